@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Benchmark for minidump_stackwalk_processor.
+
+Generates synthetic minidump_stackwalk output with a realistic amount
+of repetition in module and function names between threads and
+minidumps, parses a batch of it and keeps the resulting stack traces
+in memory, as a deduplication job would, then reports the parsing
+speed in lines per second and the memory used per stack trace and per
+frame.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import resource
+import sys
+import time
+
+import minidump_stackwalk_processor
+
+def generate_output(rng, thread_count, frame_count, module_count, function_count):
+    """ Generate the '-m' output of minidump_stackwalk for a synthetic minidump """
+    lines = ['OS|Linux|0.0.0 Linux 4.4.0-21-generic #37-Ubuntu SMP x86_64',
+             'CPU|amd64|family 6 model 61 stepping 4|4',
+             'Crash|SIGSEGV|0x0|0']
+    for i in range(module_count):
+        lines += ['Module|lib%d.so|1.0.%d|lib%d.so|%032X0|0x%08x|0x%08x|%d' %
+                  (i, i, i, i, i << 24, (i << 24) + 0xffffff, int(i == 0))]
+    lines += ['']
+    for thread_id in range(thread_count):
+        for frame_index in range(frame_count):
+            module = rng.randrange(module_count)
+            function = rng.randrange(function_count)
+            lines += ['%d|%d|lib%d.so|Namespace::Class%d::method%d(int, const char*)|src/file%d.cpp|%d|0x%x' %
+                      (thread_id, frame_index, module, function // 10, function, function // 10,
+                       rng.randrange(1000), rng.randrange(0x1000))]
+    return '\n'.join(lines) + '\n'
+
+def max_rss():
+    """ Returns the peak resident set size of this process in bytes """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage
+    return usage * 1024
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the speed of parsing minidump_stackwalk output and the memory used by the result')
+    parser.add_argument('--traces', type=int, default=1000, help='Number of stack traces to parse (default: 1000)')
+    parser.add_argument('--threads', type=int, default=20, help='Number of threads per stack trace (default: 20)')
+    parser.add_argument('--frames', type=int, default=30, help='Number of frames per thread (default: 30)')
+    parser.add_argument('--modules', type=int, default=50, help='Number of distinct modules (default: 50)')
+    parser.add_argument('--functions', type=int, default=5000, help='Number of distinct functions (default: 5000)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the generated output (default: 1)')
+    parser.add_argument('--target', type=float, action='store', dest='target_speed',
+      help='Exit with a non-zero status if fewer than this many lines per second are parsed')
+    args = parser.parse_args()
+
+    # a small set of outputs is generated up front and parsed repeatedly,
+    # so that the memory used by the output itself is not counted
+    rng = random.Random(args.seed)
+    outputs = [generate_output(rng, args.threads, args.frames, args.modules, args.functions) for i in range(10)]
+
+    baseline = max_rss()
+    start_time = time.time()
+    traces = []
+    for i in range(args.traces):
+        traces += [minidump_stackwalk_processor.Stacktrace.parse(outputs[i % len(outputs)])]
+    elapsed = time.time() - start_time
+    used = max_rss() - baseline
+
+    line_count = sum(outputs[i % len(outputs)].count('\n') for i in range(args.traces))
+    frame_count = args.traces * args.threads * args.frames
+    print('Parsed %d stack traces with %d frames' % (args.traces, frame_count))
+    print('Time: %.2f s (%.0f lines/s)' % (elapsed, line_count / elapsed))
+    print('Memory used: %.1f MB' % (used / (1024.0 * 1024.0)))
+    print('Per stack trace: %.1f KB' % (used / 1024.0 / args.traces))
+    print('Per frame: %.0f bytes' % (float(used) / frame_count))
+
+    if args.target_speed and line_count / elapsed < args.target_speed:
+        print('Parsing speed is below the target of %.0f lines/s' % args.target_speed, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
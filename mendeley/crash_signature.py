@@ -0,0 +1,278 @@
+"""
+crash_signature groups crashes by the stack of the crashing thread.
+
+A signature is generated from the top frames of the crashing thread
+of a Stacktrace parsed from minidump_stackwalk output. Each frame is
+normalized so that crashes in different builds or at slightly
+different locations of the same bug produce the same signature:
+
+ - Template arguments are collapsed to '<T>' and function parameter
+   lists and addresses are removed.
+ - Frames without symbols are replaced with the name of their module.
+ - Consecutive identical frames, from recursion or from inlined
+   functions which symbolize to the same caller, are collapsed.
+ - Leading frames which match a set of prefix patterns, such as
+   allocator, abort and exception-raising helpers, are skipped since
+   they say little about where the bug is.
+
+The normalized frames are hashed into a bucket key. A BucketIndex
+records the number of crashes and a few sample minidumps for each
+bucket, either in memory or in an SQLite database on disk, so a batch
+of minidumps can be grouped in a single pass.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import re
+import sqlite3
+import time
+
+# Default number of frames, after skipping prefix frames, which
+# make up a signature
+DEFAULT_FRAME_COUNT = 5
+
+# Default patterns for frames at the top of a crashing thread's stack
+# which are skipped. These are matched against the start of the
+# normalized function name.
+DEFAULT_PREFIX_PATTERNS = [
+    r'(__GI_)?(raise|abort)$',
+    r'__assert_fail',
+    r'__(libc|stack)_chk_fail',
+    r'__libc_message$',
+    r'(__libc_|__GI___libc_)?(malloc|calloc|realloc|free)$',
+    r'malloc_(printerr|consolidate)$',
+    r'_int_(malloc|free|realloc)$',
+    r'operator (new|delete)',
+    r'std::terminate$',
+    r'__gnu_cxx::__verbose_terminate_handler$',
+    r'__cxa_(throw|rethrow|call_unexpected)$',
+    r'qt_(assert|assert_x|message_fatal)$',
+    r'qFatal$',
+    r'QMessageLogger::fatal$',
+    r'_?CxxThrowException$',
+    r'RaiseException$',
+    r'RtlRaiseException$',
+    r'KiUserExceptionDispatcher$',
+    r'_?(invalid_parameter|invoke_watson)(_noinfo)?$',
+    r'objc_exception_throw$',
+    r'__pthread_kill$',
+    r'pthread_kill$',
+]
+
+# Default maximum number of sample minidumps recorded for each bucket
+DEFAULT_MAX_SAMPLES = 5
+
+# Name of an in-memory bucket index
+IN_MEMORY_INDEX = ':memory:'
+
+# Number of crashes added to an on-disk bucket index between commits
+COMMIT_INTERVAL = 1000
+
+ADDRESS_RE = re.compile(r'\s*\+?\s*0x[0-9a-fA-F]+')
+OPERATOR_RE = re.compile(r'operator\s*(\(\)|\[\]|<=>|<<=|>>=|<<|>>|->\*|->|&&|\|\||\+\+|--|[-+*/%^&|~!=<>,]=?)')
+ANONYMOUS_NAMESPACE = '(anonymous namespace)'
+WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_function(function):
+    """ Normalize a symbolized function name for use in a signature.
+
+    Template arguments are collapsed to '<T>', and the parameter list
+    and anything following it (eg. 'const') are removed.
+
+    >>> normalize_function('std::vector<int, std::allocator<int> >::push_back(int const&)')
+    'std::vector<T>::push_back'
+    """
+    function = ADDRESS_RE.sub('', function)
+    result = []
+    template_depth = 0
+    i = 0
+    while i < len(function):
+        if function.startswith(ANONYMOUS_NAMESPACE, i):
+            if template_depth == 0:
+                result += [ANONYMOUS_NAMESPACE]
+            i += len(ANONYMOUS_NAMESPACE)
+            continue
+
+        operator = None
+        if function.startswith('operator', i) and (i == 0 or not (function[i - 1].isalnum() or function[i - 1] == '_')):
+            operator = OPERATOR_RE.match(function, i)
+        if operator:
+            if template_depth == 0:
+                result += [operator.group(0)]
+            i = operator.end()
+            continue
+
+        char = function[i]
+        if char == '<':
+            if template_depth == 0:
+                result += ['<T>']
+            template_depth += 1
+        elif char == '>':
+            template_depth = max(template_depth - 1, 0)
+        elif char == '(' and template_depth == 0:
+            break
+        elif template_depth == 0:
+            result += [char]
+        i += 1
+
+    return WHITESPACE_RE.sub(' ', ''.join(result)).strip()
+
+def normalize_frame(frame):
+    """ Normalize a Frame for use in a signature. Frames without symbols
+    are represented by the name of their module.
+    """
+    if frame.function:
+        return normalize_function(frame.function)
+    if frame.module:
+        return '[%s]' % frame.module
+    return '[unknown]'
+
+class Signature(object):
+    """ The signature of a crash.
+
+    'frames' is the list of normalized frames and 'key' is a hash of
+    these which identifies the crash's bucket.
+    """
+    __slots__ = ('frames', 'key', 'crash_type')
+
+    def __init__(self, frames, crash_type=None):
+        self.frames = frames
+        self.crash_type = crash_type
+        text = '\n'.join(frames)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.key = hashlib.sha1(text).hexdigest()
+
+    def __str__(self):
+        return ' | '.join(self.frames)
+
+class SignatureGenerator:
+    """ Generates crash signatures from Stacktraces.
+
+    'frame_count' is the number of frames included in each signature
+    and 'prefix_patterns' is a list of regular expressions matching
+    frames at the top of the stack to skip.
+    """
+    def __init__(self, frame_count=DEFAULT_FRAME_COUNT, prefix_patterns=DEFAULT_PREFIX_PATTERNS):
+        self.frame_count = frame_count
+        self.prefix_patterns = prefix_patterns
+        self.prefix_re = None
+        if prefix_patterns:
+            self.prefix_re = re.compile('|'.join('(?:%s)' % pattern for pattern in prefix_patterns))
+
+    def signature(self, trace):
+        """ Returns the Signature of the crash in a Stacktrace, or None if
+        it does not record a crash or has no frames for the crashing thread.
+        """
+        if not trace.crash_info:
+            return None
+        frames = trace.threads.get(trace.crash_info.thread_id)
+        if not frames:
+            return None
+        return Signature(self.normalize_frames(frames), trace.crash_info.type)
+
+    def normalize_frames(self, frames):
+        """ Normalize a list of Frames from the top of a stack, skip
+        prefix frames and return the signature's list of frames.
+        """
+        normalized = []
+        for frame in frames:
+            name = normalize_frame(frame)
+            if normalized and normalized[-1] == name:
+                continue
+            normalized += [name]
+
+        # if every frame matches a prefix pattern, the prefix frames
+        # are kept rather than producing an empty signature
+        start = 0
+        if self.prefix_re:
+            while start < len(normalized) and self.prefix_re.match(normalized[start]):
+                start += 1
+            if start == len(normalized):
+                start = 0
+
+        return normalized[start:start + self.frame_count]
+
+class Bucket(object):
+    """ A group of crashes with the same signature """
+    __slots__ = ('key', 'signature', 'crash_type', 'count', 'first_seen', 'last_seen', 'samples')
+
+    def __init__(self, key, signature, crash_type, count, first_seen, last_seen, samples):
+        self.key = key
+        self.signature = signature
+        self.crash_type = crash_type
+        self.count = count
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.samples = samples
+
+class BucketIndex:
+    """ Records the number of crashes and sample minidumps for each bucket.
+
+    The index is kept in the SQLite database at 'path', or in memory if
+    'path' is IN_MEMORY_INDEX. Crashes added to an on-disk index are
+    committed in batches, so call close() when finished with it.
+    """
+    def __init__(self, path=IN_MEMORY_INDEX, max_samples=DEFAULT_MAX_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self.pending_count = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                                     key TEXT PRIMARY KEY,
+                                     signature TEXT NOT NULL,
+                                     crash_type TEXT,
+                                     count INTEGER NOT NULL,
+                                     first_seen REAL NOT NULL,
+                                     last_seen REAL NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS samples (
+                                     key TEXT NOT NULL,
+                                     dump_file TEXT NOT NULL,
+                                     PRIMARY KEY (key, dump_file))""")
+        self.connection.commit()
+
+    def add(self, signature, dump_file=None):
+        """ Add a crash with a given Signature to its bucket, recording
+        'dump_file' as a sample if the bucket has fewer than the maximum
+        number of samples.
+        """
+        now = time.time()
+        connection = self.connection
+        connection.execute('INSERT OR IGNORE INTO buckets (key, signature, crash_type, count, first_seen, last_seen) VALUES (?, ?, ?, 0, ?, ?)',
+                           (signature.key, str(signature), signature.crash_type, now, now))
+        connection.execute('UPDATE buckets SET count = count + 1, last_seen = ? WHERE key = ?', (now, signature.key))
+        if dump_file:
+            sample_count = connection.execute('SELECT COUNT(*) FROM samples WHERE key = ?', (signature.key,)).fetchone()[0]
+            if sample_count < self.max_samples:
+                connection.execute('INSERT OR IGNORE INTO samples (key, dump_file) VALUES (?, ?)', (signature.key, dump_file))
+
+        self.pending_count += 1
+        if self.pending_count >= COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """ Commit crashes added to the index """
+        self.connection.commit()
+        self.pending_count = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def buckets(self, limit=None):
+        """ Returns a list of Buckets, ordered from the most to the least crashes """
+        query = 'SELECT key, signature, crash_type, count, first_seen, last_seen FROM buckets ORDER BY count DESC, key'
+        if limit:
+            query += ' LIMIT %d' % limit
+        buckets = []
+        for key, signature, crash_type, count, first_seen, last_seen in self.connection.execute(query).fetchall():
+            samples = [row[0] for row in self.connection.execute('SELECT dump_file FROM samples WHERE key = ? ORDER BY dump_file', (key,))]
+            buckets += [Bucket(key, signature, crash_type, count, first_seen, last_seen, samples)]
+        return buckets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -5,65 +5,527 @@
 This runs the minidump_stackwalk tool to extract a stacktrace
 from a minidump and symbolize it.
 
-The output of minidump_stackwalk is then parsed and the details
-of the system where the crash occurred and stack trace of the
+The output of minidump_stackwalk is parsed as it is produced and the
+details of the system where the crash occurred and stack trace of the
 crashing thread are output.
+
+Given several minidumps, a directory or a glob pattern, the minidumps
+are processed in parallel and the results are output as each one
+completes.
+
+With --prefetch, the symbols for all of the modules in a minidump are
+fetched concurrently before the symbolized stackwalk, instead of one
+module at a time as minidump_stackwalk needs them.
+
+With --signature or --buckets, a signature is generated for each crash
+from the top frames of the crashing thread, and with --buckets crashes
+are grouped by signature in an index on disk, see crash_signature.py.
+
+With --export, the parsed stack traces are also written to a columnar
+file for bulk analysis, see stacktrace_export.py, or with
+--export-format protobuf to a stream of Breakpad ProcessStateProto
+messages, see stacktrace_proto.py.
+
+With --result-cache, the output of each stackwalk is cached, keyed by
+the content of the minidump, so that minidumps which have already been
+processed are not symbolized again unless newer symbols for one of
+their modules have since been fetched, see result_cache.py.
+
+With --metrics, the time taken by each stackwalk and the symbol cache
+lookups, requests and downloads made by fetch-symbols.py are recorded
+as JSON lines, see metrics.py, and with --metrics-summary they are
+totalled when all of the minidumps have been processed.
+
+With --serialized-symbols, symbols are fetched in the pre-parsed form
+loaded by minidump_stackwalk -f, which avoids parsing large text
+symbol files in every stackwalk, see serialized_symbols.py.
+
+With --pipeline, a batch of minidumps is processed from a single
+process which runs many stackwalks and symbol prefetches at once and
+reads their output as it arrives, rather than across a pool of worker
+processes, see stackwalk_pipeline.py.
+
+With --trim-symbols, the addresses in each module which the stackwalk
+of a minidump may look up are read from the minidump, and symbols which
+are not already cached are fetched as symbol files trimmed to the
+shards covering those addresses, if the symbol server has sharded
+copies of them, see symbol_shards.py.
 """
 
 from __future__ import print_function
 
 import argparse
+import glob
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
+import pipes
+import StringIO
 import subprocess
 import sys
+import tempfile
+import time
 
+import crash_signature
+import metrics
+import minidump_reader
 import minidump_stackwalk_processor
+import result_cache
+import stacktrace_export
+import stackwalk_pipeline
+import symbol_cache
+
+class StackwalkError(Exception):
+    """ Raised when minidump_stackwalk fails to process a minidump """
+    pass
+
+def print_frame(frame, out=sys.stdout):
+    if frame.function:
+        print('  %s' % frame.function, file=out)
+    else:
+        print('  [Unknown in %s]' % frame.module, file=out)
 
-def print_pretty_trace(trace, thread_id):
-    print('\nStacktrace for thread %s:' % (thread_id))
+def print_pretty_trace(trace, thread_id, out=sys.stdout):
+    print('\nStacktrace for thread %s:' % (thread_id), file=out)
     for frame in trace.threads[thread_id]:
-        if frame.function:
-            print('  %s' % frame.function)
-        else:
-            print('  [Unknown in %s]' % frame.module)
+        print_frame(frame, out)
+
+def print_stacktrace(trace, all_threads=False, out=sys.stdout):
+    """ Print the summary and stack trace of the crashing thread, or of
+    all threads if 'all_threads' is set or the minidump records no crash,
+    as print_stackwalk_output() does from minidump_stackwalk output
+    """
+    print_summary(trace, out)
+    thread_ids = sorted(trace.threads)
+    if trace.crash_info and trace.crash_info.thread_id in trace.threads:
+        thread_ids.remove(trace.crash_info.thread_id)
+        thread_ids.insert(0, trace.crash_info.thread_id)
+        if not all_threads:
+            thread_ids = thread_ids[:1]
+    for thread_id in thread_ids:
+        print_pretty_trace(trace, thread_id, out)
+
+def print_summary(trace, out=sys.stdout):
+    """ Print the app, crash and OS details for a stack trace """
+    if trace.main_module is None:
+        raise StackwalkError('No main module found in minidump_stackwalk output')
+    main_module = trace.modules[trace.main_module]
+    version = main_module.version or 'Unknown version'
+
+    print('App: %s (%s)' % (main_module.filename, version), file=out)
+
+    if trace.crash_info:
+        print('Crash: %s in thread %s' % (trace.crash_info.type, trace.crash_info.thread_id), file=out)
+
+    print('OS: %s %s' % (trace.os_version.platform, trace.os_version.build_id), file=out)
+
+# Default number of symbol files to fetch at once when prefetching
+DEFAULT_PREFETCH_JOBS = 16
 
-def run_stackwalk(minidump_tool, dump_file, symbol_fetch_command, verbose = False, raw = False, all_threads = False):
-    stderr_output = subprocess.PIPE
+# Formats of the file written with --export
+EXPORT_COLUMNAR = 'columnar'
+EXPORT_PROTOBUF = 'protobuf'
+EXPORT_FORMATS = [EXPORT_COLUMNAR, EXPORT_PROTOBUF]
+
+def list_modules(minidump_tool, dump_file):
+    """ List the modules loaded by the process which produced a minidump.
+
+    The module list is read directly from the minidump, see
+    minidump_reader.py. If it cannot be read, this falls back to
+    running minidump_stackwalk without symbols, which is still much
+    cheaper than a symbolized stackwalk.
+    """
+    try:
+        return minidump_reader.read_stacktrace(dump_file).modules.values()
+    except (minidump_reader.MinidumpFormatError, IOError):
+        pass
+
+    proc = subprocess.Popen([minidump_tool, '-m', dump_file],
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise StackwalkError('minidump_stackwalk exited with status %d' % proc.returncode)
+    trace = minidump_stackwalk_processor.Stacktrace.parse(stdout)
+    return trace.modules.values()
+
+def prefetch_symbols(minidump_tool, dump_file, symbol_fetch_command, jobs=DEFAULT_PREFETCH_JOBS, verbose=False):
+    """ Warm the symbol cache with the symbols for every module in a minidump.
+
+    Runs 'symbol_fetch_command' for up to 'jobs' modules at once and
+    discards the output, so that the symbol fetches made by the
+    subsequent stackwalk are served from the cache.
+    """
+    symbol_ids = set()
+    for module in list_modules(minidump_tool, dump_file):
+        if module.debug_filename and module.debug_id:
+            symbol_ids.add((module.debug_filename, module.debug_id))
+
+    devnull = open(os.devnull, 'w')
+    stderr_output = devnull
     if verbose:
         stderr_output = sys.stderr
 
-    proc = subprocess.Popen([minidump_tool, '-m', dump_file, '-e', symbol_fetch_command],
-      stdout=subprocess.PIPE, stderr=stderr_output)
-    stdout, stderr = proc.communicate()
+    def fetch(symbol_id):
+        debug_filename, debug_id = symbol_id
+        fetch_command = '%s %s %s' % (symbol_fetch_command, pipes.quote(debug_filename), pipes.quote(debug_id))
+        subprocess.call(fetch_command, shell=True, stdout=devnull, stderr=stderr_output)
+
+    pool = multiprocessing.pool.ThreadPool(min(jobs, max(len(symbol_ids), 1)))
+    try:
+        pool.map(fetch, symbol_ids)
+    finally:
+        pool.close()
+        pool.join()
+        devnull.close()
+
+def write_module_addresses(dump_file):
+    """ Write the addresses which a stackwalk of a minidump may look up
+    in each module's symbols to a temporary file, for fetch-symbols.py
+    --addresses. Returns the path of the file, which the caller should
+    remove, or None if the addresses cannot be read from the minidump.
+    """
+    try:
+        module_addresses = minidump_reader.read_module_addresses(dump_file)
+    except (minidump_reader.MinidumpFormatError, IOError):
+        return None
+    if module_addresses is None:
+        return None
+    addresses = dict(('%s/%s' % symbol_id, offsets) for symbol_id, offsets in module_addresses.items())
+    fd, path = tempfile.mkstemp(prefix='stackwalk-addresses-', suffix='.json')
+    with os.fdopen(fd, 'w') as addresses_file:
+        json.dump(addresses, addresses_file)
+    return path
+
+def print_stackwalk_output(lines, parser, raw=False, all_threads=False, out=sys.stdout, output_lines=None):
+    """ Parse and print lines of minidump_stackwalk output as they are read.
+
+    The summary is printed when the first frame is reached, followed by
+    the frames of the crashing thread, or of all threads if
+    'all_threads' is set. If 'raw' is set the lines are printed as they
+    are. Lines are also appended to 'output_lines' if it is given.
+
+    Returns True if the summary has been printed.
+    """
+    summary_printed = False
+    current_thread_id = None
+    for line in lines:
+        if output_lines is not None:
+            output_lines.append(line)
+        if raw:
+            print(line.rstrip('\n'), file=out)
+            continue
+
+        entry = parser.parse_line(line)
+        if not entry or entry[0] != minidump_stackwalk_processor.ENTRY_FRAME:
+            continue
+
+        # the system, crash and module details all precede the
+        # first frame
+        if not summary_printed:
+            print_summary(parser.stacktrace, out)
+            summary_printed = True
+
+        thread_id, frame = entry[1]
+        crash_info = parser.stacktrace.crash_info
+        if crash_info and (not all_threads) and thread_id != crash_info.thread_id:
+            continue
+        if thread_id != current_thread_id:
+            print('\nStacktrace for thread %s:' % (thread_id), file=out)
+            current_thread_id = thread_id
+        print_frame(frame, out)
+    return summary_printed
+
+def run_stackwalk(minidump_tool, dump_file, symbol_fetch_command, verbose = False, raw = False, all_threads = False,
+                  prefetch_jobs = 0, result_cache = None, metrics_log = None, serialized_symbols = False,
+                  trim_symbols = False, out=sys.stdout):
+    """ Run a symbolized stackwalk of a minidump and print the stack trace.
+
+    The output of minidump_stackwalk is parsed as it is produced, so the
+    crash details and the stack trace of the crashing thread are printed
+    before the frames of other threads have been symbolized.
+
+    If a result_cache.ResultCache is given, the output of a previous
+    stackwalk of the same minidump with the same symbols is used if
+    there is one, and otherwise the output is added to the cache.
+
+    The time taken is recorded as a 'stackwalk' event in 'metrics_log',
+    a metrics.MetricsLog.
+
+    If 'serialized_symbols' is set, 'symbol_fetch_command' must return
+    symbols serialized for FastSourceLineResolver.
 
+    If 'trim_symbols' is set, 'symbol_fetch_command' must be
+    fetch-symbols.py, which is passed the addresses the stackwalk may
+    look up in each module with --addresses.
+
+    Returns the parsed Stacktrace, which only includes the frames of
+    the crashing thread unless 'all_threads' is set, or None if 'raw'
+    is set.
+    """
+    metrics_log = metrics_log or metrics.MetricsLog()
+    start_time = time.time()
+    addresses_path = None
+    if trim_symbols:
+        addresses_path = write_module_addresses(dump_file)
+    try:
+        trace, cached = _run_stackwalk(minidump_tool, dump_file, symbol_fetch_command, verbose, raw, all_threads,
+                                       prefetch_jobs, result_cache, serialized_symbols, addresses_path, out)
+    except:
+        metrics_log.record('stackwalk', dump_file=dump_file, seconds=time.time() - start_time, cached=False,
+                           failed=True)
+        raise
+    finally:
+        if addresses_path:
+            os.remove(addresses_path)
+    metrics_log.record('stackwalk', dump_file=dump_file, seconds=time.time() - start_time, cached=cached, failed=False)
+    return trace
+
+def _run_stackwalk(minidump_tool, dump_file, symbol_fetch_command, verbose, raw, all_threads, prefetch_jobs,
+                   result_cache, serialized_symbols, addresses_path, out):
+    """ Implements run_stackwalk(). Returns a (Stacktrace, cached) tuple
+    where 'cached' is True if the result cache was used.
+    """
+    parser = minidump_stackwalk_processor.StacktraceParser(keep_all_threads=all_threads)
+
+    result_key = None
+    if result_cache:
+        result_key = result_cache.key(dump_file, '%s\n%s' % (minidump_tool, symbol_fetch_command))
+        output = result_cache.lookup(result_key)
+        if output is not None:
+            summary_printed = print_stackwalk_output(output.splitlines(True), parser, raw, all_threads, out)
+            return (_stackwalk_result(parser, summary_printed, raw, out), True)
+
+    # trimmed symbols resolve the minidump's addresses as the full
+    # symbols do, so they do not change the result cache key
+    if addresses_path:
+        symbol_fetch_command += ' --addresses %s' % pipes.quote(addresses_path)
+
+    if prefetch_jobs:
+        prefetch_symbols(minidump_tool, dump_file, symbol_fetch_command, prefetch_jobs, verbose)
+
+    # stderr is discarded rather than captured, since it is not read
+    # until minidump_stackwalk exits and could otherwise fill the pipe
+    devnull = open(os.devnull, 'w')
+    stderr_output = devnull
+    if verbose:
+        stderr_output = sys.stderr
+
+    output_lines = None
+    if result_key:
+        output_lines = []
+
+    stackwalk_args = [minidump_tool, '-m', dump_file, '-e', symbol_fetch_command]
+    if serialized_symbols:
+        stackwalk_args += ['-f']
+    proc = subprocess.Popen(stackwalk_args, stdout=subprocess.PIPE, stderr=stderr_output)
+    try:
+        summary_printed = print_stackwalk_output(minidump_stackwalk_processor.read_lines(proc.stdout), parser,
+                                                 raw, all_threads, out, output_lines)
+    except:
+        proc.kill()
+        raise
+    finally:
+        proc.wait()
+        devnull.close()
+
+    if proc.returncode != 0:
+        raise StackwalkError('minidump_stackwalk exited with status %d' % proc.returncode)
+
+    if result_key:
+        output = ''.join(output_lines)
+        if raw:
+            modules = minidump_stackwalk_processor.Stacktrace.parse(output).modules.values()
+        else:
+            modules = parser.stacktrace.modules.values()
+        result_cache.store(result_key, output, modules)
+
+    return (_stackwalk_result(parser, summary_printed, raw, out), False)
+
+def _stackwalk_result(parser, summary_printed, raw, out):
     if raw:
-        for line in stdout.splitlines():
-            print(line)
-        return
+        return None
+    if not summary_printed:
+        print_summary(parser.stacktrace, out)
+    return parser.stacktrace
 
-    trace = minidump_stackwalk_processor.Stacktrace.parse(stdout)
-    main_module = trace.modules[trace.main_module]
-    version = main_module.version or 'Unknown version'
+def find_dumps(paths):
+    """ Expand a list of minidump files, directories and glob patterns
+    into a list of minidump files.
 
-    print('App: %s (%s)' % (main_module.filename, version))
+    Directories are searched (non-recursively) for *.dmp files.
+    """
+    dump_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            dump_files += sorted(glob.glob(os.path.join(path, '*.dmp')))
+        elif os.path.exists(path):
+            dump_files += [path]
+        else:
+            dump_files += sorted(glob.glob(path))
+    return dump_files
 
-    if trace.crash_info:
-        print('Crash: %s in thread %s' % (trace.crash_info.type, trace.crash_info.thread_id))
+def print_signature(signature, out=sys.stdout):
+    if signature:
+        print('\nSignature: %s' % signature, file=out)
+    else:
+        print('\nSignature: None (no crash recorded)', file=out)
+
+def print_buckets(bucket_index, limit, out=sys.stdout):
+    """ Print the buckets with the most crashes in a BucketIndex """
+    print('\nTop crash signatures:', file=out)
+    for bucket in bucket_index.buckets(limit):
+        print('%6d  %s' % (bucket.count, bucket.signature), file=out)
+        for sample in bucket.samples:
+            print('        %s' % sample, file=out)
 
-    print('OS: %s %s' % (trace.os_version.platform, trace.os_version.build_id))
+def process_dump(job):
+    """ Run the stackwalk for one minidump in a batch.
+    Returns a (dump file, output, error, signature, stacktrace) tuple
+    where exactly one of output or error is set. The signature is only
+    generated if the job includes a SignatureGenerator.
+    """
+    minidump_tool, dump_file, symbol_fetch_command, signature_generator, options = job
+    out = StringIO.StringIO()
+    try:
+        trace = run_stackwalk(minidump_tool, dump_file, symbol_fetch_command, out=out, **options)
+        signature = None
+        if signature_generator and trace:
+            signature = signature_generator.signature(trace)
+            print_signature(signature, out)
+        return (dump_file, out.getvalue(), None, signature, trace)
+    except Exception as err:
+        return (dump_file, None, '%s: %s' % (type(err).__name__, err), None, None)
 
-    if trace.crash_info and (not all_threads):
-        print_pretty_trace(trace, trace.crash_info.thread_id)
+def run_batch(minidump_tool, dump_files, symbol_fetch_command, jobs, signature_generator=None, bucket_index=None,
+              trace_writer=None, **options):
+    """ Process a list of minidumps in parallel across a pool of 'jobs' processes.
+
+    The output for each minidump is printed as soon as it has been
+    processed, so results are not in the same order as 'dump_files'.
+    Failures are reported on stderr without stopping the batch.
+
+    If a SignatureGenerator is given, the signature of each crash is
+    printed and, if a BucketIndex is given, added to the index. If a
+    stacktrace_export.TraceWriter is given, each stack trace is
+    added to it.
+
+    Returns the number of minidumps which failed to process.
+    """
+    job_list = [(minidump_tool, dump_file, symbol_fetch_command, signature_generator, options) for dump_file in dump_files]
+    failed_count = 0
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for dump_file, output, error, signature, trace in pool.imap_unordered(process_dump, job_list):
+            if error:
+                failed_count += 1
+                print('Failed to process %s: %s' % (dump_file, error), file=sys.stderr)
+            else:
+                print('==> %s <==' % dump_file)
+                print(output)
+                if bucket_index and signature:
+                    bucket_index.add(signature, dump_file)
+                if trace_writer and trace:
+                    trace_writer.add(trace, dump_file)
+            sys.stdout.flush()
+    except:
+        pool.terminate()
+        raise
     else:
-        for key in trace.threads.keys():
-            print_pretty_trace(trace, key)
+        pool.close()
+    finally:
+        pool.join()
+    return failed_count
+
+def run_pipeline(minidump_tool, dump_files, symbol_fetch_command, jobs, signature_generator=None, bucket_index=None,
+                 trace_writer=None, raw=False, all_threads=False, prefetch_jobs=0, **options):
+    """ Process a list of minidumps with a stackwalk_pipeline.StackwalkPipeline,
+    running up to 'jobs' stackwalks and 'prefetch_jobs' symbol fetches at
+    once from this process. Results are printed, and added to
+    'bucket_index' and 'trace_writer', as in run_batch().
+
+    Returns the number of minidumps which failed to process.
+    """
+    pipeline = stackwalk_pipeline.StackwalkPipeline(minidump_tool, symbol_fetch_command, jobs, prefetch_jobs,
+                                                    all_threads=all_threads, keep_output=raw, **options)
+    failed_count = 0
+    for result in pipeline.run(dump_files):
+        if result.error:
+            failed_count += 1
+            print('Failed to process %s: %s' % (result.dump_file, result.error), file=sys.stderr)
+            continue
+        out = StringIO.StringIO()
+        trace = None
+        signature = None
+        if raw:
+            out.write(result.output)
+        else:
+            trace = result.stacktrace
+            try:
+                print_stacktrace(trace, all_threads, out)
+            except StackwalkError as err:
+                failed_count += 1
+                print('Failed to process %s: StackwalkError: %s' % (result.dump_file, err), file=sys.stderr)
+                continue
+            if signature_generator:
+                signature = signature_generator.signature(trace)
+                print_signature(signature, out)
+        print('==> %s <==' % result.dump_file)
+        print(out.getvalue())
+        if bucket_index and signature:
+            bucket_index.add(signature, result.dump_file)
+        if trace_writer and trace:
+            trace_writer.add(trace, result.dump_file)
+        sys.stdout.flush()
+    return failed_count
 
 def main():
     parser = argparse.ArgumentParser(description="Produce a stack trace from a minidump")
-    parser.add_argument('dump_file', action='store', type=str, help='Path to minidump file')
+    parser.add_argument('dump_files', action='store', type=str, nargs='+',
+      help='Path to minidump file. When more than one file, a directory or a glob pattern is given, the minidumps are processed in parallel')
+    parser.add_argument('-j', type=int, action='store', dest='jobs', default=multiprocessing.cpu_count(),
+      help='Number of minidumps to process in parallel in batch mode (default: number of CPU cores)')
     parser.add_argument('-v', action='store_true', dest='verbose', help='Display verbose output from minidump_stackwalk')
     parser.add_argument('--raw', action='store_true', dest='raw', help='Display raw output from minidump_stackwalk')
     parser.add_argument('-a', action='store_true', dest='all_threads', help='Display stacktrace for all threads')
+    parser.add_argument('--symbol-service', type=str, action='store', dest='symbol_service',
+      help='Fetch symbols from a service started with "fetch-symbols.py --listen" on this Unix socket')
+    parser.add_argument('--prefetch', action='store_true', dest='prefetch',
+      help='Fetch symbols for all modules in each minidump concurrently before the stackwalk')
+    parser.add_argument('--prefetch-jobs', type=int, action='store', dest='prefetch_jobs', default=DEFAULT_PREFETCH_JOBS,
+      help='Number of symbol files to fetch at once when prefetching (default: %d)' % DEFAULT_PREFETCH_JOBS)
+    parser.add_argument('--signature', action='store_true', dest='signature',
+      help='Display a signature for each crash generated from the top frames of the crashing thread')
+    parser.add_argument('--signature-frames', type=int, action='store', dest='signature_frames',
+      default=crash_signature.DEFAULT_FRAME_COUNT,
+      help='Number of frames in a crash signature (default: %d)' % crash_signature.DEFAULT_FRAME_COUNT)
+    parser.add_argument('--signature-prefix', type=str, action='append', dest='signature_prefixes', default=[],
+      help='Add a regular expression matching frames at the top of the stack to leave out of crash signatures, in addition to common allocator, abort and exception helpers')
+    parser.add_argument('--buckets', type=str, action='store', dest='bucket_index_path',
+      help='Group crashes by signature in an index at this path and display the signatures with the most crashes')
+    parser.add_argument('--export', type=str, action='store', dest='export_path',
+      help='Write the parsed stack traces to a columnar file at this path for bulk analysis. Only the crashing thread is included unless -a is given')
+    parser.add_argument('--export-format', type=str, action='store', dest='export_format',
+      choices=EXPORT_FORMATS, default=EXPORT_COLUMNAR,
+      help='Format of the file written with --export: a columnar file, or a stream of length-delimited ProcessStateProto messages (default: %s)' % EXPORT_COLUMNAR)
+    parser.add_argument('--top-buckets', type=int, action='store', dest='top_buckets', default=10,
+      help='Number of signatures to display with --buckets (default: 10)')
+    parser.add_argument('--result-cache', type=str, action='store', dest='result_cache_dir', nargs='?',
+      const=result_cache.DEFAULT_CACHE_ROOT,
+      help='Reuse the results of previous stackwalks of the same minidumps, cached in this directory (default: %s)' % result_cache.DEFAULT_CACHE_ROOT)
+    parser.add_argument('--symbol-cache-dir', type=str, action='store', dest='symbol_cache_dir',
+      default=symbol_cache.DEFAULT_CACHE_ROOT,
+      help='Symbol cache used by fetch-symbols.py, which cached results are checked against for newer symbols (default: %s)' % symbol_cache.DEFAULT_CACHE_ROOT)
+    parser.add_argument('--serialized-symbols', action='store_true', dest='serialized_symbols',
+      help='Fetch symbols converted to the pre-parsed form loaded by "minidump_stackwalk -f", which is much faster to load for large modules. With --symbol-service, the service must be started with "fetch-symbols.py --serialized"')
+    parser.add_argument('--trim-symbols', action='store_true', dest='trim_symbols',
+      help='Fetch symbols which are not cached as symbol files trimmed to the shards covering the addresses each minidump refers to, if the symbol server has sharded copies of them made with shard-symbols.py. Cannot be used with --symbol-service')
+    parser.add_argument('--pipeline', action='store_true', dest='pipeline',
+      help='In batch mode, run up to -j stackwalks and, with --prefetch, up to --prefetch-jobs symbol fetches at once from a single process, reading the output of all stackwalks as it arrives. -j can then be set well above the number of CPU cores. Cannot be used with --trim-symbols')
+    parser.add_argument('--metrics', type=str, action='store', dest='metrics_path',
+      help='Append the time taken by each stackwalk and by symbol fetches to this file as JSON lines. Symbol fetches are only included when fetch-symbols.py is run by minidump_stackwalk, not with --symbol-service')
+    parser.add_argument('--metrics-summary', action='store_true', dest='metrics_summary',
+      help='Display symbol cache hits and misses, bytes downloaded per symbol server, the slowest symbol fetches and the total stackwalk time once all minidumps have been processed')
     args = parser.parse_args()
     
     minidump_tool = os.environ.get('MINIDUMP_STACKWALK_PATH')
@@ -73,20 +535,137 @@ def main():
         sys.exit(1)
 
     sym_url = os.environ.get('MINIDUMP_STACKWALK_SYMBOL_URL')
-    if not sym_url:
+    if not sym_url and not args.symbol_service:
         print("""MINIDUMP_STACKWALK_SYMBOL_URL not set. This should be set to the URL
               where debug symbols are hosted.""")
         sys.exit(1)
 
-    alt_names_config_file = '%s/alternate-debug-file-names.json' % (os.path.dirname(os.path.abspath(__file__)))
+    if args.symbol_service and args.trim_symbols:
+        parser.error('--trim-symbols cannot be used with --symbol-service')
+    if args.pipeline and args.trim_symbols:
+        parser.error('--trim-symbols cannot be used with --pipeline')
+
+    if args.symbol_service:
+        sym_fetch_tool = os.path.abspath(os.path.dirname(__file__) + '/fetch-symbols-client.py')
+        sym_fetch_command = '%s \"%s\"' % (sym_fetch_tool, args.symbol_service)
+    else:
+        alt_names_config_file = '%s/alternate-debug-file-names.json' % (os.path.dirname(os.path.abspath(__file__)))
+
+        sym_fetch_tool = os.path.abspath(os.path.dirname(__file__) + '/fetch-symbols.py')
+        sym_fetch_command = '%s -a %s -s \"%s\"' % (sym_fetch_tool, alt_names_config_file, sym_url)
+        if args.serialized_symbols:
+            sym_fetch_command += ' --serialized'
+
+    prefetch_jobs = 0
+    if args.prefetch:
+        prefetch_jobs = args.prefetch_jobs
+
+    signature_generator = None
+    bucket_index = None
+    if args.signature or args.bucket_index_path:
+        signature_generator = crash_signature.SignatureGenerator(args.signature_frames,
+          crash_signature.DEFAULT_PREFIX_PATTERNS + args.signature_prefixes)
+    if args.bucket_index_path:
+        bucket_index = crash_signature.BucketIndex(args.bucket_index_path)
+
+    export_file = None
+    trace_writer = None
+    if args.export_path:
+        export_file = open(args.export_path, 'wb')
+        if args.export_format == EXPORT_PROTOBUF:
+            # the protobuf runtime is only imported when needed
+            import stacktrace_proto
+            trace_writer = stacktrace_proto.ProtoTraceWriter(export_file)
+        else:
+            trace_writer = stacktrace_export.TraceWriter(export_file)
+
+    stackwalk_results = None
+    if args.result_cache_dir:
+        stackwalk_results = result_cache.ResultCache(args.result_cache_dir, symbol_cache.SymbolCache(args.symbol_cache_dir))
+
+    dump_files = find_dumps(args.dump_files)
+    if len(dump_files) == 0:
+        print('No minidumps found', file=sys.stderr)
+        sys.exit(1)
+
+    # metrics are written to a temporary file if only a summary is wanted
+    start_time = time.time()
+    metrics_path = args.metrics_path
+    temp_metrics_path = None
+    if args.metrics_summary and not metrics_path:
+        fd, temp_metrics_path = tempfile.mkstemp(prefix='stackwalk-metrics-', suffix='.jsonl')
+        os.close(fd)
+        metrics_path = temp_metrics_path
+    metrics_log = metrics.MetricsLog(metrics_path)
+    if metrics_path:
+        os.environ[metrics.METRICS_PATH_VARIABLE] = os.path.abspath(metrics_path)
 
-    sym_fetch_tool = os.path.abspath(os.path.dirname(__file__) + '/fetch-symbols.py')
-    sym_fetch_command = '%s -a %s -s \"%s\"' % (sym_fetch_tool, alt_names_config_file, sym_url)
+    if len(dump_files) == 1 and not os.path.isdir(args.dump_files[0]):
+        trace = None
+        failed_count = 0
+        try:
+            trace = run_stackwalk(minidump_tool, dump_files[0], sym_fetch_command,
+              verbose=args.verbose,
+              raw=args.raw,
+              all_threads=args.all_threads,
+              prefetch_jobs=prefetch_jobs,
+              result_cache=stackwalk_results,
+              metrics_log=metrics_log,
+              serialized_symbols=args.serialized_symbols,
+              trim_symbols=args.trim_symbols)
+        except StackwalkError as err:
+            print('Failed to process %s: %s' % (dump_files[0], err), file=sys.stderr)
+            failed_count = 1
+        if signature_generator and trace:
+            signature = signature_generator.signature(trace)
+            print_signature(signature)
+            if bucket_index and signature:
+                bucket_index.add(signature, dump_files[0])
+        if trace_writer and trace:
+            trace_writer.add(trace, dump_files[0])
+    elif args.pipeline:
+        failed_count = run_pipeline(minidump_tool, dump_files, sym_fetch_command, args.jobs,
+          signature_generator=signature_generator,
+          bucket_index=bucket_index,
+          trace_writer=trace_writer,
+          verbose=args.verbose,
+          raw=args.raw,
+          all_threads=args.all_threads,
+          prefetch_jobs=prefetch_jobs,
+          result_cache=stackwalk_results,
+          metrics_log=metrics_log,
+          serialized_symbols=args.serialized_symbols)
+        print('Processed %d minidumps, %d failed' % (len(dump_files), failed_count), file=sys.stderr)
+    else:
+        failed_count = run_batch(minidump_tool, dump_files, sym_fetch_command, args.jobs,
+          signature_generator=signature_generator,
+          bucket_index=bucket_index,
+          trace_writer=trace_writer,
+          verbose=args.verbose,
+          raw=args.raw,
+          all_threads=args.all_threads,
+          prefetch_jobs=prefetch_jobs,
+          result_cache=stackwalk_results,
+          metrics_log=metrics_log,
+          serialized_symbols=args.serialized_symbols,
+          trim_symbols=args.trim_symbols)
+        print('Processed %d minidumps, %d failed' % (len(dump_files), failed_count), file=sys.stderr)
+
+    if bucket_index:
+        print_buckets(bucket_index, args.top_buckets)
+        bucket_index.close()
+
+    if trace_writer:
+        trace_writer.close()
+        export_file.close()
 
-    run_stackwalk(minidump_tool, args.dump_file, sym_fetch_command,
-      verbose=args.verbose,
-      raw=args.raw,
-      all_threads=args.all_threads)
+    if args.metrics_summary:
+        metrics.print_summary(metrics.Summary(metrics.read_events(metrics_path, since=start_time)))
+    if temp_metrics_path:
+        os.remove(temp_metrics_path)
+
+    if failed_count > 0:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
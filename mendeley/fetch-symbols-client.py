@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# This is a minimal client for the symbol service started with
+# 'fetch-symbols.py --listen <socket path>', for use with
+# minidump_stackwalk's '-e' option:
+#
+#   minidump_stackwalk -m -e 'fetch-symbols-client.py <socket path>' <dump>
+#
+# It follows the same contract as fetch-symbols.py, printing the
+# symbol file to stdout and exiting with status 0 if symbols were
+# found or 1 if they were not or were only partially received, in
+# which case minidump_stackwalk discards the output. If the service
+# cannot be reached it exits with status 127 so that minidump_stackwalk
+# treats the module as interrupted rather than caching it as missing.
+#
+# Only modules which are cheap to import are used here, since the
+# point of the service is to avoid per-module startup costs.
+
+import socket
+import sys
+
+# Status line sent by the symbol service when symbols were found.
+# See SymbolRequestHandler in fetch-symbols.py
+SERVICE_FOUND = 'FOUND'
+
+def main():
+    if len(sys.argv) != 4:
+        sys.stderr.write('usage: %s <socket path> <debug file name> <debug id>\n' % (sys.argv[0]))
+        sys.exit(2)
+
+    socket_path, debug_file_name, debug_id = sys.argv[1:]
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as err:
+        sys.stderr.write('Unable to connect to symbol service at %s: %s\n' % (socket_path, err))
+        sys.exit(127)
+
+    sock.sendall('%s\n%s\n' % (debug_file_name, debug_id))
+    reply = sock.makefile('rb')
+    status = reply.readline().rstrip('\n')
+    if status != SERVICE_FOUND:
+        sys.exit(1)
+
+    # the symbol file is sent in chunks, each preceded by its length,
+    # and terminated by an empty chunk
+    while True:
+        length = reply.readline()
+        if not length:
+            sys.stderr.write('Incomplete symbol file received from symbol service\n')
+            sys.exit(1)
+        length = int(length)
+        if length == 0:
+            break
+        data = reply.read(length)
+        if len(data) != length:
+            sys.stderr.write('Incomplete symbol file received from symbol service\n')
+            sys.exit(1)
+        sys.stdout.write(data)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -9,21 +9,44 @@
 # Given a binary name and build ID, it will fetch symbols
 # from $SERVER_URL/$BINARY_NAME/$BUILD_ID/$BINARY_BASENAME.sym
 # and cache them locally in a temporary directory to speed
-# up future requests.
+# up future requests. The size of the cache is bounded, see
+# symbol_cache.py
+#
+# When started with '--listen <socket path>' it instead runs as a
+# long-lived symbol service which answers requests from
+# fetch-symbols-client.py over a local Unix socket. This avoids
+# paying interpreter startup and config loading for every module
+# that minidump_stackwalk looks up.
+#
+# With '--serialized' the symbols are instead output in the binary
+# form loaded by 'minidump_stackwalk -f', see serialized_symbols.py.
+# Each symbol file is converted once and the result is cached.
+#
+# With '--addresses <file>', where the file lists the addresses a
+# minidump refers to in each module, only the shards of the symbol file
+# needed to look up those addresses are fetched, if the symbol server
+# has a sharded copy of it, and they are output as a trimmed symbol
+# file. See symbol_shards.py and extract-stacktrace.py --trim-symbols.
 
 from __future__ import print_function
-from distutils.dir_util import mkpath
 
+import Queue
+import SocketServer
 import argparse
+import cStringIO
 import json
+import multiprocessing.pool
 import urllib2
 import os
-import tempfile
+import threading
 import time
 import sys
 
-# path to local symbol cache for faster retrieval in future
-CACHE_ROOT = '%s/%s' % (tempfile.gettempdir(), 'symbol-cache')
+import metrics
+import serialized_symbols
+import symbol_cache
+import symbol_http
+import symbol_shards
 
 # TODO - For Windows binaries, attempt to fetch from the Microsoft symbol server
 # if symbols are not found in our own symbol server.
@@ -41,77 +64,632 @@ CACHE_ROOT = '%s/%s' % (tempfile.gettempdir(), 'symbol-cache')
 # MSFT_SYMBOL_SERVER_URL = 'http://msdl.microsoft.com/download/symbols'
 # MSFT_SYMBOL_STORE_USER_AGENT = "Microsoft-Symbol-Server/10.0.0.0"
 
-# Length of time to remember failed cache lookups for in seconds
-MAX_MISSING_CACHE_AGE = 300
+# Default length of time in seconds to wait for a symbol server to
+# respond before giving up on it
+DEFAULT_REQUEST_TIMEOUT = 30
+
+# Number of shards of a symbol file to fetch at once
+SHARD_FETCH_JOBS = 8
+
+# Length of time in seconds to wait for the threads of cancelled
+# requests to finish once a lookup is over
+CANCEL_JOIN_TIMEOUT = 1
+
+# Returned by open_symbols() when a conditional request finds
+# that cached symbols are up to date
+NOT_MODIFIED = object()
+
+# Returned by open_symbols() for a request which was cancelled, and
+# recorded for requests which finished after another server had
+# already returned a symbol file
+CANCELLED = object()
 
-def cache_entry_path(symfile_path):
-    cache_path = '%s/%s' % (CACHE_ROOT, symfile_path)
-    return cache_path
+def open_symbols(http, symbol_url, cached_source=None, group=None):
+    """ Start downloading a symbol file from a symbol server using the
+    connection pool 'http'.
 
-def lookup_in_cache(symfile_path):
-    """ Looks up debug symbols in the local cache.
-    Returns:
-     - The string contents of the cached symbols if they exist
-     - A number indicating the time in seconds since a lookup last failed
-       if a previous failed lookup has been cached
-     - None if no cached successful or failed lookup exists
+    If 'cached_source' is an EntrySource for a cached copy of the symbol
+    file, a conditional request is made using its validators. 'group' is
+    an optional symbol_http.RequestGroup which the request is made in.
+
+    Returns a (response, first chunk, source) tuple once the first chunk
+    of a valid symbol file has been received, where 'source' is an
+    EntrySource for the symbol file. The caller is responsible for reading
+    the rest of the response or closing it. Returns NOT_MODIFIED if the
+    cached copy is up to date, CANCELLED if the request was cancelled
+    through 'group', or None if the symbol file was not found or is not
+    valid.
     """
-    cache_path = cache_entry_path(symfile_path)
-    if os.path.exists(cache_path):
-        cache_file = open(cache_path, 'r')
-        data = cache_file.read()
-        module_line = data.split('\n', 1)[0]
-
-        if 'MODULE' in module_line:
-            return data
+    headers = {}
+    if cached_source:
+        if cached_source.etag:
+            headers['If-None-Match'] = cached_source.etag
+        if cached_source.last_modified:
+            headers['If-Modified-Since'] = cached_source.last_modified
+
+    try:
+        url_reply = http.get(symbol_url, headers, group)
+        try:
+            if url_reply.status == 304:
+                url_reply.read()
+                return NOT_MODIFIED
+            source = symbol_cache.EntrySource(symbol_url,
+                                              url_reply.getheader('etag'),
+                                              url_reply.getheader('last-modified'))
+            data = url_reply.read(symbol_cache.CHUNK_SIZE)
+        except:
+            url_reply.close()
+            raise
+    except symbol_http.HTTPError as err:
+        if err.status == 404:
+            print('Not found: %s' % (symbol_url), file=sys.stderr)
         else:
-            cache_age = time.time() - os.path.getmtime(cache_path)
-            return cache_age
-    else:
+            print('Error fetching %s: %s' % (symbol_url, err), file=sys.stderr)
+        return None
+    except symbol_http.CONNECTION_ERRORS as err:
+        if group and group.cancelled:
+            return CANCELLED
+        print('Error fetching %s: %s' % (symbol_url, err), file=sys.stderr)
+        return None
+
+    if not data.startswith('MODULE'):
+        print('Invalid symbol file: %s' % (symbol_url), file=sys.stderr)
+        url_reply.close()
         return None
+    return (url_reply, data, source)
 
-def update_cache(symfile_path, symbols):
-    """ Save breakpad debug symbols to the local cache.
-    If symbols is None, a dummy entry is created in the cache
-    to record the last time when a lookup failed.
+class SymbolDownload:
+    """ File-like object which reads a symbol file as it is downloaded
+    and copies it into the cache at the same time.
+
+    The download is only added to the cache once it has been read to the
+    end. If it is closed early or fails, the partial entry is discarded.
+    'lock' is an EntryLock which is held until the download is finished.
+
+    Completed downloads are recorded in 'metrics_log' as 'download'
+    events, timed from 'start_time'.
     """
-    cache_path = cache_entry_path(symfile_path)
-    mkpath(os.path.dirname(cache_path))
-    if symbols:
-        # save to local cache for future use
-        cache_file = open(cache_path, 'w')
-        cache_file.write(symbols)
-        cache_file.close()
-    else:
-        # write a dummy file to indicate a failed cache lookup
-        symbols_missing_file = open(cache_path, 'w')
-        symbols_missing_file.write('No symbols found')
-        symbols_missing_file.close()
-
-def lookup_symbols(debug_file_name, symfile_path, symbol_servers):
-    symbols_found = False
-    for server in symbol_servers:
-        symbol_url = '%s/%s' % (server, urllib2.quote(symfile_path))
-        print('Symbols for %s not found in cache, fetching from %s' % (debug_file_name, symbol_url), file=sys.stderr)
-        
-        try:
-            url_req = urllib2.Request(symbol_url)
-            url_reply = urllib2.urlopen(url_req)
-            data = url_reply.read()
-            update_cache(symfile_path, data)
-            symbols_found = True
-            return data
-        except urllib2.HTTPError as err:
-            if err.code == 404:
-                print('Not found: %s' % (symbol_url), file=sys.stderr)
+    def __init__(self, response, first_chunk, writer, lock=None, metrics_log=None, server=None, start_time=None):
+        self.response = response
+        self.pending = first_chunk
+        self.writer = writer
+        self.lock = lock
+        self.finished = False
+        self.metrics_log = metrics_log or metrics.MetricsLog()
+        self.server = server
+        self.start_time = start_time or time.time()
+        self.size = 0
+
+    def read(self, size=symbol_cache.CHUNK_SIZE):
+        if self.finished:
+            return ''
+        if self.pending:
+            data = self.pending
+            self.pending = ''
+        else:
+            data = self.response.read(size)
+
+        if data:
+            self.writer.write(data)
+            self.size += len(data)
+        else:
+            self.finished = True
+            try:
+                self.writer.commit()
+            finally:
+                self._release()
+            self.metrics_log.record('download', server=self.server, path=self.writer.symfile_path,
+                                    bytes=self.size, seconds=time.time() - self.start_time)
+        return data
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.response.close()
+            self.writer.abort()
+            self._release()
+
+    def _release(self):
+        if self.lock:
+            self.lock.release()
+            self.lock = None
+
+def load_alternate_names(alternate_name_map):
+    """ Load the config file mapping debug file names to alternative names """
+    if not alternate_name_map:
+        return {}
+    alt_name_file = open(alternate_name_map, 'r')
+    alt_names = json.load(alt_name_file)
+    alt_name_file.close()
+    return alt_names
+
+def load_addresses(addresses_path, debug_file_name, debug_id):
+    """ Returns the addresses listed for a module in a file written by
+    extract-stacktrace.py --trim-symbols, or None if it is not listed.
+
+    The file is a JSON object mapping '<debug file name>/<debug ID>'
+    to a list of addresses relative to the module base.
+    """
+    with open(addresses_path, 'r') as addresses_file:
+        addresses = json.load(addresses_file)
+    return addresses.get('%s/%s' % (debug_file_name, debug_id))
+
+def write_symbols(symbols, out):
+    """ Copy symbols returned by SymbolFetcher.fetch() to the file object
+    'out' in chunks and close them.
+    """
+    try:
+        while True:
+            data = symbols.read(symbol_cache.CHUNK_SIZE)
+            if not data:
+                break
+            out.write(data)
+    finally:
+        symbols.close()
+
+class SymbolFetcher:
+    """ Fetches debug symbols for binaries from the cache or the symbol servers.
+
+    'http' is the symbol_http.ConnectionPool used to query the symbol
+    servers. If 'revalidate_age' is set, cached symbols which were last
+    validated more than that many seconds ago are revalidated with a
+    conditional request to the server they were fetched from.
+
+    Cache lookups and requests are recorded in 'metrics_log', a
+    metrics.MetricsLog.
+
+    If 'serialized' is set, symbols are returned in the serialized form
+    loaded by FastSourceLineResolver instead of as text symbol files.
+    """
+    def __init__(self, symbol_servers, alt_names, cache, http, revalidate_age=None, metrics_log=None,
+                 serialized=False):
+        self.symbol_servers = symbol_servers
+        self.alt_names = alt_names
+        self.cache = cache
+        self.http = http
+        self.revalidate_age = revalidate_age
+        self.metrics_log = metrics_log or metrics.MetricsLog()
+        self.serialized = serialized
+
+    def _candidates(self, debug_file_name, debug_id):
+        """ Returns (debug file name, symbol file path) pairs for the
+        debug file name and each of its alternative names
+        """
+        debug_file_names = []
+        debug_file_names += [debug_file_name]
+        if debug_file_name in self.alt_names:
+            debug_file_names += self.alt_names[debug_file_name]
+
+        candidates = []
+        for debug_file_name in debug_file_names:
+            if debug_file_name.endswith('.pdb'):
+                symfile_name = debug_file_name[0:-4] + '.sym'
             else:
-                print('Error fetching %s: %s' % (symbol_url, err))
+                symfile_name = debug_file_name + '.sym'
+
+            symfile_path = '%s/%s/%s' % (debug_file_name, debug_id, symfile_name)
+            candidates += [(debug_file_name, symfile_path)]
+        return candidates
+
+    def fetch(self, debug_file_name, debug_id, addresses=None):
+        """ Fetch debug symbols for a binary.
+        Returns a file-like object for reading the symbol file, which should
+        be passed to write_symbols(), or None if no symbols were found under
+        the debug file name or any of its alternative names.
+
+        If 'addresses' is given and the symbol file is not already cached,
+        a symbol file trimmed to the shards needed to look up those
+        addresses is returned instead, if the symbol servers have them.
+        """
+        candidates = self._candidates(debug_file_name, debug_id)
+        if addresses is not None:
+            symbols = self._fetch_trimmed(debug_file_name, debug_id, candidates, addresses)
+            if symbols and self.serialized:
+                # trimmed symbols are only converted for this fetch
+                data = self._convert(debug_file_name, debug_id, symbols)
+                if data is None:
+                    return None
+                return cStringIO.StringIO(data)
+            if symbols:
+                return symbols
+        symbols = self._fetch_symbol_file(debug_file_name, debug_id, candidates)
+        if symbols and self.serialized:
+            return self._serialize(debug_file_name, debug_id, candidates[0][1], symbols)
+        return symbols
+
+    def _fetch_symbol_file(self, module, debug_id, candidates, record_lookup=True):
+        """ Fetch the text symbol file for one of the candidates returned
+        by _candidates()
+
+        The cache lookup is recorded as a 'cache_lookup' event unless
+        'record_lookup' is False.
+        """
+        cache = self.cache
+        def lookup_done(hit):
+            if record_lookup:
+                self.metrics_log.record('cache_lookup', module=module, debug_id=debug_id, hit=hit)
+
+        # For each of the debug file names, first try the cache
+        for debug_file_name, symfile_path in candidates:
+            cached_symbols = cache.lookup(symfile_path)
+            if cached_symbols:
+                lookup_done(True)
+                return self._revalidate(symfile_path, cached_symbols)
+
+        # If that fails, query the symbol servers specified on the command
+        # line for all of the remaining debug file names at once. If another
+        # fetcher is already doing that, wait for it and use its result.
+        # A successful download holds the lock until it has been read
+        lock = cache.lock_entry(candidates[0][1])
+        lock.acquire()
+        try:
+            for debug_file_name, symfile_path in candidates:
+                cached_symbols = cache.lookup(symfile_path)
+                if cached_symbols:
+                    lock.release()
+                    lookup_done(True)
+                    return cached_symbols
+
+            lookup_done(False)
+            symbols = self._lookup(candidates, lock)
+            if not symbols:
+                lock.release()
+            return symbols
+        except:
+            lock.release()
+            raise
+
+    def _serialize(self, debug_file_name, debug_id, symfile_path, symbols):
+        """ Returns a file-like object for reading the serialized form
+        of 'symbols', the symbol file for a binary.
+
+        Serialized symbols are cached under the binary's own debug file
+        name, whichever name the symbol file was found under. They are
+        reused unless the symbol file has been fetched or replaced in the
+        cache since they were serialized. Returns None if the symbol file
+        cannot be serialized.
+        """
+        serialized_path = symfile_path + symbol_cache.SERIALIZED_SUFFIX
+        if not isinstance(symbols, SymbolDownload):
+            stored_at = self.cache.stored_at(serialized_path)
+            if stored_at and stored_at >= self.cache.symbols_stored_at(debug_id):
+                serialized = self.cache.lookup(serialized_path)
+                if serialized:
+                    symbols.close()
+                    return serialized
+
+        data = self._convert(debug_file_name, debug_id, symbols)
+        if data is None:
+            return None
+        self.cache.update(serialized_path, data)
+        return cStringIO.StringIO(data)
+
+    def _convert(self, debug_file_name, debug_id, symbols):
+        """ Returns the serialized form of 'symbols', or None if they
+        cannot be serialized
+        """
+        start_time = time.time()
+        symbol_data = cStringIO.StringIO()
+        write_symbols(symbols, symbol_data)
+        try:
+            data = serialized_symbols.serialize(symbol_data.getvalue())
+        except serialized_symbols.SerializedSymbolsError as err:
+            print('Unable to serialize symbols for %s: %s' % (debug_file_name, err), file=sys.stderr)
+            return None
+        self.metrics_log.record('serialize', module=debug_file_name, debug_id=debug_id, bytes=len(data),
+                                seconds=time.time() - start_time)
+        return data
 
-    if not symbols_found:
-        # If none of the symbol servers had debug symbols for this binary,
-        # cache the failed lookup to speed up processing of other reports
-        # that reference the same report
-        update_cache(symfile_path, None)
+    def _fetch_trimmed(self, module, debug_id, candidates, addresses):
+        """ Fetch the shards of the symbol file for one of the candidates
+        returned by _candidates() which are needed to look up 'addresses',
+        and join them into a trimmed symbol file.
+
+        Each shard, and the index of the shards, is fetched and cached
+        like a symbol file, but the fetch is recorded only as a 'trim'
+        event rather than as a cache lookup per shard. The index is looked
+        up for all of the candidates at once. Returns None if the full
+        symbol file is already cached, or if the shards are not available,
+        in which case the full symbol file should be fetched instead.
+
+        Servers without shards are recorded as missing the index, so while
+        the failed lookups are cached no further requests are made for
+        it, and the fetch goes straight to the full symbol file.
+        """
+        for debug_file_name, symfile_path in candidates:
+            if self.cache.contains(symfile_path):
+                return None
+
+        index_candidates = [(debug_file_name, '%s%s/%s' % (symfile_path, symbol_shards.SHARDS_SUFFIX,
+                                                           symbol_shards.INDEX_NAME))
+                            for debug_file_name, symfile_path in candidates]
+        if all(self.cache.is_missing(index_path, server)
+               for debug_file_name, index_path in index_candidates for server in self.symbol_servers):
+            return None
+
+        start_time = time.time()
+        index_data = self._read_entry(module, debug_id, index_candidates)
+        if index_data is None:
+            return None
+        # the index which was found is now cached
+        for (debug_file_name, symfile_path), (_, index_path) in zip(candidates, index_candidates):
+            if self.cache.contains(index_path):
+                break
+        try:
+            index = symbol_shards.ShardIndex.parse(index_data)
+        except symbol_shards.SymbolShardsError as err:
+            print('Invalid shard index for %s: %s' % (symfile_path, err), file=sys.stderr)
+            return None
+
+        shards_path = symfile_path + symbol_shards.SHARDS_SUFFIX
+        positions = index.select_shards(addresses)
+        def fetch(position):
+            return self._read_entry(module, debug_id,
+                                    [(debug_file_name, '%s/%s' % (shards_path, symbol_shards.shard_name(position)))])
+        pool = multiprocessing.pool.ThreadPool(min(SHARD_FETCH_JOBS, max(len(positions), 1)))
+        try:
+            shards = pool.map(fetch, positions)
+        finally:
+            pool.close()
+            pool.join()
+        if None in shards:
+            print('Unable to fetch all shards for %s' % (symfile_path), file=sys.stderr)
+            return None
+
+        data = symbol_shards.assemble(index, shards)
+        self.metrics_log.record('trim', module=module, debug_id=debug_id, shards=len(positions),
+                                total_shards=len(index.shards), bytes=len(data),
+                                seconds=time.time() - start_time)
+        return cStringIO.StringIO(data)
+
+    def _read_entry(self, module, debug_id, candidates):
+        """ Fetch a single symbol file, or part of one, for one of the
+        (debug file name, path) pairs in 'candidates' from the cache or
+        the symbol servers and return its contents, or None if it was
+        not found
+        """
+        symbols = self._fetch_symbol_file(module, debug_id, candidates, record_lookup=False)
+        if not symbols:
+            return None
+        data = cStringIO.StringIO()
+        write_symbols(symbols, data)
+        return data.getvalue()
+
+    def _lookup(self, candidates, lock):
+        """ Query all of the symbol servers for all of the candidate symbol
+        files at once.
+
+        'candidates' is a list of (debug file name, symbol file path) pairs
+        in order of preference. A valid symbol file for a candidate is
+        used once every request for the candidates before it has failed,
+        so the symbol file for the binary's own debug file name is
+        preferred to those for its alternative names, as when the
+        candidates were tried one after another. The symbol file is
+        returned as a SymbolDownload which saves it to the cache as it is
+        read, and the remaining requests are cancelled. If no server has
+        any of the candidates, None is returned.
+
+        Each failed request is recorded in the cache, and requests to
+        servers where a lookup of the same candidate failed recently
+        are skipped. The threads of cancelled requests are given up to
+        CANCEL_JOIN_TIMEOUT seconds to finish before returning.
+        """
+        results = Queue.Queue()
+        requests = symbol_http.RequestGroup()
+        request_threads = []
+        finished = []
+        finished_lock = threading.Lock()
+
+        def fetch(index, symfile_path, server, symbol_url):
+            download = None
+            start_time = time.time()
+            try:
+                download = open_symbols(self.http, symbol_url, group=requests)
+                if download is None:
+                    # cache the failed lookup to speed up processing of
+                    # other reports that reference the same binary. This
+                    # is done here rather than by the lookup, which may
+                    # have returned before this request failed
+                    self.cache.record_missing(symfile_path, server)
+            finally:
+                self._record_request(server, symbol_url, download, start_time)
+                with finished_lock:
+                    if finished:
+                        # another server has already returned a symbol
+                        # file, so this request was cancelled or this
+                        # server has a symbol file which is not used
+                        if download and download is not CANCELLED:
+                            download[0].close()
+                    else:
+                        results.put((index, download, server, start_time))
+
+        request_counts = [0] * len(candidates)
+        skipped_count = 0
+        for index, (debug_file_name, symfile_path) in enumerate(candidates):
+            for server in self.symbol_servers:
+                symbol_url = '%s/%s' % (server, urllib2.quote(symfile_path))
+                retry_time = self.cache.is_missing(symfile_path, server)
+                if retry_time:
+                    print('Symbols for %s not found in cache and lookup on %s failed recently, retrying in %d seconds' %
+                          (debug_file_name, server, retry_time), file=sys.stderr)
+                    self.metrics_log.record('negative_cache_hit', module=debug_file_name, server=server,
+                                            retry_in=retry_time)
+                    skipped_count += 1
+                    continue
+
+                print('Symbols for %s not found in cache, fetching from %s' % (debug_file_name, symbol_url), file=sys.stderr)
+                request_thread = threading.Thread(target=fetch, args=(index, symfile_path, server, symbol_url))
+                request_thread.daemon = True
+                request_thread.start()
+                request_threads.append(request_thread)
+                request_counts[index] += 1
+
+        self.cache.add_to_counter('requests', sum(request_counts))
+        self.cache.add_to_counter('requests_skipped', skipped_count)
+
+        # the preferred symbol file found so far, as a (candidate index,
+        # (response, first chunk, source), server, start time) tuple
+        best = None
+        pending = list(request_counts)
+        while sum(pending):
+            result = results.get()
+            index, download = result[:2]
+            pending[index] -= 1
+            if download:
+                if best is None or index < best[0]:
+                    if best:
+                        best[1][0].close()
+                    best = result
+                else:
+                    download[0].close()
+            if best and not sum(pending[:best[0]]):
+                break
+
+        with finished_lock:
+            finished.append(True)
+            requests.cancel(keep=best[1][0] if best else None)
+            # close the responses of servers which lost the race
+            while not results.empty():
+                download = results.get()[1]
+                if download:
+                    download[0].close()
+
+        # the cancelled requests fail quickly, and are waited for so that
+        # they are not left writing to the cache after the lookup
+        deadline = time.time() + CANCEL_JOIN_TIMEOUT
+        for request_thread in request_threads:
+            request_thread.join(max(deadline - time.time(), 0))
+
+        if not best:
+            return None
+        index, (response, first_chunk, source), server, start_time = best
+        writer = self.cache.open_writer(candidates[index][1], source)
+        return SymbolDownload(response, first_chunk, writer, lock, self.metrics_log, server, start_time)
+
+    def _revalidate(self, symfile_path, cached_symbols):
+        """ Check that cached symbols are up to date with the server they
+        were fetched from if they are due to be revalidated.
+        Returns a file-like object for reading the up to date symbols.
+        """
+        if self.revalidate_age is None:
+            return cached_symbols
+        source = self.cache.source(symfile_path)
+        if not source or not (source.etag or source.last_modified):
+            return cached_symbols
+        if source.validated_at and time.time() - source.validated_at < self.revalidate_age:
+            return cached_symbols
+
+        # requests are recorded against the configured server the
+        # symbols came from, if it is still in use
+        server = source.url
+        for symbol_server in self.symbol_servers:
+            if source.url.startswith(symbol_server + '/'):
+                server = symbol_server
+
+        start_time = time.time()
+        download = open_symbols(self.http, source.url, source)
+        self._record_request(server, source.url, download, start_time)
+        if download is NOT_MODIFIED:
+            self.cache.mark_validated(symfile_path)
+            return cached_symbols
+        elif download:
+            print('Symbols for %s changed on %s' % (symfile_path, source.url), file=sys.stderr)
+            cached_symbols.close()
+            response, first_chunk, new_source = download
+            writer = self.cache.open_writer(symfile_path, new_source)
+            return SymbolDownload(response, first_chunk, writer, metrics_log=self.metrics_log, server=server,
+                                  start_time=start_time)
+        else:
+            # keep using the cached symbols if the server is unavailable
+            return cached_symbols
+
+    def _record_request(self, server, symbol_url, download, start_time):
+        if download is NOT_MODIFIED:
+            status = 'not_modified'
+        elif download is CANCELLED:
+            status = 'cancelled'
+        elif download:
+            status = 'found'
+        else:
+            status = 'not_found'
+        self.metrics_log.record('request', server=server, url=symbol_url, status=status,
+                                seconds=time.time() - start_time)
+
+    def record_fetch(self, debug_file_name, debug_id, found, start_time):
+        """ Record a fetch of symbols for a module which started at
+        'start_time' and has finished delivering the symbols
+        """
+        self.metrics_log.record('fetch', module=debug_file_name, debug_id=debug_id, found=found,
+                                seconds=time.time() - start_time)
+
+# Status lines sent by the symbol service before the symbol data
+SERVICE_FOUND = 'FOUND'
+SERVICE_NOT_FOUND = 'NOT_FOUND'
+
+class SymbolRequestHandler(SocketServer.StreamRequestHandler):
+    """ Handles a single request from fetch-symbols-client.py.
+
+    The request consists of the debug file name and debug ID, each
+    on its own line. The reply is a status line (SERVICE_FOUND or
+    SERVICE_NOT_FOUND) followed by the contents of the symbol file.
+
+    Since symbol files are streamed to the client while they are being
+    downloaded, the contents are sent as a sequence of chunks, each
+    preceded by a line with its length in bytes, and terminated by an
+    empty chunk. A client which does not receive the terminating chunk
+    knows that the symbol file is incomplete.
+    """
+    def handle(self):
+        debug_file_name = self.rfile.readline().rstrip('\n')
+        debug_id = self.rfile.readline().rstrip('\n')
+        if not debug_file_name or not debug_id:
+            return
+
+        start_time = time.time()
+        symbols = self.server.fetcher.fetch(debug_file_name, debug_id)
+        if not symbols:
+            self.wfile.write('%s\n' % SERVICE_NOT_FOUND)
+            self.server.fetcher.record_fetch(debug_file_name, debug_id, False, start_time)
+            return
+
+        self.wfile.write('%s\n' % SERVICE_FOUND)
+        try:
+            while True:
+                data = symbols.read(symbol_cache.CHUNK_SIZE)
+                self.wfile.write('%d\n' % len(data))
+                if not data:
+                    break
+                self.wfile.write(data)
+        finally:
+            symbols.close()
+        self.server.fetcher.record_fetch(debug_file_name, debug_id, True, start_time)
+
+class SymbolServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """ Long-lived symbol service listening on a local Unix socket.
+
+    Concurrent requests for the same module are coalesced by the
+    symbol cache's entry locks, so that only one of them goes to the
+    symbol servers while the others wait for the result to arrive in
+    the cache.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, fetcher):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, SymbolRequestHandler)
+        self.fetcher = fetcher
+
+def serve(socket_path, fetcher):
+    server = SymbolServer(socket_path, fetcher)
+    print('Serving symbols on %s' % (socket_path), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -120,54 +698,88 @@ def main():
     parser.add_argument('-s', type=str,
       action='append',
       dest='symbol_servers',
-      help='Add a symbol server to search for available symbols',
-      required=True)
-    parser.add_argument('debug_file_name', type=str, help='The file name (excluding the path) of the file (PDB on Windows, shared library or executable on other platforms) which the debug info was extracted from.', action='store')
-    parser.add_argument('debug_id', type=str, help='The debug/build identifier for the version of the binary referenced in a minidump', action='store')
+      help='Add a symbol server to search for available symbols. All symbol servers are queried at once')
+    parser.add_argument('-t', type=float, action='store', dest='timeout', default=DEFAULT_REQUEST_TIMEOUT,
+      help='Number of seconds to wait for a response from a symbol server (default: %d)' % DEFAULT_REQUEST_TIMEOUT)
+    parser.add_argument('debug_file_name', type=str, nargs='?', help='The file name (excluding the path) of the file (PDB on Windows, shared library or executable on other platforms) which the debug info was extracted from.', action='store')
+    parser.add_argument('debug_id', type=str, nargs='?', help='The debug/build identifier for the version of the binary referenced in a minidump', action='store')
     parser.add_argument('-a', type=str, action='store', help='Path to a config file specifying alternative names',
       dest='alternate_name_map')
+    parser.add_argument('--listen', type=str, action='store', dest='socket_path',
+      help='Run as a symbol service listening on the Unix socket at this path. Use fetch-symbols-client.py as the minidump_stackwalk fetch command to query it.')
+    parser.add_argument('--cache-dir', type=str, action='store', dest='cache_dir',
+      default=symbol_cache.DEFAULT_CACHE_ROOT, help='Directory where fetched symbols are cached')
+    parser.add_argument('--cache-size', type=symbol_cache.parse_size, action='store', dest='cache_size',
+      default=symbol_cache.DEFAULT_MAX_CACHE_SIZE,
+      help='Maximum size of the symbol cache in bytes, optionally with a K, M or G suffix. 0 for no limit')
+    parser.add_argument('--cache-policy', type=str, action='store', dest='cache_policy',
+      choices=symbol_cache.EVICTION_POLICIES, default=symbol_cache.EVICT_LRU,
+      help='Policy used to choose which entries to evict when the cache is full')
+    parser.add_argument('--cache-compression', type=str, action='store', dest='cache_compression',
+      choices=symbol_cache.FORMATS, default=symbol_cache.FORMAT_RAW,
+      help='Compression format for new cache entries. Entries in any format can be read')
+    parser.add_argument('--missing-ttl', type=float, action='store', dest='missing_ttl',
+      default=symbol_cache.DEFAULT_MISSING_TTL,
+      help='Number of seconds to wait before retrying a failed lookup on a symbol server. This doubles with each consecutive failure (default: %d)' % symbol_cache.DEFAULT_MISSING_TTL)
+    parser.add_argument('--max-missing-ttl', type=float, action='store', dest='max_missing_ttl',
+      default=symbol_cache.DEFAULT_MAX_MISSING_TTL,
+      help='Maximum number of seconds to wait before retrying a failed lookup (default: %d)' % symbol_cache.DEFAULT_MAX_MISSING_TTL)
+    parser.add_argument('--stats', action='store_true', dest='stats',
+      help='Print the number of requests made to symbol servers and the number avoided by caching failed lookups, and the number and size of cached entries, then exit')
+    parser.add_argument('--revalidate', type=float, action='store', dest='revalidate_age',
+      help='Revalidate cached symbols with a conditional request to the symbol server they were fetched from if they were last validated more than this many seconds ago')
+    parser.add_argument('--serialized', action='store_true', dest='serialized',
+      help='Output symbols in the serialized form loaded by "minidump_stackwalk -f" instead of as text. Symbol files are converted once and the result is cached')
+    parser.add_argument('--addresses', type=str, action='store', dest='addresses_path',
+      help='JSON file listing the addresses a minidump refers to in each module, as written by "extract-stacktrace.py --trim-symbols". Only the shards of the symbol file needed to look up those addresses are fetched, if the symbol server has them, see shard-symbols.py')
+    parser.add_argument('--metrics', type=str, action='store', dest='metrics_path',
+      default=os.environ.get(metrics.METRICS_PATH_VARIABLE),
+      help='Append timings of cache lookups, requests, downloads and fetches to this file as JSON lines, see metrics.py (default: $%s)' % metrics.METRICS_PATH_VARIABLE)
     opts = parser.parse_args()
 
-    debug_file_names = []
-    debug_file_names += [opts.debug_file_name]
+    cache = symbol_cache.SymbolCache(opts.cache_dir, opts.cache_size, opts.cache_policy,
+                                     opts.cache_compression, opts.missing_ttl, opts.max_missing_ttl)
 
-    debug_id = opts.debug_id
+    if opts.stats:
+        counters = cache.counters()
+        print('Requests to symbol servers: %d' % counters.get('requests', 0))
+        print('Requests skipped due to recent failed lookups: %d' % counters.get('requests_skipped', 0))
+        entries = cache.entries()
+        print('Cached entries: %d (%d bytes), %d invalid' % (len(entries), sum(entry.size for entry in entries),
+                                                             len([entry for entry in entries if entry.valid is False])))
+        sys.exit(0)
+
+    if not opts.symbol_servers:
+        parser.error('at least one symbol server must be specified with -s')
 
     # If the user specified a config file with alternative names to try,
-    # lookup the alternate debug file names for this binary
-    if opts.alternate_name_map:
-        alt_name_file = open(opts.alternate_name_map, 'r')
-        alt_names = json.load(alt_name_file)
-        if opts.debug_file_name in alt_names:
-            debug_file_names += alt_names[opts.debug_file_name]
-
-    # For each of the debug file names, fetch debug symbols from
-    # the cache or try the symbol servers specified on the command line
-    for debug_file_name in debug_file_names:
-        if debug_file_name.endswith('.pdb'):
-            symfile_name = debug_file_name[0:-4] + '.sym'
-        else:
-            symfile_name = debug_file_name + '.sym'
-
-        symfile_path = '%s/%s/%s' % (debug_file_name, debug_id, symfile_name)
-
-        # First try the cache
-        cached_symbols = lookup_in_cache(symfile_path)
-
-        if isinstance(cached_symbols, str):
-            print(cached_symbols)
-            sys.exit(0)
-        elif isinstance(cached_symbols, int):
-            if cache_age < MAX_MISSING_CACHE_AGE:
-               print('Symbols for %s not found in cache but failed lookup cached %d seconds ago' % (debug_file_name, cache_age),
-                     file=sys.stderr)
-               continue
-            
-        # If that fails, query each symbol server in turn
-        symbols = lookup_symbols(debug_file_name, symfile_path, opts.symbol_servers)
-        if symbols:
-            print(symbols, file=sys.stdout)
-            sys.exit(0)
+    # lookup the alternate debug file names for each binary
+    alt_names = load_alternate_names(opts.alternate_name_map)
+
+    http = symbol_http.ConnectionPool(timeout=opts.timeout)
+    fetcher = SymbolFetcher(opts.symbol_servers, alt_names, cache, http, opts.revalidate_age,
+                            metrics.MetricsLog(opts.metrics_path), opts.serialized)
+
+    if opts.socket_path:
+        if opts.addresses_path:
+            parser.error('--addresses cannot be used with --listen')
+        serve(opts.socket_path, fetcher)
+        sys.exit(0)
+
+    if not opts.debug_file_name or not opts.debug_id:
+        parser.error('debug_file_name and debug_id are required unless --listen is used')
+
+    addresses = None
+    if opts.addresses_path:
+        addresses = load_addresses(opts.addresses_path, opts.debug_file_name, opts.debug_id)
+
+    start_time = time.time()
+    symbols = fetcher.fetch(opts.debug_file_name, opts.debug_id, addresses)
+    if symbols:
+        write_symbols(symbols, sys.stdout)
+        fetcher.record_fetch(opts.debug_file_name, opts.debug_id, True, start_time)
+        sys.exit(0)
+    fetcher.record_fetch(opts.debug_file_name, opts.debug_id, False, start_time)
 
     # No debug symbols found for this (debug file name, build ID) combination
     # on any of the symbol servers
@@ -175,4 +787,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
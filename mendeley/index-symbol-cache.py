@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""Rebuild, verify and report on the index of a local symbol cache.
+
+The symbol cache used by fetch-symbols.py keeps an index of its entries,
+with the module name, debug ID, OS and CPU architecture of each, see
+symbol_cache.py. This walks the cache directory once and brings the
+index up to date with the entries on disk, for caches which were
+populated by copying symbol files into place or whose index was lost.
+
+With --verify every entry is also read in full: compressed entries
+must decompress, text symbol files must start with a MODULE record
+matching their path and serialized symbols must pass
+SerializedSymbols.validate(). Entries which fail are marked invalid
+in the index, so fetchers discard them instead of using them, or with
+--remove-invalid are removed.
+
+A summary of the cache by OS and architecture is then printed, along
+with any invalid entries.
+"""
+
+from __future__ import print_function
+
+import argparse
+import cStringIO
+import sys
+import zlib
+
+import serialized_symbols
+import symbol_cache
+
+def verify_entry(cache, entry):
+    """ Read an entry in full. Returns None if it is valid, or a
+    description of the problem
+    """
+    data = cStringIO.StringIO()
+    try:
+        reader = symbol_cache.EntryReader(cache.entry_path(entry.path))
+        try:
+            while True:
+                chunk = reader.read()
+                if not chunk:
+                    break
+                data.write(chunk)
+        finally:
+            reader.close()
+    except (IOError, zlib.error) as err:
+        return 'unreadable: %s' % err
+
+    if entry.path.endswith(symbol_cache.SERIALIZED_SUFFIX):
+        try:
+            serialized_symbols.SerializedSymbols(data.getvalue()).validate()
+        except serialized_symbols.SerializedSymbolsError as err:
+            return 'invalid serialized symbols: %s' % err
+        return None
+
+    if not entry.valid:
+        return 'no MODULE record'
+    # '<debug file>/<debug id>/...', where the debug file may be an
+    # alternative name for the module
+    components = entry.path.split('/')
+    if len(components) >= 3 and components[1] != entry.debug_id:
+        return 'debug ID %s does not match its path' % entry.debug_id
+    return None
+
+def print_summary(entries, out=sys.stdout):
+    """ Print the number and size of entries by OS and architecture """
+    totals = {}
+    for entry in entries:
+        key = (entry.os or '-', entry.arch or '-')
+        count, size = totals.get(key, (0, 0))
+        totals[key] = (count + 1, size + entry.size)
+    print('%-12s %-10s %8s %14s' % ('OS', 'Arch', 'Entries', 'Bytes'), file=out)
+    for (os_name, arch), (count, size) in sorted(totals.items()):
+        print('%-12s %-10s %8d %14d' % (os_name, arch, count, size), file=out)
+    print('%-23s %8d %14d' % ('Total', len(entries), sum(entry.size for entry in entries)), file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild, verify and report on the index of a symbol cache')
+    parser.add_argument('--cache-dir', type=str, action='store', dest='cache_dir',
+      default=symbol_cache.DEFAULT_CACHE_ROOT, help='Directory of the symbol cache (default: %s)' % symbol_cache.DEFAULT_CACHE_ROOT)
+    parser.add_argument('--verify', action='store_true', dest='verify',
+      help='Read every entry in full and mark those which are corrupt or do not match their path as invalid')
+    parser.add_argument('--remove-invalid', action='store_true', dest='remove_invalid',
+      help='Remove invalid entries from the cache')
+    args = parser.parse_args()
+
+    # the size limit is only applied when entries are added, which
+    # this never does
+    cache = symbol_cache.SymbolCache(args.cache_dir, max_size=0)
+    added, updated, removed = cache.reindex()
+    print('Indexed %s: %d entries added, %d updated, %d removed' % (args.cache_dir, added, updated, removed),
+          file=sys.stderr)
+
+    problems = {}
+    for entry in cache.entries():
+        if args.verify:
+            problem = verify_entry(cache, entry)
+        elif entry.valid is False:
+            problem = 'no MODULE record'
+        else:
+            continue
+        if problem:
+            problems[entry.path] = problem
+            cache.mark_invalid(entry.path)
+
+    for path, problem in sorted(problems.items()):
+        if args.remove_invalid:
+            cache.remove(path)
+            print('Removed %s: %s' % (path, problem))
+        else:
+            print('Invalid %s: %s' % (path, problem))
+
+    print_summary(cache.entries())
+    if problems and not args.remove_invalid:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+metrics records timings and counters from fetch-symbols.py and
+extract-stacktrace.py as a stream of JSON objects, one per line, and
+summarizes them.
+
+Since minidump_stackwalk starts a separate fetch-symbols.py for each
+module, every process appends its events to the same file. Each event
+is written with a single write to a file opened for appending, so
+events from concurrent processes and threads are not interleaved.
+
+Each event has 'event', 'time' (seconds since the epoch) and 'pid'
+fields, plus:
+
+  cache_lookup        module, debug_id, hit
+                      A symbol fetch looked up the symbol cache.
+  negative_cache_hit  module, server, retry_in
+                      A request was skipped since a lookup of the same
+                      symbols on the server failed recently.
+  request             server, url, status ('found', 'not_found',
+                      'not_modified' or 'cancelled'), seconds
+                      A request to a symbol server, timed until its
+                      first chunk or failure. Requests are cancelled
+                      once another server has returned the symbols.
+  download            server, path (of the symbol file), bytes, seconds
+                      Symbols downloaded into the cache, timed from
+                      the request until the last chunk.
+  fetch               module, debug_id, found, seconds
+                      A symbol fetch for a module, timed until the
+                      symbols had been delivered.
+  serialize           module, debug_id, bytes, seconds
+                      A symbol file converted for FastSourceLineResolver
+                      by fetch-symbols.py --serialized.
+  trim                module, debug_id, shards, total_shards, bytes, seconds
+                      A symbol file trimmed to the shards needed for a
+                      minidump by fetch-symbols.py --addresses, timed
+                      from the index lookup until the shards were joined.
+  stackwalk           dump_file, seconds, cached, failed
+                      A stackwalk of a minidump by extract-stacktrace.py,
+                      including prefetching symbols.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+# Environment variable which extract-stacktrace.py uses to pass its
+# metrics file to the fetch-symbols.py processes started by
+# minidump_stackwalk, without changing the symbol fetch command
+METRICS_PATH_VARIABLE = 'MINIDUMP_STACKWALK_METRICS_PATH'
+
+# Default number of modules listed in a summary
+DEFAULT_TOP_MODULES = 10
+
+class MetricsLog:
+    """ Appends events to a JSON-lines metrics file.
+
+    A MetricsLog with no path discards events, so callers need not
+    check whether metrics are enabled.
+    """
+    def __init__(self, path=None):
+        self.path = path
+
+    def record(self, event, **fields):
+        if not self.path:
+            return
+        fields['event'] = event
+        fields['time'] = time.time()
+        fields['pid'] = os.getpid()
+        line = json.dumps(fields, sort_keys=True) + '\n'
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+def read_events(path, since=None):
+    """ Read the events in a metrics file, optionally only those
+    recorded at or after time 'since'. Malformed lines, such as a line
+    left incomplete by a process which was killed, are skipped.
+    """
+    events = []
+    with open(path, 'r') as metrics_file:
+        for line in metrics_file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or event.get('time', 0) >= since:
+                events += [event]
+    return events
+
+class Summary:
+    """ Totals of the events in a metrics stream """
+    def __init__(self, events):
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.negative_cache_hits = 0
+        self.requests = {}
+        self.bytes_downloaded = {}
+        self.download_seconds = {}
+        self.fetches = []
+        self.stackwalks = 0
+        self.cached_stackwalks = 0
+        self.failed_stackwalks = 0
+        self.stackwalk_seconds = 0.0
+
+        for event in events:
+            kind = event.get('event')
+            if kind == 'cache_lookup':
+                if event['hit']:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+            elif kind == 'negative_cache_hit':
+                self.negative_cache_hits += 1
+            elif kind == 'request':
+                self.requests[event['server']] = self.requests.get(event['server'], 0) + 1
+            elif kind == 'download':
+                server = event['server']
+                self.bytes_downloaded[server] = self.bytes_downloaded.get(server, 0) + event['bytes']
+                self.download_seconds[server] = self.download_seconds.get(server, 0.0) + event['seconds']
+            elif kind == 'fetch':
+                self.fetches += [event]
+            elif kind == 'stackwalk':
+                self.stackwalks += 1
+                self.stackwalk_seconds += event['seconds']
+                if event['cached']:
+                    self.cached_stackwalks += 1
+                if event['failed']:
+                    self.failed_stackwalks += 1
+
+    def slowest_fetches(self, limit=DEFAULT_TOP_MODULES):
+        """ Returns the 'fetch' events which took longest, slowest first """
+        return sorted(self.fetches, key=lambda event: event['seconds'], reverse=True)[:limit]
+
+def print_summary(summary, out=sys.stdout, top_modules=DEFAULT_TOP_MODULES):
+    print('\nSymbol cache: %d hits, %d misses, %d requests skipped after recent failures' %
+          (summary.cache_hits, summary.cache_misses, summary.negative_cache_hits), file=out)
+    for server in sorted(set(summary.requests.keys()) | set(summary.bytes_downloaded.keys())):
+        print('  %s: %d requests, %d bytes downloaded in %.2fs' %
+              (server, summary.requests.get(server, 0), summary.bytes_downloaded.get(server, 0),
+               summary.download_seconds.get(server, 0.0)), file=out)
+    if summary.fetches:
+        print('Slowest symbol fetches:', file=out)
+        for event in summary.slowest_fetches(top_modules):
+            status = ''
+            if not event['found']:
+                status = ' (not found)'
+            print('  %8.3fs  %s %s%s' % (event['seconds'], event['module'], event['debug_id'], status), file=out)
+    if summary.stackwalks:
+        print('Stackwalks: %d (%d from result cache, %d failed) taking %.2fs in total' %
+              (summary.stackwalks, summary.cached_stackwalks, summary.failed_stackwalks, summary.stackwalk_seconds),
+              file=out)
@@ -0,0 +1,582 @@
+"""
+minidump_reader reads the header, system details, exception and module
+list of a minidump directly, without running minidump_stackwalk.
+
+This is much cheaper than a stackwalk when only a minidump's metadata
+is needed, eg. to deduplicate crashes, route them by app version or
+list the modules whose symbols should be fetched. The file is
+memory-mapped and only the stream directory is read when it is opened.
+Each stream is decoded the first time it is requested.
+
+The layout of the file follows src/google_breakpad/common/minidump_format.h
+and the values derived from it (crash reason, debug identifiers, module
+versions and so on) follow src/processor/minidump.cc and
+minidump_processor.cc, so that stacktrace() returns the same details
+as parsing the output of 'minidump_stackwalk -m'. Assertion details and
+Mac OS X exception reasons are not decoded; the latter are given
+numerically as 'code / flags'.
+
+module_addresses() lists the addresses in each module which the thread
+stacks and registers point into, which are the only addresses a
+stackwalk looks up in the module's symbols, see symbol_shards.py.
+
+Only little-endian minidumps are supported, as written by Breakpad on
+all of the platforms we ship.
+"""
+
+from __future__ import print_function
+
+import bisect
+import mmap
+import struct
+
+import minidump_stackwalk_processor
+
+# 'MDMP' read as a little-endian integer
+MD_HEADER_SIGNATURE = 0x504d444d
+MD_HEADER_VERSION = 0xa793
+
+# Stream types
+MD_THREAD_LIST_STREAM = 3
+MD_MODULE_LIST_STREAM = 4
+MD_EXCEPTION_STREAM = 6
+MD_SYSTEM_INFO_STREAM = 7
+MD_BREAKPAD_INFO_STREAM = 0x47670001
+
+# Structure layouts. All structures are packed.
+HEADER = struct.Struct('<IIIIIIQ')
+DIRECTORY_ENTRY = struct.Struct('<III')
+SYSTEM_INFO = struct.Struct('<HHHBBIIIIIHH12s')
+EXCEPTION_STREAM = struct.Struct('<IIIIQQI')
+EXCEPTION_INFORMATION = struct.Struct('<QQ')
+MODULE = struct.Struct('<QIIII13I8s8s16x')
+THREAD_ID = struct.Struct('<I')
+THREAD_SIZE = 48
+# start of stack memory and location of the stack and thread context
+THREAD_MEMORY = struct.Struct('<24xQIIII')
+BREAKPAD_INFO = struct.Struct('<III')
+UINT32 = struct.Struct('<I')
+LOCATION = struct.Struct('<II')
+CV_INFO_PDB70 = struct.Struct('<IIHH8BI')
+CV_INFO_PDB20 = struct.Struct('<IIII')
+IMAGE_DEBUG_MISC = struct.Struct('<IIB3x')
+
+# Offset of exception_information in MDRawExceptionStream
+EXCEPTION_INFORMATION_OFFSET = 40
+
+# Offset of thread_context in MDRawExceptionStream
+EXCEPTION_CONTEXT_OFFSET = 160
+
+MD_CVINFOPDB70_SIGNATURE = 0x53445352
+MD_CVINFOPDB20_SIGNATURE = 0x3031424e
+MD_VSFIXEDFILEINFO_SIGNATURE = 0xfeef04bd
+MD_VSFIXEDFILEINFO_VERSION = 0x00010000
+
+MD_BREAKPAD_INFO_VALID_DUMP_THREAD_ID = 1 << 0
+MD_BREAKPAD_INFO_VALID_REQUESTING_THREAD_ID = 1 << 1
+
+# Platform IDs
+MD_OS_WIN32_WINDOWS = 1
+MD_OS_WIN32_NT = 2
+MD_OS_MAC_OS_X = 0x8101
+MD_OS_IOS = 0x8102
+MD_OS_LINUX = 0x8201
+MD_OS_SOLARIS = 0x8202
+
+OS_NAMES = {
+    MD_OS_WIN32_NT : 'Windows NT',
+    MD_OS_WIN32_WINDOWS : 'Windows',
+    MD_OS_MAC_OS_X : 'Mac OS X',
+    MD_OS_IOS : 'iOS',
+    MD_OS_LINUX : 'Linux',
+    MD_OS_SOLARIS : 'Solaris',
+}
+
+# CPU architectures
+MD_CPU_ARCHITECTURE_X86 = 0
+MD_CPU_ARCHITECTURE_PPC = 3
+MD_CPU_ARCHITECTURE_ARM = 5
+MD_CPU_ARCHITECTURE_AMD64 = 9
+MD_CPU_ARCHITECTURE_SPARC = 0x8001
+
+CPU_NAMES = {
+    MD_CPU_ARCHITECTURE_X86 : 'x86',
+    MD_CPU_ARCHITECTURE_AMD64 : 'amd64',
+    MD_CPU_ARCHITECTURE_PPC : 'ppc',
+    MD_CPU_ARCHITECTURE_SPARC : 'sparc',
+    MD_CPU_ARCHITECTURE_ARM : 'arm',
+}
+
+# Layout of a pointer for each CPU architecture
+POINTERS = {
+    MD_CPU_ARCHITECTURE_X86 : '<I',
+    MD_CPU_ARCHITECTURE_AMD64 : '<Q',
+    MD_CPU_ARCHITECTURE_PPC : '<I',
+    MD_CPU_ARCHITECTURE_SPARC : '<I',
+    MD_CPU_ARCHITECTURE_ARM : '<I',
+}
+
+LINUX_SIGNALS = ['SIGHUP', 'SIGINT', 'SIGQUIT', 'SIGILL', 'SIGTRAP', 'SIGABRT', 'SIGBUS', 'SIGFPE',
+                 'SIGKILL', 'SIGUSR1', 'SIGSEGV', 'SIGUSR2', 'SIGPIPE', 'SIGALRM', 'SIGTERM',
+                 'SIGSTKFLT', 'SIGCHLD', 'SIGCONT', 'SIGSTOP', 'SIGTSTP', 'SIGTTIN', 'SIGTTOU',
+                 'SIGURG', 'SIGXCPU', 'SIGXFSZ', 'SIGVTALRM', 'SIGPROF', 'SIGWINCH', 'SIGIO',
+                 'SIGPWR', 'SIGSYS']
+
+MD_EXCEPTION_CODE_WIN_ACCESS_VIOLATION = 0xc0000005
+
+WINDOWS_EXCEPTIONS = {
+    0x40010005 : 'DBG_CONTROL_C',
+    0x80000001 : 'EXCEPTION_GUARD_PAGE',
+    0x80000002 : 'EXCEPTION_DATATYPE_MISALIGNMENT',
+    0x80000003 : 'EXCEPTION_BREAKPOINT',
+    0x80000004 : 'EXCEPTION_SINGLE_STEP',
+    MD_EXCEPTION_CODE_WIN_ACCESS_VIOLATION : 'EXCEPTION_ACCESS_VIOLATION',
+    0xc0000006 : 'EXCEPTION_IN_PAGE_ERROR',
+    0xc0000008 : 'EXCEPTION_INVALID_HANDLE',
+    0xc000001d : 'EXCEPTION_ILLEGAL_INSTRUCTION',
+    0xc0000025 : 'EXCEPTION_NONCONTINUABLE_EXCEPTION',
+    0xc0000026 : 'EXCEPTION_INVALID_DISPOSITION',
+    0xc000008c : 'EXCEPTION_BOUNDS_EXCEEDED',
+    0xc000008d : 'EXCEPTION_FLT_DENORMAL_OPERAND',
+    0xc000008e : 'EXCEPTION_FLT_DIVIDE_BY_ZERO',
+    0xc000008f : 'EXCEPTION_FLT_INEXACT_RESULT',
+    0xc0000090 : 'EXCEPTION_FLT_INVALID_OPERATION',
+    0xc0000091 : 'EXCEPTION_FLT_OVERFLOW',
+    0xc0000092 : 'EXCEPTION_FLT_STACK_CHECK',
+    0xc0000093 : 'EXCEPTION_FLT_UNDERFLOW',
+    0xc0000094 : 'EXCEPTION_INT_DIVIDE_BY_ZERO',
+    0xc0000095 : 'EXCEPTION_INT_OVERFLOW',
+    0xc0000096 : 'EXCEPTION_PRIV_INSTRUCTION',
+    0xc00000fd : 'EXCEPTION_STACK_OVERFLOW',
+    0xc0000194 : 'EXCEPTION_POSSIBLE_DEADLOCK',
+    0xc0000409 : 'EXCEPTION_STACK_BUFFER_OVERRUN',
+    0xc0000374 : 'EXCEPTION_HEAP_CORRUPTION',
+    0xe06d7363 : 'Unhandled C++ Exception',
+}
+
+# Suffixes of EXCEPTION_ACCESS_VIOLATION for the type of access, which
+# is the first exception parameter
+ACCESS_VIOLATION_TYPES = {
+    0 : '_READ',
+    1 : '_WRITE',
+    8 : '_EXEC',
+}
+
+class MinidumpFormatError(Exception):
+    """ Raised when reading a file which is not a valid minidump """
+    pass
+
+class SystemInfo(object):
+    """ The OS and CPU of the system where a minidump was written """
+    __slots__ = ('cpu_architecture', 'cpu_level', 'cpu_revision', 'cpu_count', 'platform_id',
+                 'major_version', 'minor_version', 'build_number', 'csd_version', 'cpu_vendor')
+
+    def __init__(self, cpu_architecture, cpu_level, cpu_revision, cpu_count, platform_id,
+                 major_version, minor_version, build_number, csd_version, cpu_vendor):
+        self.cpu_architecture = cpu_architecture
+        self.cpu_level = cpu_level
+        self.cpu_revision = cpu_revision
+        self.cpu_count = cpu_count
+        self.platform_id = platform_id
+        self.major_version = major_version
+        self.minor_version = minor_version
+        self.build_number = build_number
+        self.csd_version = csd_version
+        self.cpu_vendor = cpu_vendor
+
+class ExceptionInfo(object):
+    """ The exception recorded in a minidump written for a crash """
+    __slots__ = ('thread_id', 'code', 'flags', 'address', 'parameters')
+
+    def __init__(self, thread_id, code, flags, address, parameters):
+        self.thread_id = thread_id
+        self.code = code
+        self.flags = flags
+        self.address = address
+        self.parameters = parameters
+
+class ModuleInfo(object):
+    """ A module in a minidump's module list """
+    __slots__ = ('code_file', 'version', 'debug_file', 'debug_id', 'base_address', 'size')
+
+    def __init__(self, code_file, version, debug_file, debug_id, base_address, size):
+        self.code_file = code_file
+        self.version = version
+        self.debug_file = debug_file
+        self.debug_id = debug_id
+        self.base_address = base_address
+        self.size = size
+
+class MinidumpFile:
+    """ A memory-mapped minidump.
+
+    Use with a 'with' statement or call close() when done. Streams are
+    decoded when first requested and cached. Methods for streams which
+    are not in the minidump return None.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError) as err:
+            # eg. an empty file, which cannot be mapped
+            self.file.close()
+            raise MinidumpFormatError('Unable to map %s: %s' % (path, err))
+        self._streams = {}
+        try:
+            self._read_directory()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _unpack(self, structure, offset):
+        try:
+            return structure.unpack_from(self.data, offset)
+        except struct.error:
+            raise MinidumpFormatError('Truncated minidump %s' % self.path)
+
+    def _read_directory(self):
+        (signature, version, stream_count, directory_rva, checksum,
+         self.time_date_stamp, self.flags) = self._unpack(HEADER, 0)
+        if signature != MD_HEADER_SIGNATURE or version & 0xffff != MD_HEADER_VERSION:
+            raise MinidumpFormatError('%s is not a minidump' % self.path)
+
+        self.directory = {}
+        for i in range(stream_count):
+            stream_type, size, rva = self._unpack(DIRECTORY_ENTRY, directory_rva + i * DIRECTORY_ENTRY.size)
+            if rva + size > len(self.data):
+                raise MinidumpFormatError('Stream %d extends beyond the end of %s' % (stream_type, self.path))
+            # as in minidump.cc, the first stream of each type is used
+            self.directory.setdefault(stream_type, (rva, size))
+
+    def _stream(self, stream_type, decode):
+        """ Returns the decoded stream of 'stream_type', calling
+        decode(offset, size) the first time it is requested
+        """
+        if stream_type not in self._streams:
+            location = self.directory.get(stream_type)
+            stream = None
+            if location:
+                stream = decode(*location)
+            self._streams[stream_type] = stream
+        return self._streams[stream_type]
+
+    def _string(self, rva):
+        """ Read an MDString, which is UTF-16 encoded, as UTF-8 """
+        length, = self._unpack(UINT32, rva)
+        data = self.data[rva + UINT32.size:rva + UINT32.size + length]
+        if len(data) != length:
+            raise MinidumpFormatError('Truncated string in %s' % self.path)
+        return data.decode('utf-16-le', 'replace').encode('utf-8')
+
+    def _list_start(self, rva, size, entry_size):
+        """ Returns the entry count and offset of the first entry of a
+        list stream. Some writers pad the count to 8 bytes.
+        """
+        count, = self._unpack(UINT32, rva)
+        start = rva + UINT32.size
+        if size == UINT32.size + 4 + count * entry_size:
+            start += 4
+        elif size < UINT32.size + count * entry_size:
+            raise MinidumpFormatError('Truncated list stream in %s' % self.path)
+        return count, start
+
+    def system_info(self):
+        """ Returns the SystemInfo stream """
+        return self._stream(MD_SYSTEM_INFO_STREAM, self._read_system_info)
+
+    def _read_system_info(self, rva, size):
+        (architecture, level, revision, cpu_count, product_type, major_version, minor_version, build_number,
+         platform_id, csd_version_rva, suite_mask, reserved, cpu) = self._unpack(SYSTEM_INFO, rva)
+        csd_version = None
+        if csd_version_rva:
+            csd_version = self._string(csd_version_rva)
+        cpu_vendor = None
+        if architecture in (MD_CPU_ARCHITECTURE_X86, MD_CPU_ARCHITECTURE_AMD64):
+            cpu_vendor = cpu.rstrip('\0')
+        return SystemInfo(architecture, level, revision, cpu_count, platform_id,
+                          major_version, minor_version, build_number, csd_version, cpu_vendor)
+
+    def exception(self):
+        """ Returns the ExceptionInfo stream, which is only present in
+        minidumps written for crashes
+        """
+        return self._stream(MD_EXCEPTION_STREAM, self._read_exception)
+
+    def _read_exception(self, rva, size):
+        thread_id, align, code, flags, record, address, parameter_count = self._unpack(EXCEPTION_STREAM, rva)
+        parameters = []
+        for i in range(min(parameter_count, 15)):
+            parameters += [self._unpack(EXCEPTION_INFORMATION, rva + EXCEPTION_INFORMATION_OFFSET + i * 8)[0]]
+        return ExceptionInfo(thread_id, code, flags, address, parameters)
+
+    def thread_ids(self):
+        """ Returns the IDs of the threads in the thread list, in order """
+        return self._stream(MD_THREAD_LIST_STREAM, self._read_thread_ids)
+
+    def _read_thread_ids(self, rva, size):
+        count, start = self._list_start(rva, size, THREAD_SIZE)
+        return [self._unpack(THREAD_ID, start + i * THREAD_SIZE)[0] for i in range(count)]
+
+    def breakpad_info(self):
+        """ Returns the (dump thread ID, requesting thread ID) recorded by
+        Breakpad, each of which is None if it is not valid
+        """
+        return self._stream(MD_BREAKPAD_INFO_STREAM, self._read_breakpad_info)
+
+    def _read_breakpad_info(self, rva, size):
+        validity, dump_thread_id, requesting_thread_id = self._unpack(BREAKPAD_INFO, rva)
+        if not validity & MD_BREAKPAD_INFO_VALID_DUMP_THREAD_ID:
+            dump_thread_id = None
+        if not validity & MD_BREAKPAD_INFO_VALID_REQUESTING_THREAD_ID:
+            requesting_thread_id = None
+        return (dump_thread_id, requesting_thread_id)
+
+    def modules(self):
+        """ Returns the list of ModuleInfos. The first is the main module """
+        return self._stream(MD_MODULE_LIST_STREAM, self._read_modules)
+
+    def _read_modules(self, rva, size):
+        count, start = self._list_start(rva, size, MODULE.size)
+        modules = []
+        for i in range(count):
+            fields = self._unpack(MODULE, start + i * MODULE.size)
+            base_address, size_of_image, checksum, time_date_stamp, name_rva = fields[:5]
+            version_info = fields[5:18]
+            cv_record = LOCATION.unpack(fields[18])
+            misc_record = LOCATION.unpack(fields[19])
+
+            version = ''
+            if version_info[0] == MD_VSFIXEDFILEINFO_SIGNATURE and version_info[1] & MD_VSFIXEDFILEINFO_VERSION:
+                file_version_hi, file_version_lo = version_info[2:4]
+                version = '%d.%d.%d.%d' % (file_version_hi >> 16, file_version_hi & 0xffff,
+                                           file_version_lo >> 16, file_version_lo & 0xffff)
+            debug_file, debug_id = self._debug_info(cv_record, misc_record)
+            modules += [ModuleInfo(self._string(name_rva), version, debug_file, debug_id, base_address,
+                                   size_of_image)]
+        return modules
+
+    def _debug_info(self, cv_record, misc_record):
+        """ Returns the debug file name and identifier of a module from
+        its CodeView record, or only the file name from its
+        miscellaneous debug record if it has no usable CodeView record
+        """
+        debug_file = ''
+        debug_id = ''
+        cv_size, cv_rva = cv_record
+        if cv_size >= UINT32.size:
+            cv_signature, = self._unpack(UINT32, cv_rva)
+            if cv_signature == MD_CVINFOPDB70_SIGNATURE and cv_size >= CV_INFO_PDB70.size:
+                fields = self._unpack(CV_INFO_PDB70, cv_rva)
+                debug_id = '%08X%04X%04X%02X%02X%02X%02X%02X%02X%02X%02X%x' % fields[1:]
+                debug_file = self._c_string(cv_rva + CV_INFO_PDB70.size, cv_rva + cv_size)
+            elif cv_signature == MD_CVINFOPDB20_SIGNATURE and cv_size >= CV_INFO_PDB20.size:
+                fields = self._unpack(CV_INFO_PDB20, cv_rva)
+                debug_id = '%08X%x' % fields[2:]
+                debug_file = self._c_string(cv_rva + CV_INFO_PDB20.size, cv_rva + cv_size)
+
+        misc_size, misc_rva = misc_record
+        if not debug_file and misc_size >= IMAGE_DEBUG_MISC.size:
+            data_type, length, unicode_data = self._unpack(IMAGE_DEBUG_MISC, misc_rva)
+            data = self.data[misc_rva + IMAGE_DEBUG_MISC.size:misc_rva + misc_size]
+            if unicode_data:
+                if len(data) % 2 == 0:
+                    debug_file = data.decode('utf-16-le', 'replace').encode('utf-8')
+            else:
+                debug_file = data
+            debug_file = debug_file.split('\0', 1)[0]
+        return debug_file, debug_id
+
+    def _c_string(self, start, end):
+        return self.data[start:end].split('\0', 1)[0]
+
+    def module_addresses(self):
+        """ Returns a list of (ModuleInfo, addresses) pairs for the modules
+        which the thread stacks and contexts in the minidump point into,
+        where 'addresses' is a sorted list of addresses relative to the
+        module base.
+
+        A stackwalk only looks up the symbols of a module at addresses in
+        a thread's registers or, as return addresses, on its stack, so
+        this covers every address a stackwalk may need. Every aligned
+        pointer is included, so most of them are not code addresses.
+        Returns None if the pointer size of the minidump's CPU is not
+        known.
+        """
+        system_info = self.system_info()
+        pointer_format = system_info and POINTERS.get(system_info.cpu_architecture)
+        if not pointer_format:
+            return None
+        pointer_size = struct.calcsize(pointer_format)
+
+        # (offset, size) of the thread contexts and stack memory
+        regions = []
+        location = self.directory.get(MD_THREAD_LIST_STREAM)
+        if location:
+            count, start = self._list_start(location[0], location[1], THREAD_SIZE)
+            for i in range(count):
+                (stack_start, stack_size, stack_rva,
+                 context_size, context_rva) = self._unpack(THREAD_MEMORY, start + i * THREAD_SIZE)
+                # stacks are scanned at aligned addresses, as the
+                # stackwalkers do
+                skip = min(-stack_start % pointer_size, stack_size)
+                regions += [(stack_rva + skip, stack_size - skip), (context_rva, context_size)]
+        location = self.directory.get(MD_EXCEPTION_STREAM)
+        if location:
+            regions += [self._unpack(LOCATION, location[0] + EXCEPTION_CONTEXT_OFFSET)[::-1]]
+
+        values = set()
+        for offset, size in regions:
+            count = size // pointer_size
+            if offset + count * pointer_size > len(self.data):
+                raise MinidumpFormatError('Truncated thread memory in %s' % self.path)
+            values.update(struct.unpack_from('%s%d%s' % (pointer_format[0], count, pointer_format[1]),
+                                             self.data, offset))
+
+        addresses = {}
+        modules = sorted(self.modules() or [], key=lambda module: module.base_address)
+        bases = [module.base_address for module in modules]
+        for value in values:
+            position = bisect.bisect_right(bases, value) - 1
+            if position >= 0 and value - bases[position] < modules[position].size:
+                addresses.setdefault(position, []).append(value - bases[position])
+        return [(modules[position], sorted(module_addresses))
+                for position, module_addresses in sorted(addresses.items())]
+
+    def crash_reason(self):
+        """ Returns the (crash reason, crash address) of the exception in
+        the minidump, or None if there is no exception
+        """
+        exception = self.exception()
+        if not exception:
+            return None
+        reason = '0x%08x / 0x%08x' % (exception.code, exception.flags)
+        address = exception.address
+        system_info = self.system_info()
+        platform_id = system_info and system_info.platform_id
+
+        if platform_id in (MD_OS_WIN32_NT, MD_OS_WIN32_WINDOWS):
+            reason = WINDOWS_EXCEPTIONS.get(exception.code, reason)
+            if exception.code == MD_EXCEPTION_CODE_WIN_ACCESS_VIOLATION and len(exception.parameters) >= 2:
+                # the first parameter is the type of access and the
+                # second is the address which was accessed
+                reason += ACCESS_VIOLATION_TYPES.get(exception.parameters[0], '')
+                address = exception.parameters[1]
+        elif platform_id in (MD_OS_LINUX, MD_OS_SOLARIS):
+            if 1 <= exception.code <= len(LINUX_SIGNALS):
+                reason = LINUX_SIGNALS[exception.code - 1]
+        return (reason, address)
+
+    def requesting_thread(self):
+        """ Returns the index of the thread which crashed or requested the
+        minidump, counting threads as minidump_stackwalk does, or None
+        """
+        dump_thread_id = None
+        requesting_thread_id = None
+        breakpad_info = self.breakpad_info()
+        if breakpad_info:
+            dump_thread_id, requesting_thread_id = breakpad_info
+        exception = self.exception()
+        if exception:
+            requesting_thread_id = exception.thread_id
+        if requesting_thread_id is None:
+            return None
+
+        # the thread which wrote the minidump is left out of the
+        # threads minidump_stackwalk outputs
+        index = 0
+        for thread_id in self.thread_ids() or []:
+            if thread_id == dump_thread_id:
+                continue
+            if thread_id == requesting_thread_id:
+                return index
+            index += 1
+        return None
+
+    def stacktrace(self):
+        """ Returns a minidump_stackwalk_processor.Stacktrace with the
+        OS, CPU, crash and module details of the minidump, in the form
+        minidump_stackwalk outputs them, and no threads.
+        """
+        processor = minidump_stackwalk_processor
+
+        os_version = None
+        cpu_info = None
+        system_info = self.system_info()
+        if system_info:
+            platform = OS_NAMES.get(system_info.platform_id, '0x%08x' % system_info.platform_id)
+            build = '%d.%d.%d' % (system_info.major_version, system_info.minor_version, system_info.build_number)
+            if system_info.csd_version is not None:
+                build += ' ' + system_info.csd_version
+            os_version = processor.OSVersion(_strip_separator(platform), _strip_separator(build))
+
+            cpu_type = CPU_NAMES.get(system_info.cpu_architecture, '0x%04x' % system_info.cpu_architecture)
+            cpu_model = ''
+            if system_info.cpu_architecture in (MD_CPU_ARCHITECTURE_X86, MD_CPU_ARCHITECTURE_AMD64):
+                if system_info.cpu_vendor:
+                    cpu_model = system_info.cpu_vendor + ' '
+                cpu_model += 'family %d model %d stepping %d' % (system_info.cpu_level, system_info.cpu_revision >> 8,
+                                                                 system_info.cpu_revision & 0xff)
+            cpu_info = processor.CpuInfo(cpu_type, _strip_separator(cpu_model), system_info.cpu_count)
+
+        crash_info = None
+        crash_reason = self.crash_reason()
+        if crash_reason:
+            reason, address = crash_reason
+            crash_info = processor.CrashInfo(_strip_separator(reason), '0x%x' % address, self.requesting_thread())
+
+        main_module = None
+        modules = {}
+        for module in self.modules() or []:
+            filename = _strip_separator(_file_name(module.code_file))
+            modules[filename] = processor.Module(filename, _strip_separator(module.version),
+                                                 _strip_separator(_file_name(module.debug_file)),
+                                                 _strip_separator(module.debug_id),
+                                                 '0x%08x' % module.base_address,
+                                                 '0x%08x' % (module.base_address + module.size - 1))
+            if main_module is None:
+                main_module = filename
+
+        return processor.Stacktrace(main_module, modules, {}, crash_info, cpu_info, os_version)
+
+def _file_name(path):
+    # as PathnameStripper::File(), paths may use either separator
+    return path[max(path.rfind('/'), path.rfind('\\')) + 1:]
+
+def _strip_separator(value):
+    # as StripSeparator() in minidump_stackwalk.cc
+    return value.replace('|', '_')
+
+def read_stacktrace(path):
+    """ Read the OS, CPU, crash and module details of a minidump.
+    See MinidumpFile.stacktrace()
+    """
+    with MinidumpFile(path) as minidump:
+        return minidump.stacktrace()
+
+def read_module_addresses(path):
+    """ Read the addresses which a stackwalk of a minidump may look up in
+    the symbols of each module, as a dict mapping the (debug file name,
+    debug ID) which minidump_stackwalk fetches the module's symbols with
+    to a list of addresses. See MinidumpFile.module_addresses()
+    """
+    with MinidumpFile(path) as minidump:
+        module_addresses = minidump.module_addresses()
+    if module_addresses is None:
+        return None
+    addresses = {}
+    for module, offsets in module_addresses:
+        if module.debug_file and module.debug_id:
+            addresses.setdefault((_file_name(module.debug_file), module.debug_id), []).extend(offsets)
+    return addresses
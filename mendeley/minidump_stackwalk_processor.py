@@ -7,14 +7,23 @@ To extract a stacktrace from a minidump, run minidump_stackwalk with the
 '-m' argument and capture its stdout.
 
 Parse the result to Stacktrace.parse() to create a Stacktrace object.
+
+To process the output while minidump_stackwalk is still running, pass
+each line of its stdout to StacktraceParser.parse_line() as it is read.
+read_lines() iterates over the lines of a pipe without waiting for
+more output than is needed.
 """
 
 from __future__ import print_function
 
-import re
+# The record types below use __slots__ rather than a per-instance
+# __dict__, since a batch of parsed stack traces can hold many
+# thousands of frames and modules.
 
-class Frame:
+class Frame(object):
     """ Represents a single frame from a stack trace """
+    __slots__ = ('module', 'function', 'line', 'column', 'addr')
+
     def __init__(self, module, function, line, column, addr):
         self.module = module
         self.function = function
@@ -22,8 +31,10 @@ class Frame:
         self.column = column
         self.addr = addr
 
-class Module:
+class Module(object):
     """ Represents an executable or shared library loaded into the app that crashed """
+    __slots__ = ('filename', 'version', 'debug_filename', 'debug_id', 'base_addr', 'max_addr')
+
     def __init__(self, filename, version, debug_filename, debug_id, base_addr, max_addr):
         self.filename = filename
         self.version = version
@@ -32,22 +43,28 @@ class Module:
         self.base_addr = base_addr
         self.max_addr = max_addr
 
-class CpuInfo:
+class CpuInfo(object):
     """ Stores the CPU type, model and core count of the system where a crash occurred """
+    __slots__ = ('type', 'model', 'core_count')
+
     def __init__(self, type, model, core_count):
         self.type = type
         self.model = model
         self.core_count = core_count
 
-class CrashInfo:
+class CrashInfo(object):
     """ Basic metadata about the type and location of a crash """
+    __slots__ = ('type', 'addr', 'thread_id')
+
     def __init__(self, crash_type, crash_addr, crash_thread):
         self.type = crash_type
         self.addr = crash_addr
         self.thread_id = crash_thread
 
-class OSVersion:
+class OSVersion(object):
     """ OS platform and version of the system where a crash occurred """
+    __slots__ = ('platform', 'build_id')
+
     def __init__(self, platform, build_id):
         self.platform = platform
         self.build_id = build_id
@@ -71,43 +88,143 @@ class Stacktrace:
 
     @staticmethod
     def parse(stackwalk_output):
-        os_version = None
-        cpu_info = None
-        crash_info = None
-        main_module = None
-        threads = {}
-        modules = {}
-
+        parser = StacktraceParser()
+        parse_line = parser.parse_line
         for line in stackwalk_output.splitlines():
-            fields = line.split('|')
-            entry_type = fields[0]
-
-            if re.match('[0-9]+', entry_type):
-                thread_id = int(entry_type)
-                if not (thread_id in threads):
-                    threads[thread_id] = []
-
-                frame_index, module, function, line, column, addr = fields[1:]
-                threads[thread_id] += [Frame(module, function, line, column, addr)]
-
-            elif entry_type == 'OS':
-                platform, platform_build = fields[1:]
-                os_version = OSVersion(platform, platform_build)
-            elif entry_type == 'CPU':
-                cpu_type, cpu_model, cores = fields[1:]
-                cpu_info = CpuInfo(cpu_type, cpu_model, int(cores))
-            elif entry_type == 'Crash':
-                crash_type, crash_addr, crash_thread = fields[1:]
-                if crash_type != 'No crash':
-                    crash_info = CrashInfo(crash_type, crash_addr, int(crash_thread))
-            elif entry_type == 'Module':
-                filename, version, debug_filename, debug_id, base_addr, max_addr, is_main = fields[1:]
-                is_main = bool(int(is_main))
-
-                modules[filename] = Module(filename, version, debug_filename, debug_id, base_addr, max_addr)
-                if is_main:
-                    main_module = filename
-
-        stacktrace = Stacktrace(main_module, modules, threads, crash_info, cpu_info, os_version)
-        return stacktrace
+            parse_line(line)
+        return parser.stacktrace
 
+    @staticmethod
+    def parse_stream(stream, keep_all_threads=True):
+        """ Parse minidump_stackwalk output from a file object or pipe,
+        one line at a time. See StacktraceParser for 'keep_all_threads'.
+        """
+        parser = StacktraceParser(keep_all_threads)
+        for line in read_lines(stream):
+            parser.parse_line(line)
+        return parser.stacktrace
+
+# Types of entry returned by StacktraceParser.parse_line()
+ENTRY_OS = 'OS'
+ENTRY_CPU = 'CPU'
+ENTRY_CRASH = 'Crash'
+ENTRY_MODULE = 'Module'
+ENTRY_FRAME = 'Frame'
+
+class StacktraceParser:
+    """ Parses minidump_stackwalk output incrementally, one line at a time.
+
+    The Stacktrace is built up in 'stacktrace' as lines are parsed.
+    minidump_stackwalk outputs the system details, crash details and
+    modules before any stack frames, and the frames of the crashing
+    thread before those of other threads, so these are available
+    as soon as the first frame has been parsed.
+
+    If 'keep_all_threads' is False and the minidump records a crash,
+    only the frames of the crashing thread are kept. Frames from other
+    threads are still returned by parse_line() but are then discarded,
+    so memory use does not grow with the number of threads.
+
+    Module, function and source file names are interned, so that the
+    frames of all stack traces parsed by a process share a single copy
+    of each name.
+    """
+    def __init__(self, keep_all_threads=True):
+        self.stacktrace = Stacktrace(None, {}, {}, None, None, None)
+        self.keep_all_threads = keep_all_threads
+        # frames are almost always grouped by thread, so the frame list
+        # for the most recent thread is kept to avoid a dict lookup per
+        # frame. It is None if that thread's frames are being discarded.
+        self.current_thread_id = None
+        self.current_frames = None
+
+    def parse_line(self, line):
+        """ Parse a line of minidump_stackwalk output.
+
+        Returns an (entry type, entry) tuple for the parsed line, where
+        the entry type is one of the ENTRY_* constants and the entry is
+        an OSVersion, CpuInfo, CrashInfo, Module or a (thread ID, Frame)
+        tuple. Returns None for blank or unrecognized lines and for
+        'Crash' lines in minidumps which do not record a crash.
+        """
+        fields = line.rstrip('\r\n').split('|')
+        entry_type = fields[0]
+
+        # frame lines, which make up most of the output, are checked for
+        # first and parsed inline. Other lines are dispatched on their
+        # entry type.
+        if not entry_type.isdigit():
+            parse_entry = self.entry_parsers.get(entry_type)
+            if parse_entry:
+                return parse_entry(self, fields)
+            return None
+
+        thread_id = int(entry_type)
+        frame_index, module, function, source_file, line, addr = fields[1:]
+        frame = Frame(_intern(module), _intern(function), _intern(source_file), line, addr)
+
+        if thread_id != self.current_thread_id:
+            self._start_thread(thread_id)
+        if self.current_frames is not None:
+            self.current_frames.append(frame)
+        return (ENTRY_FRAME, (thread_id, frame))
+
+    def _start_thread(self, thread_id):
+        trace = self.stacktrace
+        self.current_thread_id = thread_id
+        if (self.keep_all_threads or not trace.crash_info or
+            thread_id == trace.crash_info.thread_id):
+            self.current_frames = trace.threads.setdefault(thread_id, [])
+        else:
+            self.current_frames = None
+
+    def _parse_os(self, fields):
+        platform, platform_build = fields[1:]
+        self.stacktrace.os_version = OSVersion(platform, platform_build)
+        return (ENTRY_OS, self.stacktrace.os_version)
+
+    def _parse_cpu(self, fields):
+        cpu_type, cpu_model, cores = fields[1:]
+        self.stacktrace.cpu_info = CpuInfo(cpu_type, cpu_model, int(cores))
+        return (ENTRY_CPU, self.stacktrace.cpu_info)
+
+    def _parse_crash(self, fields):
+        crash_type, crash_addr, crash_thread = fields[1:]
+        if crash_type == 'No crash':
+            return None
+        self.stacktrace.crash_info = CrashInfo(crash_type, crash_addr, int(crash_thread))
+        return (ENTRY_CRASH, self.stacktrace.crash_info)
+
+    def _parse_module(self, fields):
+        filename, version, debug_filename, debug_id, base_addr, max_addr, is_main = fields[1:]
+        is_main = bool(int(is_main))
+
+        filename = _intern(filename)
+        module = Module(filename, version, _intern(debug_filename), debug_id, base_addr, max_addr)
+        self.stacktrace.modules[filename] = module
+        if is_main:
+            self.stacktrace.main_module = filename
+        return (ENTRY_MODULE, module)
+
+    # Functions which parse each type of line other than stack frames,
+    # keyed by the first field of the line
+    entry_parsers = {
+        'OS' : _parse_os,
+        'CPU' : _parse_cpu,
+        'Crash' : _parse_crash,
+        'Module' : _parse_module,
+    }
+
+def _intern(value):
+    # intern() only accepts byte strings
+    if type(value) is str:
+        return intern(value)
+    return value
+
+def read_lines(stream):
+    """ Iterate over the lines of a file object or pipe, returning each
+    line as soon as it has been read. Iterating over a file object
+    directly reads ahead in large blocks, so lines from a process which
+    is still running would be delayed.
+    """
+    return iter(stream.readline, '')
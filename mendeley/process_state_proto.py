@@ -0,0 +1,211 @@
+"""
+process_state_proto encodes and decodes the messages of Breakpad's
+src/processor/proto/process_state.proto in the protobuf wire format.
+
+The messages are written by hand rather than generated by protoc, so
+they need no protobuf runtime. Each message class lists its fields in
+FIELDS, as (field number, name, label, type) tuples which mirror the
+declarations in the .proto, and stacktrace_proto_test.py checks that
+they still match it. Fields which are not set are None, and repeated
+fields are lists. Unknown fields are skipped when decoding.
+
+To follow a change to process_state.proto, update FIELDS of the
+messages below.
+"""
+
+from __future__ import print_function
+
+OPTIONAL = 'optional'
+REQUIRED = 'required'
+REPEATED = 'repeated'
+
+# Scalar field types. Message fields have their message class as type.
+INT32 = 'int32'
+INT64 = 'int64'
+STRING = 'string'
+
+# Wire types of encoded fields
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+class EncodeError(Exception):
+    """ Raised when a message is missing a required field """
+    pass
+
+class DecodeError(Exception):
+    """ Raised when data is not a valid encoding of a message """
+    pass
+
+def encode_varint(value):
+    """ Returns the encoding of a non-negative integer as a varint """
+    data = ''
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            data += chr(bits | 0x80)
+        else:
+            return data + chr(bits)
+
+def _decode_varint(data, position, end):
+    value = 0
+    shift = 0
+    while position < end:
+        byte = ord(data[position])
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+    raise DecodeError('Truncated varint')
+
+class Message(object):
+    """ A protobuf message. Fields can be set when it is constructed. """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **values):
+        for number, name, label, field_type in self.FIELDS:
+            setattr(self, name, [] if label == REPEATED else None)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def serialize(self):
+        """ Returns the encoded message """
+        data = []
+        for number, name, label, field_type in self.FIELDS:
+            values = getattr(self, name)
+            if values is None:
+                if label == REQUIRED:
+                    raise EncodeError('Required field %s.%s is not set' % (type(self).__name__, name))
+                continue
+            if label != REPEATED:
+                values = [values]
+            for value in values:
+                if field_type in (INT32, INT64):
+                    # negative values are sign-extended to 64 bits
+                    data += [encode_varint(number << 3 | WIRETYPE_VARINT), encode_varint(value & ((1 << 64) - 1))]
+                    continue
+                if field_type == STRING:
+                    value = value.encode('utf-8')
+                else:
+                    value = value.serialize()
+                data += [encode_varint(number << 3 | WIRETYPE_LENGTH_DELIMITED), encode_varint(len(value)), value]
+        return ''.join(data)
+
+    @classmethod
+    def parse(cls, data):
+        """ Returns the message encoded in 'data' """
+        message = cls()
+        message._merge(data, 0, len(data))
+        return message
+
+    def _merge(self, data, position, end):
+        fields = dict((field[0], field) for field in self.FIELDS)
+        while position < end:
+            key, position = _decode_varint(data, position, end)
+            number, wire_type = key >> 3, key & 7
+            if wire_type == WIRETYPE_VARINT:
+                value, position = _decode_varint(data, position, end)
+            elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+                length, position = _decode_varint(data, position, end)
+                value_start = position
+                position += length
+            elif wire_type == WIRETYPE_FIXED64:
+                position += 8
+            elif wire_type == WIRETYPE_FIXED32:
+                position += 4
+            else:
+                raise DecodeError('Unsupported wire type %d' % wire_type)
+            if position > end:
+                raise DecodeError('Truncated field %d' % number)
+            if number not in fields:
+                continue
+
+            number, name, label, field_type = fields[number]
+            expected_wire_type = WIRETYPE_VARINT if field_type in (INT32, INT64) else WIRETYPE_LENGTH_DELIMITED
+            if wire_type != expected_wire_type:
+                raise DecodeError('Field %s.%s has wire type %d' % (type(self).__name__, name, wire_type))
+            if field_type in (INT32, INT64):
+                if value >= 1 << 63:
+                    value -= 1 << 64
+            elif field_type == STRING:
+                try:
+                    value = data[value_start:position].decode('utf-8')
+                except UnicodeDecodeError:
+                    raise DecodeError('Field %s.%s is not valid UTF-8' % (type(self).__name__, name))
+            else:
+                # as in protobuf, a message field which occurs more than
+                # once is merged rather than replaced
+                message = getattr(self, name) if label != REPEATED else None
+                if message is None:
+                    message = field_type()
+                message._merge(data, value_start, position)
+                value = message
+            if label == REPEATED:
+                getattr(self, name).append(value)
+            else:
+                setattr(self, name, value)
+
+        for number, name, label, field_type in self.FIELDS:
+            if label == REQUIRED and getattr(self, name) is None:
+                raise DecodeError('Required field %s.%s is missing' % (type(self).__name__, name))
+
+class CodeModule(Message):
+    FIELDS = (
+        (1, 'base_address', OPTIONAL, INT64),
+        (2, 'size', OPTIONAL, INT64),
+        (3, 'code_file', OPTIONAL, STRING),
+        (4, 'code_identifier', OPTIONAL, STRING),
+        (5, 'debug_file', OPTIONAL, STRING),
+        (6, 'debug_identifier', OPTIONAL, STRING),
+        (7, 'version', OPTIONAL, STRING),
+    )
+    __slots__ = tuple(field[1] for field in FIELDS)
+
+class StackFrame(Message):
+    FIELDS = (
+        (1, 'instruction', REQUIRED, INT64),
+        (2, 'module', OPTIONAL, CodeModule),
+        (3, 'function_name', OPTIONAL, STRING),
+        (4, 'function_base', OPTIONAL, INT64),
+        (5, 'source_file_name', OPTIONAL, STRING),
+        (6, 'source_line', OPTIONAL, INT32),
+        (7, 'source_line_base', OPTIONAL, INT64),
+    )
+    __slots__ = tuple(field[1] for field in FIELDS)
+
+class ProcessStateProto(Message):
+    class Crash(Message):
+        FIELDS = (
+            (1, 'reason', REQUIRED, STRING),
+            (2, 'address', REQUIRED, INT64),
+        )
+        __slots__ = tuple(field[1] for field in FIELDS)
+
+    class Thread(Message):
+        FIELDS = (
+            (1, 'frames', REPEATED, StackFrame),
+        )
+        __slots__ = tuple(field[1] for field in FIELDS)
+
+    FIELDS = (
+        (1, 'time_date_stamp', OPTIONAL, INT64),
+        (2, 'crash', OPTIONAL, Crash),
+        (3, 'assertion', OPTIONAL, STRING),
+        (4, 'requesting_thread', OPTIONAL, INT32),
+        (5, 'threads', REPEATED, Thread),
+        (6, 'modules', REPEATED, CodeModule),
+        (7, 'os', OPTIONAL, STRING),
+        (8, 'os_short', OPTIONAL, STRING),
+        (9, 'os_version', OPTIONAL, STRING),
+        (10, 'cpu', OPTIONAL, STRING),
+        (11, 'cpu_info', OPTIONAL, STRING),
+        (12, 'cpu_count', OPTIONAL, INT32),
+    )
+    __slots__ = tuple(field[1] for field in FIELDS)
+
+# The messages declared in process_state.proto, including nested ones
+MESSAGES = [CodeModule, StackFrame, ProcessStateProto, ProcessStateProto.Crash, ProcessStateProto.Thread]
@@ -0,0 +1,147 @@
+"""
+result_cache keeps the output of symbolized stackwalks so that
+extract-stacktrace.py can return the stack trace of a minidump it has
+already processed without running minidump_stackwalk again.
+
+Results are keyed by the SHA-1 of the minidump's content together with
+a string identifying the tools and symbols used to process it, so a
+copy of a minidump under another name is also a hit, while the same
+minidump processed against another symbol server is not.
+
+The machine-readable output of minidump_stackwalk is stored, rather
+than the formatted stack trace, so a cached result serves any of
+extract-stacktrace.py's display and export options.
+
+Each result records, for every module in the minidump, when the newest
+symbols for that module were stored in the symbol cache (or that there
+were none). A result is discarded when symbols for any of its modules
+have since been added to or replaced in the symbol cache, since the
+stack trace may then symbolize differently. Symbols which are evicted
+from the symbol cache do not invalidate results.
+
+Results and their modules are kept in an SQLite database in the cache
+root. Results which have not been used for DEFAULT_MAX_AGE are removed
+when new results are stored.
+"""
+
+from __future__ import print_function
+from distutils.dir_util import mkpath
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import symbol_cache
+
+# Default location of the result cache
+DEFAULT_CACHE_ROOT = '%s/%s' % (tempfile.gettempdir(), 'stackwalk-result-cache')
+
+# Name of the database in the cache root
+INDEX_FILE_NAME = 'results.sqlite'
+
+# Default length of time in seconds after which unused results are removed
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+# Size of the chunks in which minidumps are read when hashing them
+CHUNK_SIZE = 64 * 1024
+
+class ResultCache:
+    """ A local cache of minidump_stackwalk output, validated against
+    the symbols in a symbol_cache.SymbolCache.
+    """
+    def __init__(self, root=DEFAULT_CACHE_ROOT, symbols=None, max_age=DEFAULT_MAX_AGE):
+        if symbols is None:
+            symbols = symbol_cache.SymbolCache()
+        self.root = root
+        self.symbols = symbols
+        self.max_age = max_age
+        mkpath(self.root)
+        self.index_path = os.path.join(self.root, INDEX_FILE_NAME)
+
+        connection = self._connect()
+        connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                key TEXT PRIMARY KEY,
+                                output BLOB NOT NULL,
+                                stored_at REAL NOT NULL,
+                                last_access REAL NOT NULL)""")
+        connection.execute("""CREATE TABLE IF NOT EXISTS result_modules (
+                                key TEXT NOT NULL,
+                                debug_id TEXT NOT NULL,
+                                symbols_stored_at REAL,
+                                PRIMARY KEY (key, debug_id))""")
+        connection.close()
+
+    def _connect(self):
+        # as in SymbolCache, a new connection is used for each operation
+        # so that a cache can be shared between processes
+        return sqlite3.connect(self.index_path, timeout=symbol_cache.INDEX_LOCK_TIMEOUT, isolation_level=None)
+
+    def key(self, dump_file, identity):
+        """ Returns the cache key for the result of processing 'dump_file'.
+        'identity' is a string identifying the stackwalk tool and
+        symbol source used.
+        """
+        digest = hashlib.sha1()
+        with open(dump_file, 'rb') as dump:
+            for chunk in iter(lambda: dump.read(CHUNK_SIZE), ''):
+                digest.update(chunk)
+        digest.update('\0' + identity)
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """ Returns the cached minidump_stackwalk output for a key, or None
+        if there is no result or newer symbols for any of its modules have
+        been stored since it was.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT output FROM results WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+            for debug_id, stored_at in connection.execute('SELECT debug_id, symbols_stored_at FROM result_modules WHERE key = ?',
+                                                          (key,)).fetchall():
+                current = self.symbols.symbols_stored_at(debug_id)
+                # symbols which have been evicted from, or were never in,
+                # the symbol cache do not invalidate the result; only
+                # symbols stored since it was do
+                if current is not None and (stored_at is None or current > stored_at):
+                    self._remove_result(connection, key)
+                    return None
+            connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+            return zlib.decompress(row[0])
+        finally:
+            connection.close()
+
+    def store(self, key, output, modules):
+        """ Save the minidump_stackwalk output for a key. 'modules' are the
+        minidump_stackwalk_processor.Modules in the output, whose symbols
+        the result is validated against.
+        """
+        now = time.time()
+        debug_ids = set(module.debug_id for module in modules if module.debug_id)
+        symbols_stored_at = [(debug_id, self.symbols.symbols_stored_at(debug_id)) for debug_id in debug_ids]
+
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._remove_result(connection, key)
+                connection.execute('INSERT INTO results (key, output, stored_at, last_access) VALUES (?, ?, ?, ?)',
+                                   (key, sqlite3.Binary(zlib.compress(output)), now, now))
+                connection.executemany('INSERT INTO result_modules (key, debug_id, symbols_stored_at) VALUES (?, ?, ?)',
+                                       [(key, debug_id, stored_at) for debug_id, stored_at in symbols_stored_at])
+                if self.max_age:
+                    for old_key, in connection.execute('SELECT key FROM results WHERE last_access < ?',
+                                                       (now - self.max_age,)).fetchall():
+                        self._remove_result(connection, old_key)
+            finally:
+                connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def _remove_result(self, connection, key):
+        connection.execute('DELETE FROM results WHERE key = ?', (key,))
+        connection.execute('DELETE FROM result_modules WHERE key = ?', (key,))
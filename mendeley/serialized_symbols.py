@@ -0,0 +1,501 @@
+"""
+serialized_symbols converts Breakpad text symbol files to the
+pre-parsed binary form which FastSourceLineResolver loads (see
+src/processor/module_serializer.h), and reads and validates that form.
+
+Loading a text symbol file into BasicSourceLineResolver parses every
+record, which takes seconds for large modules. FastSourceLineResolver
+instead uses the serialized data in place, so loading it is nearly
+free. fetch-symbols.py --serialized serves symbols in this form to
+minidump_stackwalk -f, converting each symbol file once and keeping the
+result in the symbol cache.
+
+serialize() follows BasicSourceLineResolver's rules for loading a
+symbol file, including which overlapping records are dropped, and
+produces the same bytes as ModuleSerializer. RangeMap and
+ContainedRangeMap implement the rules for dropping records, and are
+also used by symbol_file and symbol_shards. The serialized form has no
+header or checksum and FastSourceLineResolver does not check it, so
+SerializedSymbols.validate() checks the structure of the data for
+tools which maintain the cache.
+
+The serialized form is a header with the size of each of its maps,
+followed by the maps themselves: source files, functions (each with a
+map of its source lines), public symbols, one map of Windows stack
+frame info per STACK WIN type, and the STACK CFI INIT and STACK CFI
+rules. Integers are in the byte order of the machine which serialized
+the data.
+"""
+
+from __future__ import print_function
+
+import bisect
+import re
+import struct
+
+# Types of STACK WIN records, see WindowsFrameInfo::StackInfoTypes
+STACK_INFO_TYPES = 5
+
+# Number of maps in serialized symbols, see
+# FastSourceLineResolver::Module::kNumberMaps_
+MAP_COUNT = 5 + STACK_INFO_TYPES
+
+# WindowsFrameInfo::VALID_ALL
+WINDOWS_FRAME_INFO_VALID_ALL = -1
+
+MAX_ADDRESS = (1 << 64) - 1
+
+U32 = struct.Struct('=I')
+U64 = struct.Struct('=Q')
+HEADER = struct.Struct('=%dI' % MAP_COUNT)
+LINE = struct.Struct('=QQii')
+FUNCTION_FIELDS = struct.Struct('=QQi')
+PUBLIC_SYMBOL_FIELDS = struct.Struct('=Qi')
+WINDOWS_FRAME_INFO_FIELDS = struct.Struct('=iIIIIIIB')
+
+HEX_NUMBER = re.compile(r'\s*([+-]?)(?:0[xX])?([0-9a-fA-F]*)')
+DECIMAL_NUMBER = re.compile(r'\s*([+-]?[0-9]*)')
+
+class SerializedSymbolsError(Exception):
+    """ Raised when a symbol file cannot be loaded, or serialized symbols
+    are not valid
+    """
+    pass
+
+def _hex(token, bits=64):
+    """ Parse a hex number as strtoull() does, wrapping to 'bits' bits """
+    sign, digits = HEX_NUMBER.match(token).groups()
+    value = int(digits or '0', 16)
+    if sign == '-':
+        value = -value
+    return value & ((1 << bits) - 1)
+
+def _int32(value):
+    """ Truncate an integer to a signed 32-bit int, as a C cast does """
+    value &= 0xffffffff
+    if value & 0x80000000:
+        value -= 1 << 32
+    return value
+
+def _atoi(token):
+    value = DECIMAL_NUMBER.match(token).group(1)
+    if value in ('', '+', '-'):
+        return 0
+    return _int32(int(value))
+
+def _tokenize(line, max_tokens):
+    """ Split a record into 'max_tokens' fields as Tokenize() does, the
+    last of which is the remainder of the line. Returns None if there are
+    fewer fields.
+    """
+    tokens = []
+    rest = line
+    while len(tokens) < max_tokens - 1:
+        rest = rest.lstrip(' ')
+        if not rest:
+            return None
+        token, _, rest = rest.partition(' ')
+        tokens += [token]
+    if not rest:
+        return None
+    return tokens + [rest]
+
+class RangeMap:
+    """ A map of non-overlapping address ranges, as Breakpad's RangeMap
+    stores them. store() returns False for a range which RangeMap would
+    reject.
+    """
+    def __init__(self):
+        self.highs = []
+        self.ranges = []
+
+    def store(self, base, size, entry):
+        high = base + size - 1
+        if size == 0 or high > MAX_ADDRESS:
+            return False
+        position = bisect.bisect_left(self.highs, base)
+        if position != bisect.bisect_left(self.highs, high):
+            return False
+        if position < len(self.highs) and self.ranges[position][0] <= high:
+            return False
+        self.highs.insert(position, high)
+        self.ranges.insert(position, (base, entry))
+        return True
+
+class ContainedRangeMap:
+    """ A tree of address ranges in which each range must fully contain,
+    or be fully contained by, any range it overlaps, as Breakpad's
+    ContainedRangeMap stores them
+    """
+    def __init__(self, base=0, entry=None, highs=None, children=None):
+        self.base = base
+        self.entry = entry
+        self.highs = highs or []
+        self.children = children or []
+
+    def store(self, base, size, entry):
+        high = base + size - 1
+        if size == 0 or high > MAX_ADDRESS:
+            return False
+        position_base = bisect.bisect_left(self.highs, base)
+        position_high = bisect.bisect_left(self.highs, high)
+        count = len(self.highs)
+
+        if position_base == position_high and position_base < count and base >= self.children[position_base].base:
+            # the new range is within an existing child, which must not
+            # have exactly the same extent
+            child = self.children[position_base]
+            if child.base == base and self.highs[position_base] == high:
+                return False
+            return child.store(base, size, entry)
+
+        contains_high = position_high < count and high >= self.children[position_high].base
+        if ((position_base < count and base > self.children[position_base].base) or
+            (contains_high and high < self.highs[position_high])):
+            # partial containment of an existing child
+            return False
+        if contains_high:
+            position_high += 1
+
+        # existing children within the new range become its children
+        child = ContainedRangeMap(base, entry, self.highs[position_base:position_high],
+                                   self.children[position_base:position_high])
+        self.highs[position_base:position_high] = [high]
+        self.children[position_base:position_high] = [child]
+        return True
+
+class _Function:
+    __slots__ = ('name', 'address', 'size', 'parameter_size', 'lines')
+
+    def __init__(self, name, address, size, parameter_size):
+        self.name = name
+        self.address = address
+        self.size = size
+        self.parameter_size = parameter_size
+        self.lines = RangeMap()
+
+class _Module:
+    """ The maps of a symbol file, loaded as by BasicSourceLineResolver """
+    def __init__(self):
+        self.files = {}
+        self.functions = RangeMap()
+        self.public_symbols = {}
+        self.windows_frame_info = [ContainedRangeMap() for i in range(STACK_INFO_TYPES)]
+        self.cfi_initial_rules = RangeMap()
+        self.cfi_delta_rules = {}
+
+    def load(self, symbol_data):
+        function = None
+        # the text is read as a C string
+        symbol_data = symbol_data.split('\0', 1)[0]
+        for line_number, record in enumerate(re.split('[\r\n]+', symbol_data), 1):
+            if not record:
+                continue
+            if record.startswith('FILE '):
+                tokens = _tokenize(record[5:], 2)
+                if not tokens or _atoi(tokens[0]) < 0:
+                    self._error(line_number, record)
+                self.files.setdefault(_atoi(tokens[0]), tokens[1])
+            elif record.startswith('STACK '):
+                if not self._load_stack_info(record[6:]):
+                    self._error(line_number, record)
+            elif record.startswith('FUNC '):
+                tokens = _tokenize(record[5:], 4)
+                if not tokens:
+                    self._error(line_number, record)
+                function = _Function(tokens[3], _hex(tokens[0]), _hex(tokens[1]), _int32(_hex(tokens[2])))
+                # invalid or overlapping functions are dropped along
+                # with their lines
+                self.functions.store(function.address, function.size, function)
+            elif record.startswith('PUBLIC '):
+                function = None
+                tokens = _tokenize(record[7:], 3)
+                if not tokens:
+                    self._error(line_number, record)
+                address = _hex(tokens[0])
+                # public symbols at address 0 are ignored, but two at
+                # any other address are an error
+                if address:
+                    if address in self.public_symbols:
+                        self._error(line_number, record)
+                    self.public_symbols[address] = (tokens[2], address, _int32(_hex(tokens[1])))
+            elif record.startswith('MODULE ') or record.startswith('INFO '):
+                pass
+            else:
+                tokens = _tokenize(record, 4)
+                if not function or not tokens or _atoi(tokens[2]) <= 0:
+                    self._error(line_number, record)
+                address = _hex(tokens[0])
+                size = _hex(tokens[1])
+                function.lines.store(address, size, (address, size, _atoi(tokens[3]), _atoi(tokens[2])))
+
+    def _load_stack_info(self, record):
+        platform, _, rest = record.lstrip(' ').partition(' ')
+        if platform == 'WIN':
+            tokens = _tokenize(rest, 11)
+            if not tokens:
+                return False
+            stack_info_type = _int32(_hex(tokens[0]))
+            if stack_info_type < 0 or stack_info_type >= STACK_INFO_TYPES:
+                return False
+            sizes = [_hex(token, 32) for token in tokens[3:9]]
+            if _hex(tokens[9], 32):
+                frame_info = (sizes, 0, tokens[10])
+            else:
+                frame_info = (sizes, _hex(tokens[10], 32) != 0, '')
+            # ranges which violate the containment rules are dropped
+            self.windows_frame_info[stack_info_type].store(_hex(tokens[1]), _hex(tokens[2]), frame_info)
+            return True
+        elif platform == 'CFI':
+            fields = rest.lstrip(' ').split(' ', 1)
+            if fields[0] == 'INIT':
+                fields = fields[1:]
+                if fields:
+                    fields = fields[0].lstrip(' ').split(' ', 1)
+                if len(fields) < 2:
+                    return False
+                address = _hex(fields[0])
+                fields = fields[1].lstrip(' ').split(' ', 1)
+                if len(fields) < 2 or not fields[1]:
+                    return False
+                self.cfi_initial_rules.store(address, _hex(fields[0]), fields[1])
+                return True
+            if len(fields) < 2 or not fields[1]:
+                return False
+            self.cfi_delta_rules[_hex(fields[0])] = fields[1]
+            return True
+        return False
+
+    def _error(self, line_number, record):
+        raise SerializedSymbolsError('Invalid symbol file record at line %d: %s' % (line_number, record[:100]))
+
+def _write_map(key_format, items, write_value):
+    """ Serialize a sorted list of (key, value) pairs as StdMapSerializer
+    and RangeMapSerializer do: a count, the offset of each value from the
+    start of the map, the keys and then the values.
+    """
+    count = len(items)
+    values = []
+    offset = U32.size + count * (U32.size + struct.calcsize(key_format))
+    offsets = []
+    for key, value in items:
+        data = write_value(value)
+        offsets += [offset]
+        offset += len(data)
+        values += [data]
+    return ''.join([U32.pack(count), struct.pack('=%dI' % count, *offsets),
+                    struct.pack('=%d%s' % (count, key_format), *[key for key, value in items])] + values)
+
+def _write_range_map(range_map, write_entry):
+    def write_range(base_and_entry):
+        base, entry = base_and_entry
+        return U64.pack(base) + write_entry(entry)
+    return _write_map('Q', zip(range_map.highs, range_map.ranges), write_range)
+
+def _write_line(line):
+    address, size, source_file_id, line_number = line
+    return LINE.pack(address, size, source_file_id, line_number)
+
+def _write_function(function):
+    return (function.name + '\0' + FUNCTION_FIELDS.pack(function.address, function.size, function.parameter_size) +
+            _write_range_map(function.lines, _write_line))
+
+def _write_public_symbol(symbol):
+    name, address, parameter_size = symbol
+    return name + '\0' + PUBLIC_SYMBOL_FIELDS.pack(address, parameter_size)
+
+def _write_windows_frame_info(frame_info):
+    if frame_info is None:
+        return ''
+    sizes, allocates_base_pointer, program_string = frame_info
+    allocates_base_pointer = allocates_base_pointer and 255 or 0
+    return (WINDOWS_FRAME_INFO_FIELDS.pack(WINDOWS_FRAME_INFO_VALID_ALL, *(sizes + [allocates_base_pointer])) +
+            program_string + '\0')
+
+def _write_contained_range_map(node):
+    entry = _write_windows_frame_info(node.entry)
+    children = _write_map('Q', zip(node.highs, node.children), _write_contained_range_map)
+    return U64.pack(node.base) + U32.pack(len(entry)) + entry + children
+
+def _write_string(value):
+    return value + '\0'
+
+def serialize(symbol_data):
+    """ Convert the contents of a text symbol file to serialized symbols.
+    Raises SerializedSymbolsError if BasicSourceLineResolver would fail
+    to load the symbol file.
+    """
+    module = _Module()
+    module.load(symbol_data)
+    maps = [_write_map('i', sorted(module.files.items()), _write_string),
+            _write_range_map(module.functions, _write_function),
+            _write_map('Q', sorted(module.public_symbols.items()), _write_public_symbol)]
+    maps += [_write_contained_range_map(frame_info) for frame_info in module.windows_frame_info]
+    maps += [_write_range_map(module.cfi_initial_rules, _write_string),
+             _write_map('Q', sorted(module.cfi_delta_rules.items()), _write_string)]
+    return ''.join([HEADER.pack(*[len(data) for data in maps])] + maps + ['\0'])
+
+class SerializedSymbols:
+    """ Reads serialized symbols, such as a cache entry produced by
+    serialize().
+
+    'data' is a string or buffer (such as an mmap) holding the serialized
+    symbols. The constructor only reads the header, call validate() to
+    check the whole structure.
+    """
+    def __init__(self, data):
+        self.data = data
+        if len(data) < HEADER.size + 1:
+            raise SerializedSymbolsError('Serialized symbols are truncated')
+        self.map_sizes = HEADER.unpack_from(data, 0)
+        self.map_offsets = []
+        offset = HEADER.size
+        for size in self.map_sizes:
+            self.map_offsets += [offset]
+            offset += size
+        if offset + 1 != len(data):
+            raise SerializedSymbolsError('Serialized symbols are %d bytes, but their header describes %d' %
+                                         (len(data), offset + 1))
+        self.counts = None
+
+    def _map(self, start, end, key_format):
+        """ Returns the keys of a serialized map and the offsets of its values
+        within the data, checking that they lie within [start, end) and that
+        the keys are in ascending order
+        """
+        if start + U32.size > end:
+            raise SerializedSymbolsError('Map at offset %d is truncated' % start)
+        count, = U32.unpack_from(self.data, start)
+        key_size = struct.calcsize(key_format)
+        values_start = start + U32.size + count * (U32.size + key_size)
+        if values_start > end:
+            raise SerializedSymbolsError('Map at offset %d with %d entries is truncated' % (start, count))
+        offsets = struct.unpack_from('=%dI' % count, self.data, start + U32.size)
+        keys = struct.unpack_from('=%d%s' % (count, key_format), self.data, start + U32.size + count * U32.size)
+        previous_offset = values_start - start
+        for index in range(count):
+            if offsets[index] < previous_offset or start + offsets[index] > end:
+                raise SerializedSymbolsError('Entry %d of map at offset %d is out of bounds' % (index, start))
+            if index and keys[index] <= keys[index - 1]:
+                raise SerializedSymbolsError('Keys of map at offset %d are not in ascending order' % start)
+            previous_offset = offsets[index]
+        return keys, [start + offset for offset in offsets]
+
+    def _string(self, offset, end):
+        terminator = self.data.find('\0', offset, end)
+        if terminator < 0:
+            raise SerializedSymbolsError('String at offset %d is not terminated' % offset)
+        return self.data[offset:terminator], terminator + 1
+
+    def _check_range_map(self, start, end, check_entry):
+        keys, offsets = self._map(start, end, 'Q')
+        previous_high = None
+        for index, high in enumerate(keys):
+            entry_end = end
+            if index + 1 < len(offsets):
+                entry_end = offsets[index + 1]
+            if offsets[index] + U64.size > entry_end:
+                raise SerializedSymbolsError('Range at offset %d is truncated' % offsets[index])
+            base, = U64.unpack_from(self.data, offsets[index])
+            if base > high or (previous_high is not None and base <= previous_high):
+                raise SerializedSymbolsError('Range at offset %d overlaps another' % offsets[index])
+            previous_high = high
+            check_entry(offsets[index] + U64.size, entry_end)
+        return len(keys)
+
+    def _check_line(self, start, end):
+        if start + LINE.size != end:
+            raise SerializedSymbolsError('Line at offset %d has the wrong size' % start)
+        self.counts['lines'] += 1
+
+    def _check_function(self, start, end):
+        name, offset = self._string(start, end)
+        if offset + FUNCTION_FIELDS.size > end:
+            raise SerializedSymbolsError('Function at offset %d is truncated' % start)
+        self._check_range_map(offset + FUNCTION_FIELDS.size, end, self._check_line)
+
+    def _check_public_symbol(self, start, end):
+        name, offset = self._string(start, end)
+        if offset + PUBLIC_SYMBOL_FIELDS.size != end:
+            raise SerializedSymbolsError('Public symbol at offset %d has the wrong size' % start)
+
+    def _check_string(self, start, end):
+        value, offset = self._string(start, end)
+        if offset != end:
+            raise SerializedSymbolsError('String at offset %d has the wrong size' % start)
+
+    def _check_contained_range_map(self, start, end, low=0, high=MAX_ADDRESS):
+        if start + U64.size + U32.size > end:
+            raise SerializedSymbolsError('Range at offset %d is truncated' % start)
+        base, = U64.unpack_from(self.data, start)
+        entry_size, = U32.unpack_from(self.data, start + U64.size)
+        entry_start = start + U64.size + U32.size
+        if entry_start + entry_size > end:
+            raise SerializedSymbolsError('Range at offset %d is truncated' % start)
+        if entry_size:
+            if entry_size < WINDOWS_FRAME_INFO_FIELDS.size + 1:
+                raise SerializedSymbolsError('Stack frame info at offset %d is truncated' % entry_start)
+            self._check_string(entry_start + WINDOWS_FRAME_INFO_FIELDS.size, entry_start + entry_size)
+        keys, offsets = self._map(entry_start + entry_size, end, 'Q')
+        previous_high = None
+        for index, child_high in enumerate(keys):
+            child_end = end
+            if index + 1 < len(offsets):
+                child_end = offsets[index + 1]
+            child_base = self._check_contained_range_map(offsets[index], child_end, low, child_high)
+            if (child_base > child_high or child_base < low or child_high > high or
+                (previous_high is not None and child_base <= previous_high)):
+                raise SerializedSymbolsError('Range at offset %d is not contained by its parent' % offsets[index])
+            previous_high = child_high
+            self.counts['windows_frame_info'] += 1
+        return base
+
+    def validate(self):
+        """ Check the structure of the serialized symbols. Raises
+        SerializedSymbolsError if they are not valid, and otherwise returns
+        a dict with the number of each kind of record.
+        """
+        if self.data[-1] != '\0':
+            raise SerializedSymbolsError('Serialized symbols are not terminated')
+        self.counts = dict((name, 0) for name in ['lines', 'windows_frame_info'])
+        ends = self.map_offsets[1:] + [len(self.data) - 1]
+        files = self._map(self.map_offsets[0], ends[0], 'i')[1]
+        for index, offset in enumerate(files):
+            self._check_string(offset, (files + [ends[0]])[index + 1])
+        self.counts['files'] = len(files)
+        self.counts['functions'] = self._check_range_map(self.map_offsets[1], ends[1], self._check_function)
+        public_symbols = self._map(self.map_offsets[2], ends[2], 'Q')[1]
+        for index, offset in enumerate(public_symbols):
+            self._check_public_symbol(offset, (public_symbols + [ends[2]])[index + 1])
+        self.counts['public_symbols'] = len(public_symbols)
+        for map_index in range(3, 3 + STACK_INFO_TYPES):
+            self._check_contained_range_map(self.map_offsets[map_index], ends[map_index])
+        self.counts['cfi_initial_rules'] = self._check_range_map(self.map_offsets[MAP_COUNT - 2], ends[MAP_COUNT - 2],
+                                                                 self._check_string)
+        cfi_delta_rules = self._map(self.map_offsets[MAP_COUNT - 1], ends[MAP_COUNT - 1], 'Q')[1]
+        for index, offset in enumerate(cfi_delta_rules):
+            self._check_string(offset, (cfi_delta_rules + [ends[MAP_COUNT - 1]])[index + 1])
+        self.counts['cfi_delta_rules'] = len(cfi_delta_rules)
+        return self.counts
+
+    def files(self):
+        """ Returns a dict mapping source file IDs to names """
+        keys, offsets = self._map(self.map_offsets[0], self.map_offsets[1], 'i')
+        return dict((key, self._string(offset, self.map_offsets[1])[0]) for key, offset in zip(keys, offsets))
+
+    def functions(self):
+        """ Returns a list of (name, address, size) tuples for the functions """
+        end = self.map_offsets[2]
+        keys, offsets = self._map(self.map_offsets[1], end, 'Q')
+        functions = []
+        for offset in offsets:
+            name, fields_offset = self._string(offset + U64.size, end)
+            address, size, parameter_size = FUNCTION_FIELDS.unpack_from(self.data, fields_offset)
+            functions += [(name, address, size)]
+        return functions
+
+    def public_symbols(self):
+        """ Returns a list of (name, address) tuples for the public symbols """
+        end = self.map_offsets[3]
+        keys, offsets = self._map(self.map_offsets[2], end, 'Q')
+        return [(self._string(offset, end)[0], key) for key, offset in zip(keys, offsets)]
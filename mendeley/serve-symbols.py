@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""Serve a directory of Breakpad symbol files over HTTP.
+
+Symbol files are served from '<dir>/<debug file>/<debug id>/<name>.sym',
+the layout fetch-symbols.py requests, along with any other files in the
+directory such as the shards written by shard-symbols.py. Range
+requests, gzip content encoding, conditional requests and concurrent
+clients are supported, see symbol_server.py.
+
+With --allow-upload, symbol files can be added with upload-symbols.py.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import symbol_server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a directory of symbol files over HTTP for fetch-symbols.py')
+    parser.add_argument('root', type=str, help='Directory of symbol files to serve')
+    parser.add_argument('--host', type=str, action='store', dest='host', default='127.0.0.1',
+      help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, action='store', dest='port', default=8000,
+      help='Port to listen on (default: 8000)')
+    parser.add_argument('--allow-upload', action='store_true', dest='allow_upload',
+      help='Accept symbol files uploaded with PUT requests, such as from upload-symbols.py')
+    parser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
+      help='Log each request to stderr')
+    args = parser.parse_args()
+
+    server = symbol_server.SymbolServer((args.host, args.port), args.root, args.allow_upload, args.verbose)
+    print('Serving symbols from %s on %s' % (args.root, server.url), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
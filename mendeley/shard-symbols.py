@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Split the symbol files on a symbol server into address-range shards.
+
+For each '<name>.sym' found under the given files or directories, the
+shards and their index are written to the '<name>.sym.shards'
+directory next to it, which fetch-symbols.py --addresses fetches from
+to assemble symbol files trimmed to the addresses a minidump refers to.
+See symbol_shards.py.
+
+Symbol files whose shards are newer than the symbol file itself are
+skipped unless --force is given, so this can be re-run over a symbol
+server's directory after each upload.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import symbol_shards
+
+def find_symbol_files(paths):
+    """ Returns the .sym files given in 'paths' or found in directories in
+    'paths'
+    """
+    symbol_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            symbol_files += [path]
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            # shard directories are not searched
+            dir_names[:] = [name for name in dir_names if not name.endswith(symbol_shards.SHARDS_SUFFIX)]
+            symbol_files += [os.path.join(dir_path, name) for name in sorted(file_names) if name.endswith('.sym')]
+    return symbol_files
+
+def shard_symbol_file(symbol_path, shard_size=symbol_shards.DEFAULT_SHARD_SIZE, force=False):
+    """ Write the shards of a symbol file. Returns the ShardIndex, or
+    None if the existing shards are up to date.
+    """
+    shards_path = symbol_path + symbol_shards.SHARDS_SUFFIX
+    index_path = os.path.join(shards_path, symbol_shards.INDEX_NAME)
+    if (not force and os.path.exists(index_path) and
+        os.path.getmtime(index_path) >= os.path.getmtime(symbol_path)):
+        return None
+
+    with open(symbol_path, 'rb') as symbol_file:
+        index, shards = symbol_shards.build_shards(symbol_file.read(), shard_size)
+
+    # the shards are written to a new directory which then replaces any
+    # previous one, so a symbol server never serves a mix of the two
+    parent_dir = os.path.dirname(os.path.abspath(symbol_path))
+    temp_path = tempfile.mkdtemp(dir=parent_dir, prefix='.tmp-')
+    try:
+        for position, data in enumerate(shards):
+            with open(os.path.join(temp_path, symbol_shards.shard_name(position)), 'wb') as shard_file:
+                shard_file.write(data)
+        with open(os.path.join(temp_path, symbol_shards.INDEX_NAME), 'wb') as index_file:
+            index_file.write(index.format())
+        os.chmod(temp_path, 0o755)
+
+        old_path = None
+        if os.path.exists(shards_path):
+            old_path = tempfile.mkdtemp(dir=parent_dir, prefix='.tmp-')
+            os.rename(shards_path, os.path.join(old_path, 'shards'))
+        os.rename(temp_path, shards_path)
+        if old_path:
+            shutil.rmtree(old_path)
+    except:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description='Split symbol files into address-range shards for fetch-symbols.py --addresses')
+    parser.add_argument('paths', type=str, nargs='+',
+      help='Symbol files, or directories such as the root of a symbol server, to search for .sym files')
+    parser.add_argument('--shard-size', type=int, action='store', dest='shard_size',
+      default=symbol_shards.DEFAULT_SHARD_SIZE,
+      help='Approximate size of each shard in bytes (default: %d)' % symbol_shards.DEFAULT_SHARD_SIZE)
+    parser.add_argument('-f', '--force', action='store_true', dest='force',
+      help='Rewrite the shards of symbol files even if they are up to date')
+    args = parser.parse_args()
+
+    failed_count = 0
+    for symbol_path in find_symbol_files(args.paths):
+        try:
+            index = shard_symbol_file(symbol_path, args.shard_size, args.force)
+        except (IOError, OSError, symbol_shards.SymbolShardsError) as err:
+            print('Unable to shard %s: %s' % (symbol_path, err), file=sys.stderr)
+            failed_count += 1
+            continue
+        if index:
+            print('%s: %d shards' % (symbol_path, len(index.shards)))
+
+    if failed_count > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
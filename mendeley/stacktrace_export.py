@@ -0,0 +1,344 @@
+"""
+stacktrace_export writes parsed stack traces to a compact columnar
+file for bulk analysis, and reads them back.
+
+Traces are written in batches. Each batch stores its traces, modules
+and frames as typed columns of integers, one column per field, and all
+names (modules, functions, source files, versions and so on) in a
+single string table which the columns refer to by index. Since the
+same few modules and functions appear in most crashes, each name is
+stored once per batch. Addresses are stored as 64-bit integers rather
+than strings. Each column is compressed with zlib.
+
+A file can be read back in a single pass with read_batches(), giving
+TraceBatch objects whose columns can be analyzed directly, or converted
+back into Stacktrace objects with TraceBatch.stacktraces().
+
+File layout (all integers are little-endian):
+
+  file header:   'BPTRACE' + format version (1 byte)
+  batch header:  number of traces (uint32), number of columns (uint16)
+  column:        name length (uint16), name, element type (1 byte, see
+                 COLUMN_TYPES), compressed length (uint32),
+                 zlib-compressed column data
+"""
+
+from __future__ import print_function
+
+import array
+import struct
+import sys
+import zlib
+
+import minidump_stackwalk_processor
+
+FILE_MAGIC = 'BPTRACE'
+FORMAT_VERSION = 1
+
+# Default number of traces written in each batch
+DEFAULT_BATCH_SIZE = 1000
+
+# Index used in string columns for missing values
+NO_STRING = -1
+
+# Value used in integer columns for missing values
+NO_VALUE = -1
+
+def _typecode(size):
+    """ Returns the typecode of a signed array element of 'size' bytes """
+    for typecode in 'bhilq':
+        try:
+            if array.array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            # 'q' is not supported by older Pythons
+            pass
+    raise ValueError('No %d byte array type is available on this platform' % size)
+
+# Element types of columns, mapped to the typecodes of the arrays
+# which hold them. 'B' columns hold raw bytes.
+COLUMN_TYPES = {
+    'i' : _typecode(4),
+    'q' : _typecode(8),
+    'B' : 'B',
+}
+
+# Columns of a batch, with their element types. The '*_start' columns
+# hold, for each trace, the index of its first module or frame, plus a
+# final entry with the total count.
+COLUMNS = [
+    ('strings_start', 'i'),
+    ('strings_data', 'B'),
+
+    ('trace_dump_file', 'i'),
+    ('trace_main_module', 'i'),
+    ('trace_os_platform', 'i'),
+    ('trace_os_build', 'i'),
+    ('trace_cpu_type', 'i'),
+    ('trace_cpu_model', 'i'),
+    ('trace_cpu_cores', 'i'),
+    ('trace_crash_type', 'i'),
+    ('trace_crash_addr', 'q'),
+    ('trace_crash_thread', 'i'),
+    ('trace_module_start', 'i'),
+    ('trace_frame_start', 'i'),
+
+    ('module_filename', 'i'),
+    ('module_version', 'i'),
+    ('module_debug_filename', 'i'),
+    ('module_debug_id', 'i'),
+    ('module_base_addr', 'q'),
+    ('module_max_addr', 'q'),
+
+    ('frame_thread', 'i'),
+    ('frame_module', 'i'),
+    ('frame_function', 'i'),
+    ('frame_source_file', 'i'),
+    ('frame_line', 'i'),
+    ('frame_addr', 'q'),
+]
+
+class ExportFormatError(Exception):
+    """ Raised when reading a file which is not a valid stack trace export """
+    pass
+
+def _parse_int(value, base=10):
+    try:
+        return int(value, base)
+    except (TypeError, ValueError):
+        return NO_VALUE
+
+def _parse_addr(value):
+    # addresses are unsigned but stored in signed columns, so the upper
+    # half of the address space wraps around to negative values. This
+    # leaves 0xffffffffffffffff indistinguishable from a missing address.
+    addr = _parse_int(value, 16)
+    if addr >= 1 << 63:
+        addr -= 1 << 64
+    return addr
+
+def _new_columns():
+    return dict((name, array.array(COLUMN_TYPES[column_type])) for name, column_type in COLUMNS)
+
+class TraceWriter:
+    """ Writes Stacktraces to a file object in batches of 'batch_size'.
+
+    Call close() once all traces have been added to write the final
+    batch. This does not close the file object.
+    """
+    def __init__(self, out, batch_size=DEFAULT_BATCH_SIZE):
+        self.out = out
+        self.batch_size = batch_size
+        self.out.write(FILE_MAGIC + chr(FORMAT_VERSION))
+        self._start_batch()
+
+    def _start_batch(self):
+        self.columns = _new_columns()
+        self.strings = {}
+        self.trace_count = 0
+
+    def _string(self, value):
+        if value is None:
+            return NO_STRING
+        index = self.strings.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings[value] = index
+        return index
+
+    def add(self, trace, dump_file=None):
+        """ Add a Stacktrace, optionally with the path of its minidump """
+        columns = self.columns
+        string = self._string
+
+        columns['trace_dump_file'].append(string(dump_file))
+        columns['trace_main_module'].append(string(trace.main_module))
+        os_version = trace.os_version
+        columns['trace_os_platform'].append(string(os_version and os_version.platform))
+        columns['trace_os_build'].append(string(os_version and os_version.build_id))
+        cpu_info = trace.cpu_info
+        columns['trace_cpu_type'].append(string(cpu_info and cpu_info.type))
+        columns['trace_cpu_model'].append(string(cpu_info and cpu_info.model))
+        columns['trace_cpu_cores'].append(cpu_info.core_count if cpu_info else NO_VALUE)
+        crash_info = trace.crash_info
+        columns['trace_crash_type'].append(string(crash_info and crash_info.type))
+        columns['trace_crash_addr'].append(_parse_addr(crash_info.addr) if crash_info else NO_VALUE)
+        columns['trace_crash_thread'].append(crash_info.thread_id if crash_info else NO_VALUE)
+
+        columns['trace_module_start'].append(len(columns['module_filename']))
+        for module in trace.modules.values():
+            columns['module_filename'].append(string(module.filename))
+            columns['module_version'].append(string(module.version))
+            columns['module_debug_filename'].append(string(module.debug_filename))
+            columns['module_debug_id'].append(string(module.debug_id))
+            columns['module_base_addr'].append(_parse_addr(module.base_addr))
+            columns['module_max_addr'].append(_parse_addr(module.max_addr))
+
+        columns['trace_frame_start'].append(len(columns['frame_thread']))
+        for thread_id, frames in trace.threads.items():
+            for frame in frames:
+                columns['frame_thread'].append(thread_id)
+                columns['frame_module'].append(string(frame.module))
+                columns['frame_function'].append(string(frame.function))
+                columns['frame_source_file'].append(string(frame.line))
+                columns['frame_line'].append(_parse_int(frame.column))
+                columns['frame_addr'].append(_parse_addr(frame.addr))
+
+        self.trace_count += 1
+        if self.trace_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the traces added since the last batch as a new batch """
+        if not self.trace_count:
+            return
+        columns = self.columns
+        columns['trace_module_start'].append(len(columns['module_filename']))
+        columns['trace_frame_start'].append(len(columns['frame_thread']))
+
+        strings = [None] * len(self.strings)
+        for value, index in self.strings.items():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            strings[index] = value
+        offset = 0
+        for value in strings:
+            columns['strings_start'].append(offset)
+            offset += len(value)
+        columns['strings_start'].append(offset)
+        columns['strings_data'].fromstring(''.join(strings))
+
+        self.out.write(struct.pack('<IH', self.trace_count, len(COLUMNS)))
+        for name, column_type in COLUMNS:
+            column = columns[name]
+            if sys.byteorder != 'little':
+                column.byteswap()
+            data = zlib.compress(column.tostring())
+            self.out.write(struct.pack('<H', len(name)) + name)
+            self.out.write(struct.pack('<cI', column_type, len(data)))
+            self.out.write(data)
+        self._start_batch()
+
+    def close(self):
+        self.flush()
+
+class TraceBatch:
+    """ A batch of stack traces read from an export file.
+
+    'columns' maps each column name (see COLUMNS) to an array of its
+    values and 'strings' is the batch's string table, which string
+    columns index into.
+    """
+    def __init__(self, trace_count, columns):
+        self.trace_count = trace_count
+        self.columns = columns
+        starts = columns['strings_start']
+        data = columns['strings_data'].tostring()
+        self.strings = [data[starts[i]:starts[i + 1]] for i in range(len(starts) - 1)]
+
+    def string(self, index):
+        if index == NO_STRING:
+            return None
+        return self.strings[index]
+
+    def column_strings(self, name):
+        """ Returns the values of a string column """
+        return [self.string(index) for index in self.columns[name]]
+
+    def stacktraces(self):
+        """ Reconstruct the Stacktraces in the batch. Yields a
+        (dump file, Stacktrace) tuple for each trace.
+        """
+        columns = self.columns
+        string = self.string
+        processor = minidump_stackwalk_processor
+
+        for i in range(self.trace_count):
+            os_version = None
+            if columns['trace_os_platform'][i] != NO_STRING:
+                os_version = processor.OSVersion(string(columns['trace_os_platform'][i]),
+                                                 string(columns['trace_os_build'][i]))
+            cpu_info = None
+            if columns['trace_cpu_type'][i] != NO_STRING:
+                cpu_info = processor.CpuInfo(string(columns['trace_cpu_type'][i]),
+                                             string(columns['trace_cpu_model'][i]),
+                                             columns['trace_cpu_cores'][i])
+            crash_info = None
+            if columns['trace_crash_type'][i] != NO_STRING:
+                crash_info = processor.CrashInfo(string(columns['trace_crash_type'][i]),
+                                                 _format_addr(columns['trace_crash_addr'][i]),
+                                                 columns['trace_crash_thread'][i])
+
+            modules = {}
+            for m in range(columns['trace_module_start'][i], columns['trace_module_start'][i + 1]):
+                module = processor.Module(string(columns['module_filename'][m]),
+                                          string(columns['module_version'][m]),
+                                          string(columns['module_debug_filename'][m]),
+                                          string(columns['module_debug_id'][m]),
+                                          _format_addr(columns['module_base_addr'][m], '0x%08x'),
+                                          _format_addr(columns['module_max_addr'][m], '0x%08x'))
+                modules[module.filename] = module
+
+            threads = {}
+            for f in range(columns['trace_frame_start'][i], columns['trace_frame_start'][i + 1]):
+                line = columns['frame_line'][f]
+                frame = processor.Frame(string(columns['frame_module'][f]),
+                                        string(columns['frame_function'][f]),
+                                        string(columns['frame_source_file'][f]),
+                                        str(line) if line != NO_VALUE else '',
+                                        _format_addr(columns['frame_addr'][f]))
+                threads.setdefault(columns['frame_thread'][f], []).append(frame)
+
+            trace = processor.Stacktrace(string(columns['trace_main_module'][i]), modules, threads,
+                                         crash_info, cpu_info, os_version)
+            yield (string(columns['trace_dump_file'][i]), trace)
+
+def _format_addr(value, format='0x%x'):
+    if value == NO_VALUE:
+        return ''
+    if value < 0:
+        value += 1 << 64
+    return format % value
+
+def read_batches(source):
+    """ Read the batches of traces from an export file, given as a path
+    or file object. Returns a list of TraceBatch objects.
+
+    The whole file is read at once.
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as input_file:
+            data = input_file.read()
+    else:
+        data = source.read()
+
+    header_size = len(FILE_MAGIC) + 1
+    if data[:len(FILE_MAGIC)] != FILE_MAGIC:
+        raise ExportFormatError('Not a stack trace export file')
+    if ord(data[len(FILE_MAGIC)]) != FORMAT_VERSION:
+        raise ExportFormatError('Unsupported export format version %d' % ord(data[len(FILE_MAGIC)]))
+
+    batches = []
+    offset = header_size
+    try:
+        while offset < len(data):
+            trace_count, column_count = struct.unpack_from('<IH', data, offset)
+            offset += struct.calcsize('<IH')
+            columns = {}
+            for i in range(column_count):
+                name_length, = struct.unpack_from('<H', data, offset)
+                offset += 2
+                name = data[offset:offset + name_length]
+                offset += name_length
+                column_type, data_length = struct.unpack_from('<cI', data, offset)
+                offset += struct.calcsize('<cI')
+                column = array.array(COLUMN_TYPES[column_type])
+                column.fromstring(zlib.decompress(data[offset:offset + data_length]))
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                offset += data_length
+                columns[name] = column
+            batches += [TraceBatch(trace_count, columns)]
+    except (struct.error, zlib.error, KeyError) as err:
+        raise ExportFormatError('Truncated or corrupt export file: %s' % err)
+    return batches
@@ -0,0 +1,222 @@
+"""
+stacktrace_proto converts Stacktraces to and from Breakpad's
+ProcessStateProto message (src/processor/proto/process_state.proto)
+and reads and writes streams of them, for archiving processed crashes
+without having to re-symbolize them.
+
+Each message in a stream is preceded by its length as a varint, as
+written by writeDelimitedTo() in the Java and C++ protobuf libraries.
+
+The messages are encoded by process_state_proto, so no protobuf
+runtime is needed.
+
+The conversion follows minidump_stackwalk's machine-readable output:
+
+ - Threads are stored in order of their thread number, which is their
+   index in the minidump, so threads whose frames were not kept are
+   stored as empty threads.
+ - The main module is stored first in the module list.
+ - A frame's offset in the output is its instruction address relative
+   to its source line, function or module base, or the absolute
+   address if the frame has no module. Stored frames satisfy the same
+   relation, so only the module bases and the addresses of frames
+   without a function are absolute.
+"""
+
+from __future__ import print_function
+
+import minidump_stackwalk_processor
+import process_state_proto
+
+def _parse_int(value, base=10):
+    try:
+        return int(value, base)
+    except (TypeError, ValueError):
+        return None
+
+def _int64(value):
+    # addresses are unsigned, but are stored in int64 fields
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+def _uint64(value):
+    if value < 0:
+        value += 1 << 64
+    return value
+
+def _to_unicode(value):
+    # string fields hold unicode, which is encoded as UTF-8, so output
+    # which is not valid UTF-8 is replaced
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+def _from_unicode(value):
+    if value is None:
+        return ''
+    return value.encode('utf-8')
+
+def to_proto(trace):
+    """ Convert a Stacktrace to a process_state_proto.ProcessStateProto """
+    proto = process_state_proto.ProcessStateProto()
+    if trace.os_version:
+        proto.os = _to_unicode(trace.os_version.platform)
+        proto.os_version = _to_unicode(trace.os_version.build_id)
+    if trace.cpu_info:
+        proto.cpu = _to_unicode(trace.cpu_info.type)
+        proto.cpu_info = _to_unicode(trace.cpu_info.model)
+        proto.cpu_count = trace.cpu_info.core_count
+    if trace.crash_info:
+        proto.crash = process_state_proto.ProcessStateProto.Crash(
+            reason=_to_unicode(trace.crash_info.type),
+            address=_int64(_parse_int(trace.crash_info.addr, 16) or 0))
+        proto.requesting_thread = trace.crash_info.thread_id
+
+    module_bases = {}
+    modules = sorted(trace.modules.values(), key=lambda module: module.filename != trace.main_module)
+    for module in modules:
+        module_proto = process_state_proto.CodeModule(code_file=_to_unicode(module.filename),
+                                                      version=_to_unicode(module.version),
+                                                      debug_file=_to_unicode(module.debug_filename),
+                                                      debug_identifier=_to_unicode(module.debug_id))
+        base_addr = _parse_int(module.base_addr, 16)
+        max_addr = _parse_int(module.max_addr, 16)
+        if base_addr is not None:
+            module_proto.base_address = _int64(base_addr)
+            module_bases[module.filename] = base_addr
+            if max_addr is not None:
+                module_proto.size = max_addr - base_addr + 1
+        proto.modules.append(module_proto)
+
+    thread_count = 0
+    if trace.threads:
+        thread_count = max(trace.threads.keys()) + 1
+    for thread_id in range(thread_count):
+        thread_proto = process_state_proto.ProcessStateProto.Thread()
+        for frame in trace.threads.get(thread_id, []):
+            offset = _parse_int(frame.addr, 16) or 0
+            frame_proto = process_state_proto.StackFrame(instruction=_int64(offset))
+            if frame.module:
+                frame_proto.module = process_state_proto.CodeModule(code_file=_to_unicode(frame.module))
+            if frame.function:
+                frame_proto.function_name = _to_unicode(frame.function)
+                if frame.line:
+                    frame_proto.source_file_name = _to_unicode(frame.line)
+                    frame_proto.source_line = _parse_int(frame.column) or 0
+                    frame_proto.source_line_base = 0
+                else:
+                    frame_proto.function_base = 0
+            elif frame.module in module_bases:
+                module_base = module_bases[frame.module]
+                frame_proto.module.base_address = _int64(module_base)
+                frame_proto.instruction = _int64((module_base + offset) & ((1 << 64) - 1))
+            thread_proto.frames.append(frame_proto)
+        proto.threads.append(thread_proto)
+    return proto
+
+def from_proto(proto):
+    """ Convert a process_state_proto.ProcessStateProto to a Stacktrace """
+    processor = minidump_stackwalk_processor
+    os_version = None
+    if proto.os is not None or proto.os_version is not None:
+        os_version = processor.OSVersion(_from_unicode(proto.os), _from_unicode(proto.os_version))
+    cpu_info = None
+    if proto.cpu is not None:
+        cpu_info = processor.CpuInfo(_from_unicode(proto.cpu), _from_unicode(proto.cpu_info), proto.cpu_count or 0)
+    crash_info = None
+    if proto.crash is not None:
+        crash_info = processor.CrashInfo(_from_unicode(proto.crash.reason), '0x%x' % _uint64(proto.crash.address),
+                                         proto.requesting_thread or 0)
+
+    main_module = None
+    modules = {}
+    for module_proto in proto.modules:
+        base_addr = ''
+        max_addr = ''
+        if module_proto.base_address is not None:
+            base_addr = '0x%08x' % _uint64(module_proto.base_address)
+            if module_proto.size is not None:
+                max_addr = '0x%08x' % (_uint64(module_proto.base_address) + module_proto.size - 1)
+        filename = _from_unicode(module_proto.code_file)
+        modules[filename] = processor.Module(filename, _from_unicode(module_proto.version),
+                                             _from_unicode(module_proto.debug_file),
+                                             _from_unicode(module_proto.debug_identifier), base_addr, max_addr)
+        if main_module is None:
+            main_module = filename
+
+    threads = {}
+    for thread_id, thread_proto in enumerate(proto.threads):
+        if not thread_proto.frames:
+            continue
+        frames = []
+        for frame_proto in thread_proto.frames:
+            module_proto = frame_proto.module or process_state_proto.CodeModule()
+            if frame_proto.source_file_name is not None:
+                offset = frame_proto.instruction - (frame_proto.source_line_base or 0)
+            elif frame_proto.function_name is not None:
+                offset = frame_proto.instruction - (frame_proto.function_base or 0)
+            elif frame_proto.module is not None:
+                offset = frame_proto.instruction - (module_proto.base_address or 0)
+            else:
+                offset = frame_proto.instruction
+            line = ''
+            if frame_proto.source_file_name is not None:
+                line = str(frame_proto.source_line or 0)
+            frames += [processor.Frame(_from_unicode(module_proto.code_file),
+                                       _from_unicode(frame_proto.function_name),
+                                       _from_unicode(frame_proto.source_file_name),
+                                       line, '0x%x' % _uint64(offset))]
+        threads[thread_id] = frames
+
+    return processor.Stacktrace(main_module, modules, threads, crash_info, cpu_info, os_version)
+
+def _read_varint(stream):
+    """ Read a varint from a stream. Returns None at the end of the stream """
+    value = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift:
+                raise EOFError('Truncated message length')
+            return None
+        value |= (ord(byte) & 0x7f) << shift
+        if not ord(byte) & 0x80:
+            return value
+        shift += 7
+
+def write_stacktrace(out, trace):
+    """ Write a Stacktrace to a stream as a length-delimited ProcessStateProto """
+    data = to_proto(trace).serialize()
+    out.write(process_state_proto.encode_varint(len(data)))
+    out.write(data)
+
+def read_stacktraces(stream):
+    """ Read the length-delimited ProcessStateProto messages in a stream,
+    yielding a Stacktrace for each one.
+    """
+    while True:
+        length = _read_varint(stream)
+        if length is None:
+            return
+        data = stream.read(length)
+        if len(data) != length:
+            raise EOFError('Truncated message')
+        yield from_proto(process_state_proto.ProcessStateProto.parse(data))
+
+class ProtoTraceWriter:
+    """ Writes Stacktraces to a stream of ProcessStateProto messages.
+
+    This has the same interface as stacktrace_export.TraceWriter. The
+    minidump paths passed to add() are not stored since
+    ProcessStateProto has no field for them.
+    """
+    def __init__(self, out):
+        self.out = out
+
+    def add(self, trace, dump_file=None):
+        write_stacktrace(self.out, trace)
+
+    def close(self):
+        self.out.flush()
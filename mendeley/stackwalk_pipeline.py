@@ -0,0 +1,326 @@
+"""
+stackwalk_pipeline processes a batch of minidumps from a single thread,
+overlapping the I/O of many minidump_stackwalk processes and symbol
+fetches instead of dedicating a worker process to each stackwalk.
+
+Each minidump passes through two stages:
+
+  prefetch   The modules of the minidump are read from it (see
+             minidump_reader.py) and the symbol fetch command is run
+             for each module whose symbols have not already been
+             fetched for an earlier minidump in the batch.
+  stackwalk  Once its symbols have been fetched, minidump_stackwalk is
+             run on the minidump and its output is read as it arrives
+             and passed to a StacktraceParser a line at a time.
+
+Up to 'stackwalk_jobs' stackwalks and 'fetch_jobs' symbol fetches run
+at once, and the fetches for the next minidumps overlap the stackwalks
+of earlier ones. A select() loop waits on the output of all running
+stackwalks, so the number of minidumps in flight is bounded by the
+number of processes the system can run rather than by a pool of Python
+workers, each of which would block reading a single stackwalk.
+
+This is the event loop that an asyncio pipeline would provide, built on
+select() since this code targets Python 2.
+"""
+
+from __future__ import print_function
+
+import collections
+import errno
+import os
+import pipes
+import select
+import subprocess
+import sys
+import time
+
+import metrics
+import minidump_reader
+import minidump_stackwalk_processor
+
+# Default number of minidump_stackwalk processes to run at once
+DEFAULT_STACKWALK_JOBS = 32
+
+# Default number of symbol fetches to run at once
+DEFAULT_FETCH_JOBS = 16
+
+# Length of time in seconds to wait for output before checking whether
+# any symbol fetches have finished
+FETCH_POLL_INTERVAL = 0.05
+
+# Size of the reads from the stdout of minidump_stackwalk
+READ_SIZE = 64 * 1024
+
+class StackwalkResult(object):
+    """ The outcome of processing one minidump.
+
+    'stacktrace' is the parsed Stacktrace and 'output' the output of
+    minidump_stackwalk, if the pipeline keeps it, or 'error' describes
+    why the minidump could not be processed. 'cached' is True if the
+    output came from the result cache.
+    """
+    __slots__ = ('dump_file', 'stacktrace', 'output', 'error', 'cached', 'seconds')
+
+    def __init__(self, dump_file, stacktrace, output, error, cached, seconds):
+        self.dump_file = dump_file
+        self.stacktrace = stacktrace
+        self.output = output
+        self.error = error
+        self.cached = cached
+        self.seconds = seconds
+
+class _Stackwalk:
+    """ A minidump in the pipeline. The output of minidump_stackwalk is
+    only kept in 'output_lines' if 'keep_output' is set, since the
+    parser does not need it.
+
+    If a line of output cannot be parsed, 'error' describes why and the
+    rest of the output is ignored, so that only this minidump fails.
+    """
+    def __init__(self, dump_file, all_threads, keep_output):
+        self.dump_file = dump_file
+        self.start_time = time.time()
+        self.parser = minidump_stackwalk_processor.StacktraceParser(keep_all_threads=all_threads)
+        self.pending_fetches = set()
+        self.result_key = None
+        self.proc = None
+        self.partial_line = ''
+        self.output_lines = [] if keep_output else None
+        self.error = None
+
+    def feed(self, data):
+        """ Parse a chunk of minidump_stackwalk output """
+        if self.error:
+            return
+        lines = (self.partial_line + data).split('\n')
+        self.partial_line = lines.pop()
+        parse_line = self.parser.parse_line
+        output_lines = self.output_lines
+        try:
+            for line in lines:
+                line += '\n'
+                if output_lines is not None:
+                    output_lines.append(line)
+                parse_line(line)
+        except Exception as err:
+            self.error = '%s: %s' % (type(err).__name__, err)
+
+    def finish(self):
+        """ Parse the last line of output, if it has no newline """
+        if self.partial_line and not self.error:
+            if self.output_lines is not None:
+                self.output_lines.append(self.partial_line)
+            try:
+                self.parser.parse_line(self.partial_line)
+            except Exception as err:
+                self.error = '%s: %s' % (type(err).__name__, err)
+        self.partial_line = ''
+
+    def output(self):
+        if self.output_lines is None:
+            return None
+        return ''.join(self.output_lines)
+
+class StackwalkPipeline:
+    """ Runs symbolized stackwalks of a batch of minidumps, see the
+    module description.
+
+    'symbol_fetch_command' is passed to minidump_stackwalk with '-e' and
+    is also run with each module's debug file name and debug ID to
+    prefetch its symbols if 'fetch_jobs' is non-zero.
+
+    If a result_cache.ResultCache is given, minidumps which have already
+    been processed with the same symbols are not processed again, and
+    the output of new stackwalks is added to the cache. The time taken
+    for each minidump is recorded as a 'stackwalk' event in 'metrics_log'.
+
+    The output of minidump_stackwalk is only held in memory, and returned
+    in each StackwalkResult, if 'keep_output' is set or it is needed for
+    the result cache.
+    """
+    def __init__(self, minidump_tool, symbol_fetch_command, stackwalk_jobs=DEFAULT_STACKWALK_JOBS,
+                 fetch_jobs=DEFAULT_FETCH_JOBS, all_threads=False, serialized_symbols=False, result_cache=None,
+                 metrics_log=None, verbose=False, keep_output=False):
+        if stackwalk_jobs < 1:
+            raise ValueError('At least one stackwalk must be allowed to run')
+        self.minidump_tool = minidump_tool
+        self.symbol_fetch_command = symbol_fetch_command
+        self.stackwalk_jobs = stackwalk_jobs
+        self.fetch_jobs = fetch_jobs
+        self.all_threads = all_threads
+        self.serialized_symbols = serialized_symbols
+        self.result_cache = result_cache
+        self.metrics_log = metrics_log or metrics.MetricsLog()
+        self.verbose = verbose
+        self.keep_output = keep_output or result_cache is not None
+
+    def run(self, dump_files):
+        """ Process 'dump_files', yielding a StackwalkResult for each as
+        it completes. Results are not in the same order as 'dump_files'.
+        """
+        devnull = open(os.devnull, 'w')
+        stderr_output = sys.stderr if self.verbose else devnull
+
+        waiting = collections.deque(dump_files)
+        # minidumps waiting for their symbols, in the order they entered
+        # the pipeline, and those whose symbols have been fetched
+        prefetching = []
+        ready = collections.deque()
+        # symbol IDs which have been fetched, and the processes and
+        # waiting minidumps of fetches which are queued or running
+        fetched = set()
+        queued_fetches = collections.deque()
+        fetch_procs = {}
+        fetch_waiters = {}
+        # running stackwalks, by the file descriptor of their stdout
+        running = {}
+
+        try:
+            while waiting or prefetching or ready or running:
+                # admit minidumps while the prefetch stage has room, so
+                # that fetches for the next minidumps overlap the
+                # stackwalks of the current ones
+                while waiting and len(prefetching) + len(ready) < self.stackwalk_jobs * 2:
+                    stackwalk = _Stackwalk(waiting.popleft(), self.all_threads, self.keep_output)
+                    cached = self._lookup_result(stackwalk)
+                    if cached:
+                        yield cached
+                        continue
+                    for symbol_id in self._symbol_ids(stackwalk.dump_file):
+                        if symbol_id in fetched:
+                            continue
+                        if symbol_id not in fetch_waiters:
+                            fetch_waiters[symbol_id] = []
+                            queued_fetches.append(symbol_id)
+                        fetch_waiters[symbol_id].append(stackwalk)
+                        stackwalk.pending_fetches.add(symbol_id)
+                    if stackwalk.pending_fetches:
+                        prefetching.append(stackwalk)
+                    else:
+                        ready.append(stackwalk)
+
+                while queued_fetches and len(fetch_procs) < self.fetch_jobs:
+                    symbol_id = queued_fetches.popleft()
+                    fetch_command = '%s %s %s' % (self.symbol_fetch_command, pipes.quote(symbol_id[0]),
+                                                  pipes.quote(symbol_id[1]))
+                    fetch_procs[symbol_id] = subprocess.Popen(fetch_command, shell=True, stdout=devnull,
+                                                              stderr=stderr_output)
+
+                while ready and len(running) < self.stackwalk_jobs:
+                    stackwalk = ready.popleft()
+                    stackwalk_args = [self.minidump_tool, '-m', stackwalk.dump_file, '-e', self.symbol_fetch_command]
+                    if self.serialized_symbols:
+                        stackwalk_args += ['-f']
+                    stackwalk.proc = subprocess.Popen(stackwalk_args, stdout=subprocess.PIPE, stderr=stderr_output)
+                    running[stackwalk.proc.stdout.fileno()] = stackwalk
+
+                # wait for output, waking periodically to check for
+                # finished fetches if any are running
+                timeout = FETCH_POLL_INTERVAL if fetch_procs else None
+                readable = []
+                if running:
+                    try:
+                        readable = select.select(running.keys(), [], [], timeout)[0]
+                    except select.error as err:
+                        if err.args[0] != errno.EINTR:
+                            raise
+                elif fetch_procs:
+                    time.sleep(timeout)
+
+                for fd in readable:
+                    stackwalk = running[fd]
+                    data = os.read(fd, READ_SIZE)
+                    if data:
+                        stackwalk.feed(data)
+                        continue
+                    del running[fd]
+                    yield self._finish_stackwalk(stackwalk)
+
+                for symbol_id, proc in fetch_procs.items():
+                    if proc.poll() is None:
+                        continue
+                    # failed fetches are left to the stackwalk, which
+                    # runs the fetch command again and reports the module
+                    # as missing
+                    del fetch_procs[symbol_id]
+                    fetched.add(symbol_id)
+                    for stackwalk in fetch_waiters.pop(symbol_id):
+                        stackwalk.pending_fetches.discard(symbol_id)
+                    for stackwalk in [stackwalk for stackwalk in prefetching if not stackwalk.pending_fetches]:
+                        prefetching.remove(stackwalk)
+                        ready.append(stackwalk)
+        finally:
+            for stackwalk in running.values():
+                _kill(stackwalk.proc)
+                stackwalk.proc.stdout.close()
+            for proc in fetch_procs.values():
+                _kill(proc)
+            devnull.close()
+
+    def _symbol_ids(self, dump_file):
+        """ Returns the (debug file, debug ID) of each module in a
+        minidump, or none if prefetching is disabled or the module list
+        cannot be read, in which case symbols are fetched as the
+        stackwalk needs them
+        """
+        if not self.fetch_jobs:
+            return set()
+        try:
+            modules = minidump_reader.read_stacktrace(dump_file).modules.values()
+        except (minidump_reader.MinidumpFormatError, IOError):
+            return set()
+        return set((module.debug_filename, module.debug_id) for module in modules
+                   if module.debug_filename and module.debug_id)
+
+    def _lookup_result(self, stackwalk):
+        """ Returns a StackwalkResult if the result cache has the output
+        for a minidump, and otherwise sets its result cache key
+        """
+        if not self.result_cache:
+            return None
+        try:
+            stackwalk.result_key = self.result_cache.key(stackwalk.dump_file, '%s\n%s' % (self.minidump_tool,
+                                                                                         self.symbol_fetch_command))
+        except IOError as err:
+            return self._result(stackwalk, 'IOError: %s' % err, False)
+        output = self.result_cache.lookup(stackwalk.result_key)
+        if output is None:
+            return None
+        stackwalk.feed(output)
+        stackwalk.finish()
+        return self._result(stackwalk, stackwalk.error, True)
+
+    def _finish_stackwalk(self, stackwalk):
+        stackwalk.proc.stdout.close()
+        returncode = stackwalk.proc.wait()
+        # a stackwalk which failed, for example by being killed, may
+        # have left a truncated last line, so it is only parsed if the
+        # stackwalk succeeded
+        if returncode != 0:
+            return self._result(stackwalk, 'StackwalkError: minidump_stackwalk exited with status %d' % returncode,
+                                False)
+        stackwalk.finish()
+        if stackwalk.error:
+            return self._result(stackwalk, stackwalk.error, False)
+        if stackwalk.result_key:
+            self.result_cache.store(stackwalk.result_key, stackwalk.output(),
+                                    stackwalk.parser.stacktrace.modules.values())
+        return self._result(stackwalk, None, False)
+
+    def _result(self, stackwalk, error, cached):
+        seconds = time.time() - stackwalk.start_time
+        self.metrics_log.record('stackwalk', dump_file=stackwalk.dump_file, seconds=seconds, cached=cached,
+                                failed=error is not None)
+        if error:
+            return StackwalkResult(stackwalk.dump_file, None, None, error, cached, seconds)
+        return StackwalkResult(stackwalk.dump_file, stackwalk.parser.stacktrace, stackwalk.output(), None, cached,
+                               seconds)
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except OSError:
+        # already exited
+        pass
+    proc.wait()
@@ -0,0 +1,911 @@
+"""
+symbol_cache provides a size-bounded local cache of Breakpad
+debug symbol files for fetch-symbols.py.
+
+Symbol files are stored under '<cache root>/<debug file>/<debug id>/<name>.sym'.
+Since the debug ID identifies the build of a binary, an entry's path
+already identifies its content and entries are never rewritten with
+different symbols.
+
+An SQLite index in the cache root records the size, last access time
+and hit count of each entry. This allows the cache to be kept within a
+byte budget by evicting the least recently (LRU) or least frequently
+(LFU) used entries without walking the cache directory. SQLite's locking
+keeps the index consistent when several symbol fetchers share a cache.
+
+Entries are written to a temporary file and renamed into place, so a
+concurrent reader sees either the complete symbol file or no entry at
+all. Failed lookups are recorded in the index, per symbol server,
+rather than as entries in the cache directory. A failed lookup is not
+retried until its time-to-live has passed, and the time-to-live doubles
+with each consecutive failure, up to a limit.
+
+Entries may optionally be stored compressed with gzip or zlib framing.
+The format of each entry is detected when it is read, so a cache can
+hold a mix of formats, and compressed entries are decompressed in
+chunks as they are copied out of the cache.
+
+The index also records the URL each entry was fetched from, along
+with its ETag and Last-Modified headers, so that fetchers can
+revalidate entries with conditional requests.
+
+Symbols converted to FastSourceLineResolver's serialized form are kept
+as separate entries, named after the symbol file with SERIALIZED_SUFFIX
+appended, see serialized_symbols.py.
+
+The index also describes each entry: the module name, debug ID, OS
+and CPU architecture from its MODULE record, and whether it has a
+valid MODULE record at all. Lookups of entries known to be invalid
+are answered from the index without reading the entry, and invalid
+entries are evicted first. reindex() rebuilds the index from the
+entries on disk, for caches populated by other tools or whose index
+was lost, see index-symbol-cache.py.
+
+The address indexes which symbol_file keeps next to entries count
+towards the size limit along with the entries themselves. Lock files
+only exist while a fetch of an entry is in progress, and directories
+left empty when entries are removed, or by lookups of modules which
+were never found, are removed.
+"""
+
+from __future__ import print_function
+from distutils.dir_util import mkpath
+
+import errno
+import gzip
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # entry locks are not available on Windows
+    fcntl = None
+
+# Default location of the local symbol cache
+DEFAULT_CACHE_ROOT = '%s/%s' % (tempfile.gettempdir(), 'symbol-cache')
+
+# Default upper limit on the total size of entries in the cache, in bytes
+DEFAULT_MAX_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+
+# Name of the index database in the cache root
+INDEX_FILE_NAME = 'index.sqlite'
+
+# Eviction policies
+EVICT_LRU = 'lru'
+EVICT_LFU = 'lfu'
+EVICTION_POLICIES = [EVICT_LRU, EVICT_LFU]
+
+# Length of time in seconds to wait for another process to release
+# its lock on the index
+INDEX_LOCK_TIMEOUT = 60
+
+# Formats for storing cache entries
+FORMAT_RAW = 'none'
+FORMAT_GZIP = 'gzip'
+FORMAT_ZLIB = 'zlib'
+FORMATS = [FORMAT_RAW, FORMAT_GZIP, FORMAT_ZLIB]
+
+# Compression level used for compressed entries. Symbol files are large,
+# so this favours speed over the last few percent of compression
+COMPRESSION_LEVEL = 6
+
+# Size of the chunks in which entries are read, written and decompressed
+CHUNK_SIZE = 64 * 1024
+
+# Prefix for temporary files which entries are written to before
+# being moved into place
+TEMP_FILE_PREFIX = '.tmp-'
+
+# Suffix of the address index which symbol_file.SymbolFile keeps next
+# to an entry. It is removed along with the entry, and its size is
+# recorded with the entry's, see SymbolCache.record_index_size().
+INDEX_SUFFIX = '.idx'
+
+# Suffix of entries holding symbols serialized for FastSourceLineResolver
+SERIALIZED_SUFFIX = '.serialized'
+
+# Default length of time in seconds after a failed lookup before it
+# is retried, and the limit on this after repeated failures
+DEFAULT_MISSING_TTL = 300
+DEFAULT_MAX_MISSING_TTL = 24 * 60 * 60
+
+# Columns added to the entries table after it was first created, which
+# are added to existing indexes when a cache is opened
+ADDED_ENTRY_COLUMNS = [('source_url', 'TEXT'),
+                       ('etag', 'TEXT'),
+                       ('last_modified', 'TEXT'),
+                       ('validated_at', 'REAL'),
+                       ('stored_at', 'REAL'),
+                       ('module', 'TEXT'),
+                       ('debug_id', 'TEXT'),
+                       ('os', 'TEXT'),
+                       ('arch', 'TEXT'),
+                       ('valid', 'INTEGER'),
+                       ('index_size', 'INTEGER')]
+
+# Names of files in the cache directory which are not entries, other
+# than temporary files and locks
+INDEX_FILE_NAMES = [INDEX_FILE_NAME, INDEX_FILE_NAME + '-journal', INDEX_FILE_NAME + '-wal', INDEX_FILE_NAME + '-shm']
+
+# Suffix of the lock file for an entry, see SymbolCache.lock_entry()
+LOCK_SUFFIX = '.lock'
+
+# Size of an entry and its address index in the entries table
+ENTRY_SIZE = 'size + COALESCE(index_size, 0)'
+
+def parse_size(size):
+    """ Parse a size in bytes with an optional K, M or G suffix, eg. '512M' """
+    units = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3}
+    size = size.strip().upper()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+class SymbolCache:
+    """ A local cache of symbol files with an index and a size limit.
+
+    Paths passed to the cache are relative to the cache root and have
+    the form '<debug file>/<debug id>/<name>.sym'.
+    """
+    def __init__(self, root=DEFAULT_CACHE_ROOT, max_size=DEFAULT_MAX_CACHE_SIZE, policy=EVICT_LRU,
+                 compression=FORMAT_RAW, missing_ttl=DEFAULT_MISSING_TTL, max_missing_ttl=DEFAULT_MAX_MISSING_TTL):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('Unknown cache eviction policy %s' % policy)
+        if compression not in FORMATS:
+            raise ValueError('Unknown cache entry format %s' % compression)
+        self.root = root
+        self.max_size = max_size
+        self.policy = policy
+        self.compression = compression
+        self.missing_ttl = missing_ttl
+        self.max_missing_ttl = max_missing_ttl
+        mkpath(self.root)
+        self.index_path = os.path.join(self.root, INDEX_FILE_NAME)
+
+        connection = self._connect()
+        connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER NOT NULL,
+                                last_access REAL NOT NULL,
+                                hits INTEGER NOT NULL DEFAULT 0)""")
+        missing_columns = [row[1] for row in connection.execute('PRAGMA table_info(missing)')]
+        if missing_columns and not 'server' in missing_columns:
+            # failed lookups recorded before they were tracked per server
+            # are simply forgotten
+            connection.execute('DROP TABLE missing')
+        connection.execute("""CREATE TABLE IF NOT EXISTS missing (
+                                path TEXT NOT NULL,
+                                server TEXT NOT NULL,
+                                failed_at REAL NOT NULL,
+                                failures INTEGER NOT NULL,
+                                PRIMARY KEY (path, server))""")
+        connection.execute("""CREATE TABLE IF NOT EXISTS counters (
+                                name TEXT PRIMARY KEY,
+                                value INTEGER NOT NULL)""")
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(entries)')]
+        for column, column_type in ADDED_ENTRY_COLUMNS:
+            if not column in columns:
+                connection.execute('ALTER TABLE entries ADD COLUMN %s %s' % (column, column_type))
+        if not 'debug_id' in columns:
+            # entries indexed before the debug ID was recorded take it from
+            # their path, so that symbols_stored_at() finds them
+            connection.executemany('UPDATE entries SET debug_id = ? WHERE path = ?',
+                                   [(path.split('/')[1], path) for path, in
+                                    connection.execute('SELECT path FROM entries').fetchall() if path.count('/') >= 2])
+        connection.execute('CREATE INDEX IF NOT EXISTS entries_debug_id ON entries (debug_id)')
+        connection.close()
+
+    def _connect(self):
+        # A new connection is used for each operation so that a cache
+        # can be shared between the threads of the symbol service
+        return sqlite3.connect(self.index_path, timeout=INDEX_LOCK_TIMEOUT, isolation_level=None)
+
+    def entry_path(self, symfile_path):
+        return '%s/%s' % (self.root, symfile_path)
+
+    def lookup(self, symfile_path):
+        """ Looks up debug symbols in the cache.
+        Returns an EntryReader for the cached symbols if they exist, which
+        the caller is responsible for closing, or None otherwise.
+        """
+        cache_path = self.entry_path(symfile_path)
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT valid FROM entries WHERE path = ?', (symfile_path,)).fetchone()
+            if row and row[0] == 0:
+                self._remove_entry(connection, symfile_path)
+                return None
+            try:
+                reader = EntryReader(cache_path)
+            except IOError:
+                # the entry was evicted, never existed or is corrupt
+                self._remove_entry(connection, symfile_path)
+                return None
+
+            now = time.time()
+            if row and row[0]:
+                connection.execute('UPDATE entries SET last_access = ?, hits = hits + 1 WHERE path = ?',
+                                   (now, symfile_path))
+                return reader
+
+            # entries written before the index described them are checked
+            # when first read, and a dummy entry written by an older version
+            # of the cache to record a failed lookup is removed
+            fields = _entry_fields(symfile_path, reader.module_line())
+            if not fields[-1]:
+                reader.close()
+                self._remove_entry(connection, symfile_path)
+                return None
+            if row:
+                connection.execute("""UPDATE entries SET last_access = ?, hits = hits + 1, module = ?, debug_id = ?,
+                                      os = ?, arch = ?, valid = ? WHERE path = ?""",
+                                   (now,) + fields + (symfile_path,))
+            else:
+                # adopt entries written before the cache was indexed
+                connection.execute("""INSERT OR REPLACE INTO entries
+                                      (path, size, last_access, hits, module, debug_id, os, arch, valid)
+                                      VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)""",
+                                   (symfile_path, reader.stored_size, now) + fields)
+            return reader
+        finally:
+            connection.close()
+
+    def contains(self, symfile_path):
+        """ Returns True if the index has a valid entry at 'symfile_path'.
+        The entry itself is not read.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT COALESCE(valid, 1) FROM entries WHERE path = ?',
+                                     (symfile_path,)).fetchone()
+        finally:
+            connection.close()
+        return bool(row and row[0])
+
+    def entries(self):
+        """ Returns a CacheEntry for each entry in the index, ordered by path """
+        connection = self._connect()
+        try:
+            rows = connection.execute("""SELECT path, module, debug_id, os, arch, size, last_access, hits, valid
+                                         FROM entries ORDER BY path""").fetchall()
+        finally:
+            connection.close()
+        return [CacheEntry(*row) for row in rows]
+
+    def reindex(self):
+        """ Rebuild the index from the entries in the cache directory.
+
+        Each entry's MODULE record is read to describe it in the index.
+        Entries which are not in the index are added, with their
+        modification time as their last access time, and entries in the
+        index which no longer exist are removed. The sources, access
+        times and hit counts of existing entries are kept.
+
+        The sizes of address indexes are recorded with their entries, and
+        indexes without an entry, lock files left behind by fetchers which
+        were killed and empty directories are removed.
+
+        Returns an (added, updated, removed) tuple of entry counts.
+        """
+        found = {}
+        index_sizes = {}
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            for name in file_names:
+                if name.startswith(TEMP_FILE_PREFIX) or (dir_path == self.root and name in INDEX_FILE_NAMES):
+                    continue
+                path = os.path.join(dir_path, name)
+                if name.endswith(LOCK_SUFFIX):
+                    _remove_stale_lock(path)
+                    continue
+                symfile_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if name.endswith(INDEX_SUFFIX):
+                    try:
+                        index_sizes[symfile_path[:-len(INDEX_SUFFIX)]] = (path, os.path.getsize(path))
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    stat = os.stat(path)
+                    reader = EntryReader(path)
+                    module_line = reader.module_line()
+                    reader.close()
+                except IOError:
+                    module_line = ''
+                except OSError:
+                    # removed since the directory was listed
+                    continue
+                found[symfile_path] = (stat.st_size, stat.st_mtime, _entry_fields(symfile_path, module_line))
+
+        for symfile_path, (path, size) in index_sizes.items():
+            if not symfile_path in found:
+                _remove_file(path)
+        for dir_path, dir_names, file_names in os.walk(self.root, topdown=False):
+            # directories are visited before their parents, which may
+            # have been pruned along with them
+            _prune_dirs(self.root, dir_path)
+
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            indexed = set(row[0] for row in connection.execute('SELECT path FROM entries'))
+            removed = indexed - set(found)
+            for symfile_path in removed:
+                connection.execute('DELETE FROM entries WHERE path = ?', (symfile_path,))
+            for symfile_path, (size, mtime, fields) in found.items():
+                index_size = index_sizes.get(symfile_path, (None, None))[1]
+                if symfile_path in indexed:
+                    connection.execute("""UPDATE entries SET size = ?, module = ?, debug_id = ?, os = ?, arch = ?,
+                                          valid = ?, index_size = ? WHERE path = ?""",
+                                       (size,) + fields + (index_size, symfile_path))
+                else:
+                    connection.execute("""INSERT INTO entries
+                                          (path, size, last_access, hits, stored_at, module, debug_id, os, arch, valid,
+                                           index_size)
+                                          VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?)""",
+                                       (symfile_path, size, mtime, mtime) + fields + (index_size,))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return (len(set(found) - indexed), len(indexed & set(found)), len(removed))
+
+    def mark_invalid(self, symfile_path):
+        """ Record that an entry is not valid, so that it is removed
+        rather than read when it is next looked up
+        """
+        connection = self._connect()
+        try:
+            connection.execute('UPDATE entries SET valid = 0 WHERE path = ?', (symfile_path,))
+        finally:
+            connection.close()
+
+    def remove(self, symfile_path):
+        """ Remove an entry from the cache """
+        connection = self._connect()
+        try:
+            self._remove_entry(connection, symfile_path)
+        finally:
+            connection.close()
+
+    def update(self, symfile_path, symbols, source=None):
+        """ Save breakpad debug symbols to the cache. 'source' is an
+        optional EntrySource describing where the symbols were fetched from.
+
+        If the cache then exceeds its size limit, entries are evicted
+        according to the cache's eviction policy.
+        """
+        writer = self.open_writer(symfile_path, source)
+        try:
+            for offset in range(0, len(symbols), CHUNK_SIZE):
+                writer.write(symbols[offset:offset + CHUNK_SIZE])
+        except:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def open_writer(self, symfile_path, source=None):
+        """ Returns an EntryWriter which writes a new entry to the cache in
+        the cache's configured format. The entry is added to the cache
+        when the writer is committed.
+        """
+        return EntryWriter(self, symfile_path, self.compression, source)
+
+    def source(self, symfile_path):
+        """ Returns the EntrySource recorded for an entry, or None if the
+        entry does not exist or its source is unknown.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT source_url, etag, last_modified, validated_at FROM entries WHERE path = ?',
+                                     (symfile_path,)).fetchone()
+        finally:
+            connection.close()
+        if not row or not row[0]:
+            return None
+        return EntrySource(*row)
+
+    def mark_validated(self, symfile_path):
+        """ Record that an entry was found to be up to date with its source """
+        connection = self._connect()
+        try:
+            connection.execute('UPDATE entries SET validated_at = ? WHERE path = ?', (time.time(), symfile_path))
+        finally:
+            connection.close()
+
+    def record_index_size(self, symfile_path, size):
+        """ Record the size of the address index saved next to an entry,
+        so that it counts towards the size limit, and evict other
+        entries if the cache is now over its limit
+        """
+        connection = self._connect()
+        try:
+            connection.execute('UPDATE entries SET index_size = ? WHERE path = ?', (size, symfile_path))
+            self._evict(connection, keep=symfile_path)
+        finally:
+            connection.close()
+
+    def stored_at(self, symfile_path):
+        """ Returns the time at which an entry was stored, or None if it
+        does not exist or was stored before this was recorded
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT stored_at FROM entries WHERE path = ?', (symfile_path,)).fetchone()
+        finally:
+            connection.close()
+        if not row:
+            return None
+        return row[0]
+
+    def symbols_stored_at(self, debug_id):
+        """ Returns the time at which the newest symbol file for the build
+        with 'debug_id' was stored, under any debug file name, or None if
+        the cache has no symbol file for it. Entries adopted from before
+        the index recorded this count as stored at time 0.
+
+        Only '<debug file>/<debug id>/<name>.sym' entries count. Entries
+        derived from a symbol file, such as its serialized form or shards,
+        do not change the symbols and are ignored.
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT path, COALESCE(stored_at, 0) FROM entries WHERE debug_id = ?',
+                                      (debug_id,)).fetchall()
+        finally:
+            connection.close()
+        stored_at = [row[1] for row in rows if _is_symbol_file(row[0])]
+        return max(stored_at) if stored_at else None
+
+    def record_missing(self, symfile_path, server):
+        """ Record that a lookup of an entry on a symbol server failed """
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT failures FROM missing WHERE path = ? AND server = ?',
+                                     (symfile_path, server)).fetchone()
+            failures = 1
+            if row:
+                failures = row[0] + 1
+            connection.execute('INSERT OR REPLACE INTO missing (path, server, failed_at, failures) VALUES (?, ?, ?, ?)',
+                               (symfile_path, server, time.time(), failures))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def is_missing(self, symfile_path, server):
+        """ Returns the number of seconds until a failed lookup of an entry
+        on a symbol server should be retried, or 0 if it should be
+        looked up now.
+
+        The time-to-live of a failed lookup is doubled for each
+        consecutive failure, up to the cache's maximum time-to-live.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT failed_at, failures FROM missing WHERE path = ? AND server = ?',
+                                     (symfile_path, server)).fetchone()
+        finally:
+            connection.close()
+        if not row:
+            return 0
+        failed_at, failures = row
+        ttl = min(self.missing_ttl * (2 ** min(failures - 1, 32)), self.max_missing_ttl)
+        return max(failed_at + ttl - time.time(), 0)
+
+    def add_to_counter(self, name, amount=1):
+        """ Add 'amount' to one of the cache's persistent counters """
+        connection = self._connect()
+        try:
+            connection.execute('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', (name,))
+            connection.execute('UPDATE counters SET value = value + ? WHERE name = ?', (amount, name))
+        finally:
+            connection.close()
+
+    def counters(self):
+        """ Returns a dict of the cache's persistent counters """
+        connection = self._connect()
+        try:
+            return dict(connection.execute('SELECT name, value FROM counters').fetchall())
+        finally:
+            connection.close()
+
+    def _add_entry(self, symfile_path, size, source, module_line):
+        """ Record a new entry of 'size' bytes, starting with
+        'module_line', in the index and evict other entries if the cache
+        is over its size limit.
+        """
+        if not source:
+            source = EntrySource(None)
+        connection = self._connect()
+        try:
+            connection.execute('DELETE FROM missing WHERE path = ?', (symfile_path,))
+            connection.execute("""INSERT OR REPLACE INTO entries
+                                  (path, size, last_access, hits, source_url, etag, last_modified, validated_at, stored_at,
+                                   module, debug_id, os, arch, valid)
+                                  VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                               (symfile_path, size, time.time(),
+                                source.url, source.etag, source.last_modified, time.time(), time.time()) +
+                               _entry_fields(symfile_path, module_line))
+            self._evict(connection, keep=symfile_path)
+        finally:
+            connection.close()
+
+    def _remove_entry(self, connection, symfile_path):
+        entry_path = self.entry_path(symfile_path)
+        for path in [entry_path, entry_path + INDEX_SUFFIX]:
+            _remove_file(path)
+        _remove_stale_lock(entry_path + LOCK_SUFFIX)
+        _prune_dirs(self.root, os.path.dirname(entry_path))
+        connection.execute('DELETE FROM entries WHERE path = ?', (symfile_path,))
+
+    def lock_entry(self, symfile_path):
+        """ Returns a lock which serializes fetches of an entry across processes.
+
+        A fetcher which misses the cache should take the lock and then
+        look up the entry again before fetching it, so that when several
+        processes miss at once only one of them downloads the symbols.
+        """
+        return EntryLock(self.entry_path(symfile_path) + LOCK_SUFFIX, self.root)
+
+    def _evict(self, connection, keep):
+        """ Remove entries until the cache is within its size limit.
+        The entry at 'keep' is never evicted.
+        """
+        if not self.max_size:
+            return
+
+        # invalid entries are evicted first
+        if self.policy == EVICT_LFU:
+            order = 'COALESCE(valid, 1), hits, last_access'
+        else:
+            order = 'COALESCE(valid, 1), last_access'
+
+        # take the write lock up-front so that concurrent fetchers
+        # do not both evict entries to make room for the same data
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            total_size = connection.execute('SELECT COALESCE(SUM(%s), 0) FROM entries' % ENTRY_SIZE).fetchone()[0]
+            if total_size <= self.max_size:
+                return
+
+            candidates = connection.execute('SELECT path, %s FROM entries WHERE path != ? ORDER BY %s' %
+                                            (ENTRY_SIZE, order), (keep,)).fetchall()
+            for path, size in candidates:
+                if total_size <= self.max_size:
+                    break
+                self._remove_entry(connection, path)
+                total_size -= size
+        finally:
+            connection.execute('COMMIT')
+
+    def total_size(self):
+        """ Returns the total size in bytes of the entries in the cache
+        and their address indexes
+        """
+        connection = self._connect()
+        try:
+            return connection.execute('SELECT COALESCE(SUM(%s), 0) FROM entries' % ENTRY_SIZE).fetchone()[0]
+        finally:
+            connection.close()
+
+class CacheEntry(object):
+    """ The description of an entry in the index of a SymbolCache.
+
+    'module', 'debug_id', 'os' and 'arch' are read from the entry's
+    MODULE record, or for serialized symbols, which have none, the
+    module name and debug ID are taken from the entry's path. 'valid'
+    is False if the entry has no valid MODULE record, or None if it
+    has not been checked since it was adopted by the index.
+    """
+    __slots__ = ('path', 'module', 'debug_id', 'os', 'arch', 'size', 'last_access', 'hits', 'valid')
+
+    def __init__(self, path, module, debug_id, os, arch, size, last_access, hits, valid):
+        self.path = path
+        self.module = module
+        self.debug_id = debug_id
+        self.os = os
+        self.arch = arch
+        self.size = size
+        self.last_access = last_access
+        self.hits = hits
+        self.valid = valid if valid is None else bool(valid)
+
+def _is_symbol_file(symfile_path):
+    """ Returns True if 'symfile_path' is the path of a text symbol file,
+    rather than of an entry derived from one
+    """
+    return symfile_path.count('/') == 2 and symfile_path.endswith('.sym')
+
+def _entry_fields(symfile_path, module_line):
+    """ Returns the (module, debug ID, OS, arch, valid) columns of the
+    index for an entry starting with 'module_line'
+    """
+    if symfile_path.endswith(SERIALIZED_SUFFIX):
+        # serialized symbols have no MODULE record
+        components = symfile_path.split('/')
+        if len(components) < 3:
+            return (None, None, None, None, 0)
+        return (components[0], components[1], None, None, 1)
+    # MODULE <os> <arch> <debug id> <debug file>
+    fields = module_line.rstrip('\r').split(' ', 4)
+    if len(fields) != 5 or fields[0] != 'MODULE':
+        return (None, None, None, None, 0)
+    return (fields[4], fields[3], fields[1], fields[2], 1)
+
+class EntrySource:
+    """ The URL a cache entry was fetched from and the validators
+    (ETag and Last-Modified headers) the server returned for it
+    """
+    def __init__(self, url, etag=None, last_modified=None, validated_at=None):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = validated_at
+
+class EntryReader:
+    """ Reads the symbol file stored in a cache entry.
+
+    Compressed entries are decompressed in chunks as they are read.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.stored_size = os.fstat(self.file.fileno()).st_size
+        magic = self.file.read(2)
+        self.file.seek(0)
+
+        if magic == '\x1f\x8b':
+            self.format = FORMAT_GZIP
+            self.stream = gzip.GzipFile(fileobj=self.file, mode='rb')
+        elif len(magic) == 2 and ord(magic[0]) & 0x0f == 8 and (ord(magic[0]) * 256 + ord(magic[1])) % 31 == 0:
+            self.format = FORMAT_ZLIB
+            self.stream = _ZlibReader(self.file)
+        else:
+            self.format = FORMAT_RAW
+            self.stream = self.file
+
+        # the first chunk is read up-front so that the MODULE
+        # line can be checked before the entry is used
+        try:
+            self.pending = self.stream.read(CHUNK_SIZE)
+        except zlib.error as err:
+            self.close()
+            raise IOError('Corrupt cache entry %s: %s' % (path, err))
+
+    def module_line(self):
+        """ Returns the first line of the symbol file """
+        return self.pending.split('\n', 1)[0]
+
+    def read(self, size=CHUNK_SIZE):
+        """ Read up to 'size' bytes of the symbol file. Returns an
+        empty string at the end of the file.
+        """
+        if self.pending:
+            data = self.pending[:size]
+            self.pending = self.pending[size:]
+            return data
+        return self.stream.read(size)
+
+    def close(self):
+        if self.stream is not self.file:
+            self.stream.close()
+        self.file.close()
+
+class EntryWriter:
+    """ Writes a new cache entry, compressing it if required.
+
+    Data is written to a temporary file in the entry's directory.
+    commit() renames it into place, so a concurrent reader sees either
+    the complete entry or no entry at all. abort() discards it.
+    """
+    def __init__(self, cache, symfile_path, format, source=None):
+        self.cache = cache
+        self.symfile_path = symfile_path
+        self.source = source
+        self.path = cache.entry_path(symfile_path)
+        cache_dir = os.path.dirname(self.path)
+        while True:
+            _make_dirs(cache_dir)
+            try:
+                fd, self.temp_path = tempfile.mkstemp(dir=cache_dir, prefix=TEMP_FILE_PREFIX)
+                break
+            except OSError as err:
+                # retry if the directory was pruned by another process
+                if err.errno != errno.ENOENT:
+                    raise
+        self.file = os.fdopen(fd, 'wb')
+
+        if format == FORMAT_GZIP:
+            self.stream = gzip.GzipFile(fileobj=self.file, mode='wb', compresslevel=COMPRESSION_LEVEL)
+        elif format == FORMAT_ZLIB:
+            self.stream = _ZlibWriter(self.file)
+        else:
+            self.stream = self.file
+        # the start of the entry, up to the end of its first line, which
+        # describes the entry in the index
+        self.head = ''
+
+    def write(self, data):
+        if not '\n' in self.head and len(self.head) < CHUNK_SIZE:
+            self.head += data[:CHUNK_SIZE]
+        self.stream.write(data)
+
+    def commit(self):
+        """ Move the entry into place and add it to the cache index """
+        try:
+            if self.stream is not self.file:
+                self.stream.close()
+            self.file.close()
+            # mkstemp() creates files which are only readable by the owner
+            os.chmod(self.temp_path, 0o644)
+            size = os.path.getsize(self.temp_path)
+            _rename_file(self.temp_path, self.path)
+        except:
+            self.abort()
+            raise
+        self.cache._add_entry(self.symfile_path, size, self.source, self.head.split('\n', 1)[0])
+
+    def abort(self):
+        """ Discard the entry """
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+class _ZlibReader:
+    """ File-like wrapper which decompresses a zlib stream """
+    def __init__(self, file):
+        self.file = file
+        self.decompressor = zlib.decompressobj()
+        self.unconsumed = ''
+
+    def read(self, size):
+        while True:
+            compressed = self.unconsumed or self.file.read(CHUNK_SIZE)
+            if not compressed:
+                return self.decompressor.flush()
+            data = self.decompressor.decompress(compressed, size)
+            self.unconsumed = self.decompressor.unconsumed_tail
+            if data:
+                return data
+
+    def close(self):
+        pass
+
+class _ZlibWriter:
+    """ File-like wrapper which writes a zlib stream """
+    def __init__(self, file):
+        self.file = file
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+
+class EntryLock:
+    """ An exclusive lock on a cache entry, held using a lock file.
+
+    Use with a 'with' statement, or call acquire() and release() when
+    the lock must outlive a block. On platforms without fcntl this does
+    not lock anything.
+
+    The lock file is removed when the lock is released, along with the
+    entry's directories if they are empty, under the cache root 'root'.
+    A process which was waiting for the lock then finds that the file
+    it locked is no longer the lock file, and locks the new one.
+    """
+    def __init__(self, lock_path, root=None):
+        self.lock_path = lock_path
+        self.root = root
+        self.lock_file = None
+
+    def acquire(self):
+        if not fcntl:
+            return
+        while True:
+            _make_dirs(os.path.dirname(self.lock_path))
+            try:
+                lock_file = open(self.lock_path, 'a')
+            except IOError as err:
+                # retry if the directory was pruned by another process
+                if err.errno != errno.ENOENT:
+                    raise
+                continue
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            if _is_lock_file(lock_file.fileno(), self.lock_path):
+                self.lock_file = lock_file
+                return
+            lock_file.close()
+
+    def release(self):
+        if self.lock_file:
+            _remove_file(self.lock_path)
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+            if self.root:
+                _prune_dirs(self.root, os.path.dirname(self.lock_path))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+def _make_dirs(path):
+    """ Create a directory and its parents if they do not exist. Unlike
+    mkpath(), this does not remember the directories it has created,
+    which may since have been pruned.
+    """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+def _prune_dirs(root, path):
+    """ Remove 'path' and its parents below 'root' while they are empty """
+    root = os.path.normpath(root)
+    path = os.path.normpath(path)
+    while path.startswith(root + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            # not empty, or already removed
+            return
+        path = os.path.dirname(path)
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _is_lock_file(fd, lock_path):
+    """ Returns True if the file open as 'fd' is still the file at
+    'lock_path', ie. it has not been removed since it was opened
+    """
+    try:
+        path_stat = os.stat(lock_path)
+    except OSError:
+        return False
+    file_stat = os.fstat(fd)
+    return (path_stat.st_dev, path_stat.st_ino) == (file_stat.st_dev, file_stat.st_ino)
+
+def _remove_stale_lock(lock_path):
+    """ Remove a lock file which is not held, such as one left behind
+    by a process which was killed while fetching an entry
+    """
+    if not fcntl:
+        _remove_file(lock_path)
+        return
+    try:
+        fd = os.open(lock_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if _is_lock_file(fd, lock_path):
+            _remove_file(lock_path)
+    except IOError:
+        # held by a fetch in progress
+        pass
+    finally:
+        os.close(fd)
+
+def _rename_file(src, dest):
+    """ Move 'src' to 'dest', replacing 'dest' if it exists """
+    try:
+        os.rename(src, dest)
+    except OSError:
+        # rename() does not replace existing files on Windows
+        if os.name != 'nt' or not os.path.exists(dest):
+            raise
+        os.remove(dest)
+        os.rename(src, dest)
@@ -0,0 +1,418 @@
+"""
+symbol_file looks up the function, source file and line of addresses
+in a Breakpad text symbol file, as BasicSourceLineResolver does, so
+that frames can be re-symbolized in Python without re-running
+minidump_stackwalk.
+
+The symbol file is memory-mapped and, on first use, an index of the
+file is built. The index holds the addresses, sizes and line numbers
+of the FUNC, PUBLIC and line records in sorted arrays, plus the offset
+of each record in the file, so lookups are a bisection and the names
+of functions and files are only read from the symbol file when they
+are needed. STACK records are not indexed.
+
+The index can be saved to a file next to the symbol file, so that
+later loads of the same symbol file skip parsing it. An index file
+records the size and modification time of the symbol file it was built
+from and is rebuilt if they do not match. For entries in the symbol
+cache, open_cached() keeps the index next to the entry, see
+symbol_cache.INDEX_SUFFIX.
+
+Symbol cache entries compressed with gzip or zlib are decompressed into
+memory rather than mapped.
+"""
+
+from __future__ import print_function
+
+import array
+import bisect
+import cStringIO
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import minidump_stackwalk_processor
+import serialized_symbols
+import symbol_cache
+
+INDEX_MAGIC = 'BPSYMIDX'
+INDEX_FORMAT_VERSION = 4
+
+def _typecode(size):
+    """ Returns the typecode of a signed array element of 'size' bytes """
+    for typecode in 'ilq':
+        try:
+            if array.array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            # 'q' is not supported by older Pythons
+            pass
+    raise ValueError('No %d byte array type is available on this platform' % size)
+
+# Addresses in symbol files are relative to the module base, so they
+# fit in signed 64-bit integers
+ADDRESS_TYPE = _typecode(8)
+INT_TYPE = _typecode(4)
+
+# Arrays making up the index, with their element types. For each kind
+# of record, '*_offset' is the offset of the record's line in the
+# symbol file.
+INDEX_ARRAYS = [
+    ('func_address', ADDRESS_TYPE),
+    ('func_size', ADDRESS_TYPE),
+    ('func_offset', ADDRESS_TYPE),
+    ('line_address', ADDRESS_TYPE),
+    ('line_size', ADDRESS_TYPE),
+    ('line_number', INT_TYPE),
+    ('line_file', INT_TYPE),
+    ('public_address', ADDRESS_TYPE),
+    ('public_offset', ADDRESS_TYPE),
+    ('file_id', INT_TYPE),
+    ('file_offset', ADDRESS_TYPE),
+]
+
+# File header of an index: magic, format version, byte order ('<' or
+# '>'), size and modification time of the symbol file
+INDEX_HEADER = struct.Struct('<8sBcQd')
+
+# Number of bytes read to find the MODULE line
+CHUNK_HEADER_SIZE = 4096
+
+class SymbolFileError(Exception):
+    """ Raised when a file is not a valid Breakpad symbol file """
+    pass
+
+class SourceInfo(object):
+    """ The function, and if known source file and line, covering an
+    address. Addresses are relative to the module base.
+    """
+    __slots__ = ('function', 'function_base', 'source_file', 'line', 'line_base')
+
+    def __init__(self, function, function_base, source_file=None, line=None, line_base=None):
+        self.function = function
+        self.function_base = function_base
+        self.source_file = source_file
+        self.line = line
+        self.line_base = line_base
+
+class SymbolFile:
+    """ A Breakpad text symbol file with an address index.
+
+    If 'index_path' is given, the index is loaded from that path if it
+    is up to date, and otherwise is built and saved there, after which
+    'index_saved' is called with the size of the index file, if given.
+    Call close() when done.
+    """
+    def __init__(self, path, index_path=None, index_saved=None):
+        self.path = path
+        self.index_path = index_path
+        self.index_saved = index_saved
+        self.file = open(path, 'rb')
+        self.mapped = None
+        try:
+            self.data = self._load(self.file)
+            header = self.data[:CHUNK_HEADER_SIZE].split('\n', 1)[0]
+        except:
+            self.close()
+            raise
+        if not header.startswith('MODULE '):
+            self.close()
+            raise SymbolFileError('%s is not a symbol file' % path)
+        # MODULE <os> <arch> <debug id> <debug file>
+        fields = header.rstrip('\r').split(' ', 4)
+        self.os, self.arch, self.debug_id, self.debug_file = (fields[1:] + [''] * 4)[:4]
+        self.index = None
+
+    def _load(self, symbol_file):
+        stat = os.fstat(symbol_file.fileno())
+        self.source_size = stat.st_size
+        self.source_mtime = stat.st_mtime
+        if not stat.st_size:
+            return ''
+        self.mapped = mmap.mmap(symbol_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mapped[:6].startswith('MODULE'):
+            return self.mapped
+        # a compressed cache entry
+        self.mapped.close()
+        self.mapped = None
+        reader = symbol_cache.EntryReader(self.path)
+        try:
+            chunks = []
+            while True:
+                chunk = reader.read()
+                if not chunk:
+                    break
+                chunks += [chunk]
+        finally:
+            reader.close()
+        return ''.join(chunks)
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _ensure_index(self):
+        if self.index is not None:
+            return
+        if self.index_path:
+            self.index = self._read_index()
+        if self.index is None:
+            self.index = self._build_index()
+            if self.index_path:
+                self._write_index()
+
+    def _build_index(self):
+        index = dict((name, array.array(typecode)) for name, typecode in INDEX_ARRAYS)
+        funcs = []
+        lines = []
+        publics = []
+        files = []
+        functions = serialized_symbols.RangeMap()
+        in_function = False
+        # the lines of the current function, or None if it was dropped
+        function_lines = None
+        function_base = function_end = 0
+
+        stream = self.data
+        if not isinstance(stream, mmap.mmap):
+            stream = cStringIO.StringIO(stream)
+        else:
+            stream.seek(0)
+        offset = 0
+        try:
+            for line in iter(stream.readline, ''):
+                line_offset = offset
+                offset += len(line)
+                first = line[:1]
+                if first.isdigit() or first in 'abcdef':
+                    # line records, which make up most of the file, are
+                    # only allowed within a function
+                    if not in_function:
+                        raise SymbolFileError('Line record outside a function at offset %d of %s' %
+                                              (line_offset, self.path))
+                    address, size, number, file_id = line.split(' ', 4)[:4]
+                    address = int(address, 16)
+                    size = int(size, 16)
+                    number = int(number)
+                    file_id = int(file_id)
+                    # as in BasicSourceLineResolver, invalid lines and
+                    # lines overlapping an earlier one of their function
+                    # are dropped. The lines of all functions share one
+                    # array, so lines starting outside their function,
+                    # which lookup() does not use, are left out of it
+                    if (function_lines is not None and function_lines.store(address, size, None) and
+                        function_base <= address < function_end):
+                        lines += [(address, size, number, file_id)]
+                elif line.startswith('FUNC '):
+                    address, size = [int(field, 16) for field in line.split(' ', 3)[1:3]]
+                    # as in BasicSourceLineResolver, invalid or overlapping
+                    # functions are dropped along with their lines, but
+                    # their line records are still parsed
+                    function_lines = None
+                    if functions.store(address, size, None):
+                        funcs += [(address, size, line_offset)]
+                        function_lines = serialized_symbols.RangeMap()
+                        function_base = address
+                        function_end = address + size
+                    in_function = True
+                elif line.startswith('PUBLIC '):
+                    address = int(line.split(' ', 2)[1], 16)
+                    # as in BasicSourceLineResolver, public symbols at
+                    # address 0 are ignored
+                    if address:
+                        publics += [(address, line_offset)]
+                    in_function = False
+                elif line.startswith('FILE '):
+                    files += [(int(line.split(' ', 2)[1]), line_offset)]
+        except ValueError:
+            raise SymbolFileError('Malformed record at offset %d of %s' % (line_offset, self.path))
+
+        funcs.sort()
+        for address, size, func_offset in funcs:
+            index['func_address'].append(address)
+            index['func_size'].append(size)
+            index['func_offset'].append(func_offset)
+        lines.sort()
+        for address, size, number, file_id in lines:
+            index['line_address'].append(address)
+            index['line_size'].append(size)
+            index['line_number'].append(number)
+            index['line_file'].append(file_id)
+        # of public symbols at the same address, the first in the file
+        # is used
+        publics.sort()
+        for address, public_offset in publics:
+            if index['public_address'] and index['public_address'][-1] == address:
+                continue
+            index['public_address'].append(address)
+            index['public_offset'].append(public_offset)
+        # files are sorted by ID to be found with a binary search, and
+        # the first of any duplicate IDs is used
+        files.sort()
+        for file_id, file_offset in files:
+            index['file_id'].append(file_id)
+            index['file_offset'].append(file_offset)
+        return index
+
+    def _read_index(self):
+        """ Returns the saved index, or None if it is missing, stale or
+        was written on a platform with a different byte order
+        """
+        try:
+            index_file = open(self.index_path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                magic, version, byte_order, size, mtime = INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+            except struct.error:
+                return None
+            if (magic != INDEX_MAGIC or version != INDEX_FORMAT_VERSION or byte_order != _byte_order() or
+                size != self.source_size or mtime != self.source_mtime):
+                return None
+            index = {}
+            for name, typecode in INDEX_ARRAYS:
+                column = array.array(typecode)
+                count_data = index_file.read(8)
+                if len(count_data) != 8:
+                    return None
+                count, = struct.unpack('<Q', count_data)
+                try:
+                    column.fromfile(index_file, count)
+                except EOFError:
+                    return None
+                index[name] = column
+            return index
+        finally:
+            index_file.close()
+
+    def _write_index(self):
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=symbol_cache.TEMP_FILE_PREFIX)
+        except OSError:
+            # the index is only an optimization, so a read-only cache or
+            # an entry which has since been removed is not an error
+            return
+        try:
+            with os.fdopen(fd, 'wb') as index_file:
+                index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, _byte_order(),
+                                                   self.source_size, self.source_mtime))
+                for name, typecode in INDEX_ARRAYS:
+                    column = self.index[name]
+                    index_file.write(struct.pack('<Q', len(column)))
+                    column.tofile(index_file)
+            os.chmod(temp_path, 0o644)
+            size = os.path.getsize(temp_path)
+            symbol_cache._rename_file(temp_path, self.index_path)
+        except (IOError, OSError):
+            # the index is only an optimization, so a read-only cache
+            # or full disk is not an error
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        if self.index_saved:
+            self.index_saved(size)
+
+    def _record(self, offset, field_count):
+        """ Returns the last field of the record at 'offset', which has
+        'field_count' space-separated fields, the last of which may
+        itself contain spaces
+        """
+        end = self.data.find('\n', offset)
+        if end < 0:
+            end = len(self.data)
+        return self.data[offset:end].rstrip('\r').split(' ', field_count - 1)[-1]
+
+    def source_file(self, file_id):
+        """ Returns the name of the file with 'file_id', or None """
+        self._ensure_index()
+        file_ids = self.index['file_id']
+        position = bisect.bisect_left(file_ids, file_id)
+        if position == len(file_ids) or file_ids[position] != file_id:
+            return None
+        return self._record(self.index['file_offset'][position], 3)
+
+    def lookup(self, address):
+        """ Returns the SourceInfo for an address relative to the module
+        base, or None if it is not covered by any function or public
+        symbol.
+        """
+        self._ensure_index()
+        index = self.index
+
+        function_base = None
+        position = bisect.bisect_right(index['func_address'], address) - 1
+        if position >= 0:
+            function_base = index['func_address'][position]
+            if address - function_base < index['func_size'][position]:
+                info = SourceInfo(self._record(index['func_offset'][position], 5), function_base)
+                line_position = bisect.bisect_right(index['line_address'], address) - 1
+                if line_position >= 0:
+                    line_base = index['line_address'][line_position]
+                    if line_base >= function_base and address - line_base < index['line_size'][line_position]:
+                        info.source_file = self.source_file(index['line_file'][line_position])
+                        info.line = index['line_number'][line_position]
+                        info.line_base = line_base
+                return info
+
+        # as in BasicSourceLineResolver, the nearest public symbol is only
+        # used if no function lies between it and the address
+        position = bisect.bisect_right(index['public_address'], address) - 1
+        if position >= 0:
+            public_address = index['public_address'][position]
+            if function_base is None or public_address > function_base:
+                return SourceInfo(self._record(index['public_offset'][position], 4), public_address)
+        return None
+
+def _byte_order():
+    if sys.byteorder == 'little':
+        return '<'
+    return '>'
+
+def open_cached(cache, symfile_path):
+    """ Open a SymbolFile for an entry in a symbol_cache.SymbolCache,
+    keeping its index next to the entry. Returns None if the entry is
+    not in the cache.
+    """
+    entry_path = cache.entry_path(symfile_path)
+    try:
+        return SymbolFile(entry_path, entry_path + symbol_cache.INDEX_SUFFIX,
+                          lambda size: cache.record_index_size(symfile_path, size))
+    except IOError:
+        return None
+
+def symbolize_frame(frame, symbols):
+    """ Returns a copy of a minidump_stackwalk_processor.Frame without
+    a function, whose address is therefore relative to its module base,
+    symbolized using a SymbolFile. As in minidump_stackwalk's output, the
+    address of the new frame is relative to the start of its source line
+    or function. Returns the frame itself if it already has a function
+    or the address is not covered by the symbols.
+    """
+    if frame.function:
+        return frame
+    try:
+        address = int(frame.addr, 16)
+    except (TypeError, ValueError):
+        return frame
+    info = symbols.lookup(address)
+    if not info:
+        return frame
+    if info.line is not None:
+        return minidump_stackwalk_processor.Frame(frame.module, info.function, info.source_file or '',
+                                                  str(info.line), '0x%x' % (address - info.line_base))
+    return minidump_stackwalk_processor.Frame(frame.module, info.function, '', '',
+                                              '0x%x' % (address - info.function_base))
@@ -0,0 +1,287 @@
+"""
+symbol_http provides a pooled HTTP client for fetching symbol files
+from symbol servers.
+
+Connections are kept alive and reused for later requests to the
+same host, which avoids a TCP (and TLS) handshake per request when
+fetch-symbols.py tries several servers and alternate names, and
+across requests handled by the long-lived symbol service.
+
+Responses are requested with gzip content encoding and decoded in
+chunks as they are read.
+
+Requests made in parallel can be added to a RequestGroup, which closes
+the connections of those still in progress once one of them has
+produced the response that is wanted.
+"""
+
+from __future__ import print_function
+
+import httplib
+import socket
+import threading
+import urlparse
+import zlib
+
+# Maximum number of idle connections to keep open to each host
+MAX_IDLE_CONNECTIONS = 4
+
+# Maximum number of redirects to follow for a request
+MAX_REDIRECTS = 5
+
+# Size of the chunks in which compressed responses are read
+CHUNK_SIZE = 64 * 1024
+
+# Errors raised when a request fails because of a connection problem
+CONNECTION_ERRORS = (httplib.HTTPException, socket.error)
+
+class HTTPError(Exception):
+    """ Raised when a server responds to a request with an error status """
+    def __init__(self, url, status, reason):
+        Exception.__init__(self, 'HTTP Error %d: %s' % (status, reason))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+class Response:
+    """ A response to a request made with ConnectionPool.get().
+
+    The body is decompressed as it is read if the server used gzip
+    content encoding. Once the body has been read to the end the
+    connection is returned to the pool. Call close() to discard a
+    response which has not been completely read.
+    """
+    def __init__(self, pool, host_key, connection, response, group=None):
+        self.pool = pool
+        self.host_key = host_key
+        self.connection = connection
+        self.response = response
+        self.group = group
+        self.status = response.status
+        self.decompressor = None
+        self.buffer = ''
+        if (response.getheader('content-encoding') or '').lower() == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, size=CHUNK_SIZE):
+        """ Read up to 'size' bytes of the body. Returns an empty string
+        at the end of the body.
+        """
+        if not self.decompressor:
+            data = self.response.read(size)
+            if not data:
+                self._release()
+            return data
+
+        while not self.buffer:
+            compressed = self.response.read(CHUNK_SIZE)
+            if not compressed:
+                self.buffer = self.decompressor.flush()
+                self._release()
+                break
+            self.buffer = self.decompressor.decompress(compressed)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def close(self):
+        """ Discard the remainder of the response """
+        if self.connection:
+            if self.group:
+                self.group._remove(self.connection)
+            self.connection.close()
+            self.connection = None
+
+    def _release(self):
+        if self.connection:
+            if self.group:
+                self.group._remove(self.connection)
+            if self.response.will_close:
+                self.connection.close()
+            else:
+                self.pool._put(self.host_key, self.connection)
+            self.connection = None
+
+class RequestGroup:
+    """ A set of requests made in parallel, such as lookups of the same
+    symbol file on several servers, which can be cancelled together.
+
+    Connections are part of the group from when a request is made until
+    its response has been read or closed. cancel() shuts them down, so
+    that threads waiting for a response raise one of CONNECTION_ERRORS
+    rather than waiting for the server until the request times out.
+    """
+    def __init__(self):
+        self.connections = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self, keep=None):
+        """ Cancel all requests in the group except the one which
+        returned the Response 'keep'. Requests made with the group after
+        it has been cancelled fail immediately.
+        """
+        with self.lock:
+            self.cancelled = True
+            connections = [connection for connection in self.connections
+                           if not keep or connection is not keep.connection]
+            self.connections.difference_update(connections)
+        for connection in connections:
+            # closing the socket does not wake a thread which is blocked
+            # reading from it, but shutting it down does
+            sock = connection.sock
+            if sock:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def _add(self, connection):
+        with self.lock:
+            if self.cancelled:
+                raise socket.error('Request cancelled')
+            self.connections.add(connection)
+
+    def _check(self):
+        # called once a request has been sent, since a connection which
+        # was still being opened when the group was cancelled could not
+        # be shut down
+        with self.lock:
+            if self.cancelled:
+                raise socket.error('Request cancelled')
+
+    def _remove(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+class ConnectionPool:
+    """ Keeps HTTP connections to symbol servers open for reuse.
+
+    A pool can be shared between threads. Each request uses a
+    connection of its own, which is returned to the pool once the
+    response has been read.
+    """
+    def __init__(self, timeout=None, max_idle_connections=MAX_IDLE_CONNECTIONS):
+        self.timeout = timeout
+        self.max_idle_connections = max_idle_connections
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers={}, group=None):
+        """ Make a GET request for 'url', following redirects.
+
+        Returns a Response for successful (2xx) and 'Not Modified' (304)
+        responses. Raises HTTPError for error responses and one of
+        CONNECTION_ERRORS if the request could not be made or was
+        cancelled through the RequestGroup 'group'.
+        """
+        for i in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers, group=group)
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('location')
+                response.close()
+                if not location:
+                    raise HTTPError(url, response.status, 'Redirect without a location')
+                url = urlparse.urljoin(url, location)
+                continue
+            if response.status >= 400:
+                reason = response.response.reason
+                response.close()
+                raise HTTPError(url, response.status, reason)
+            return response
+        raise HTTPError(url, response.status, 'Too many redirects')
+
+    def head(self, url, headers={}):
+        """ Make a HEAD request for 'url'. Redirects are not followed.
+
+        Returns the response status, or raises one of CONNECTION_ERRORS
+        if the request could not be made.
+        """
+        response = self._request(url, headers, 'HEAD')
+        response.read()
+        return response.status
+
+    def put(self, url, body, headers={}):
+        """ Make a PUT request to upload 'body', a string or a file
+        opened for reading, to 'url'. Redirects are not followed.
+
+        Returns a Response for successful (2xx) responses. Raises
+        HTTPError for other responses and one of CONNECTION_ERRORS if
+        the request could not be made.
+        """
+        response = self._request(url, headers, 'PUT', body)
+        if response.status >= 300:
+            reason = response.response.reason
+            response.close()
+            raise HTTPError(url, response.status, reason)
+        return response
+
+    def close(self):
+        """ Close all idle connections """
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections = {}
+
+    def _request(self, url, headers, method='GET', body=None, group=None):
+        parts = urlparse.urlsplit(url)
+        host_key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {'Accept-Encoding' : 'gzip'}
+        request_headers.update(headers)
+
+        connection = self._take(host_key)
+        reused = connection is not None
+        while True:
+            if not connection:
+                connection = self._connect(host_key)
+            try:
+                if group:
+                    group._add(connection)
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                connection.request(method, path, body, request_headers)
+                if group:
+                    group._check()
+                return Response(self, host_key, connection, connection.getresponse(), group)
+            except CONNECTION_ERRORS:
+                if group:
+                    group._remove(connection)
+                connection.close()
+                connection = None
+                if not reused or (group and group.cancelled):
+                    raise
+                # the server may have closed an idle connection,
+                # so retry once on a new connection
+                reused = False
+
+    def _connect(self, host_key):
+        scheme, host, port = host_key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        elif scheme == 'http':
+            return httplib.HTTPConnection(host, port, timeout=self.timeout)
+        else:
+            raise httplib.InvalidURL('Unsupported URL scheme %s' % scheme)
+
+    def _take(self, host_key):
+        with self.lock:
+            connections = self.idle_connections.get(host_key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def _put(self, host_key, connection):
+        with self.lock:
+            connections = self.idle_connections.setdefault(host_key, [])
+            if len(connections) < self.max_idle_connections:
+                connections.append(connection)
+                return
+        connection.close()
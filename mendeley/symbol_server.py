@@ -0,0 +1,408 @@
+"""
+symbol_server provides an HTTP symbol server which serves a directory
+of Breakpad symbol files in the layout fetch-symbols.py expects,
+'<root>/<debug file>/<debug id>/<name>.sym', and accepts uploads of
+new symbol files. See serve-symbols.py and upload-symbols.py.
+
+Each request is handled on a thread of its own and connections are
+kept alive between requests, so many fetchers can be served at once.
+
+Responses carry an ETag and Last-Modified header and conditional
+requests are answered with 'Not Modified' when the file is unchanged,
+so fetchers can revalidate their cached copies cheaply. Clients which
+accept gzip content encoding receive the file compressed as it is
+read, in chunked transfer encoding. Requests with a single byte range
+receive that part of the file uncompressed.
+
+When uploads are allowed, a symbol file is uploaded with a PUT request
+to its path, optionally with gzip content encoding. The upload is
+written to a temporary file and renamed into place once its MODULE
+record has been checked against the path, so fetchers never see a
+partial symbol file. An upload with 'If-None-Match: *' is refused with
+'Precondition Failed' if the symbol file already exists.
+"""
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import SocketServer
+import email.utils
+import gzip
+import os
+import re
+import tempfile
+import threading
+import urllib
+import zlib
+
+# Size of the chunks in which files are read and written
+CHUNK_SIZE = 64 * 1024
+
+# Compression level used for gzip responses
+COMPRESSION_LEVEL = 6
+
+# Files smaller than this are sent without compression, since the
+# saving would not cover the cost of compressing them
+MIN_COMPRESS_SIZE = 1024
+
+# Number of connections waiting to be accepted before further
+# connections are refused
+REQUEST_QUEUE_SIZE = 128
+
+# Prefix of the temporary files uploads are written to
+TEMP_FILE_PREFIX = '.tmp-'
+
+# 'bytes=<first>-<last>', where either may be omitted
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class UploadError(Exception):
+    """ Raised when an uploaded symbol file is refused """
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def symbol_file_path(module_line):
+    """ Returns the '<debug file>/<debug id>/<name>.sym' path of a symbol
+    file starting with 'module_line', or None if it is not a valid
+    MODULE record. This matches the paths fetch-symbols.py requests.
+    """
+    # MODULE <os> <arch> <debug id> <debug file>
+    fields = module_line.rstrip('\r\n').split(' ', 4)
+    if len(fields) != 5 or fields[0] != 'MODULE' or not fields[3] or '/' in fields[4]:
+        return None
+    debug_file = fields[4]
+    if debug_file.endswith('.pdb'):
+        name = debug_file[0:-4] + '.sym'
+    else:
+        name = debug_file + '.sym'
+    return '%s/%s/%s' % (debug_file, fields[3], name)
+
+def parse_range(header, size):
+    """ Returns the (first, last) byte offsets of the file selected by a
+    'Range' header, None if the header should be ignored or 'size' if the
+    range cannot be satisfied.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        # unknown units and multiple ranges are answered with the whole
+        # file, which RFC 7233 permits
+        return None
+    if not match.group(1):
+        length = int(match.group(2))
+        if length == 0:
+            return size
+        return (max(size - length, 0), size - 1)
+    first = int(match.group(1))
+    if first >= size:
+        return size
+    last = int(match.group(2)) if match.group(2) else size - 1
+    if first > last:
+        return None
+    return (first, min(last, size - 1))
+
+class SymbolServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._send_file(send_body=True)
+
+    def do_HEAD(self):
+        self._send_file(send_body=False)
+
+    def do_PUT(self):
+        length = self.headers.get('Content-Length')
+        if not length or not length.isdigit():
+            self.close_connection = 1
+            self._send_status(411, 'Content-Length required')
+            return
+        path = self._file_path()
+        encoding = self.headers.get('Content-Encoding', '').lower()
+        if_none_match = self.headers.get('If-None-Match', '').strip() == '*'
+        try:
+            if not self.server.allow_upload:
+                raise UploadError(405, 'Uploads are not allowed')
+            if path is None:
+                raise UploadError(404, 'Not a symbol file path')
+            self.server.check_upload(path, encoding, if_none_match)
+        except UploadError as err:
+            # the body is discarded so that the client reads the response
+            # rather than finding the connection closed mid-upload
+            try:
+                _copy(self.rfile, int(length), _Discard())
+            except UploadError:
+                self.close_connection = 1
+            self._send_status(err.status, str(err), [('Allow', 'GET, HEAD')] if err.status == 405 else [])
+            return
+        try:
+            created = self.server.store(path, self.rfile, int(length), encoding, if_none_match)
+        except UploadError as err:
+            self.close_connection = 1
+            self._send_status(err.status, str(err))
+            return
+        self._send_status(201 if created else 204, None)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _file_path(self):
+        """ Returns the path in the symbol directory named by the request
+        path, or None if it does not name a file in it
+        """
+        request_path = urllib.unquote(self.path.split('?', 1)[0])
+        components = [component for component in request_path.split('/') if component]
+        if not components or any(component in ('.', '..') or component.startswith(TEMP_FILE_PREFIX)
+                                 or '\\' in component for component in components):
+            return None
+        return os.path.join(self.server.root, *components)
+
+    def _send_status(self, status, message, headers=[]):
+        body = '%s\n' % message if message else ''
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if body:
+            self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_file(self, send_body):
+        path = self._file_path()
+        try:
+            symbol_file = open(path, 'rb') if path else None
+        except IOError:
+            # also raised for directories
+            symbol_file = None
+        if not symbol_file:
+            self._send_status(404, 'Not found')
+            return
+
+        try:
+            stat = os.fstat(symbol_file.fileno())
+            etag = '"%x-%x"' % (int(stat.st_mtime * 1000000), stat.st_size)
+            last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+            headers = [('ETag', etag), ('Last-Modified', last_modified), ('Accept-Ranges', 'bytes'),
+                       ('Vary', 'Accept-Encoding')]
+
+            if self._not_modified(etag, stat.st_mtime):
+                self._send_status(304, None, headers)
+                return
+
+            byte_range = None
+            if self.headers.get('Range') and self.headers.get('If-Range', etag) in (etag, last_modified):
+                byte_range = parse_range(self.headers.get('Range'), stat.st_size)
+            if byte_range == stat.st_size:
+                self._send_status(416, 'Range not satisfiable', [('Content-Range', 'bytes */%d' % stat.st_size)])
+                return
+
+            compress = (byte_range is None and stat.st_size >= MIN_COMPRESS_SIZE and
+                        self._accepts_gzip())
+            if byte_range:
+                first, last = byte_range
+                self.send_response(206)
+                headers += [('Content-Range', 'bytes %d-%d/%d' % (first, last, stat.st_size)),
+                            ('Content-Length', str(last - first + 1))]
+            else:
+                first, last = 0, stat.st_size - 1
+                self.send_response(200)
+                if compress and self.request_version != 'HTTP/1.1':
+                    # HTTP/1.0 clients have no chunked encoding, so the end
+                    # of the body is marked by closing the connection
+                    headers += [('Content-Encoding', 'gzip')]
+                    self.close_connection = 1
+                elif compress:
+                    headers += [('Content-Encoding', 'gzip'), ('Transfer-Encoding', 'chunked')]
+                else:
+                    headers += [('Content-Length', str(stat.st_size))]
+            headers += [('Content-Type', 'text/plain')]
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if not send_body:
+                return
+
+            symbol_file.seek(first)
+            if compress:
+                self._send_compressed(symbol_file)
+            else:
+                remaining = last - first + 1
+                while remaining > 0:
+                    data = symbol_file.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        # the file was truncated after its size was sent
+                        self.close_connection = 1
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+        finally:
+            symbol_file.close()
+
+    def _send_compressed(self, symbol_file):
+        chunked = self.request_version == 'HTTP/1.1'
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        while True:
+            data = symbol_file.read(CHUNK_SIZE)
+            compressed = compressor.compress(data) if data else compressor.flush()
+            if compressed and chunked:
+                self.wfile.write('%x\r\n%s\r\n' % (len(compressed), compressed))
+            elif compressed:
+                self.wfile.write(compressed)
+            if not data:
+                break
+        if chunked:
+            self.wfile.write('0\r\n\r\n')
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            since = email.utils.parsedate_tz(if_modified_since)
+            return since is not None and int(mtime) <= email.utils.mktime_tz(since)
+        return False
+
+    def _accepts_gzip(self):
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            params = coding.strip().split(';')
+            if params[0].strip().lower() != 'gzip':
+                continue
+            # 'gzip;q=0' means gzip is not acceptable
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+class SymbolServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server for the symbol files under 'root'. Uploads are
+    refused unless 'allow_upload' is set.
+    """
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, address, root, allow_upload=False, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, SymbolServerHandler)
+        self.root = os.path.abspath(root)
+        self.allow_upload = allow_upload
+        self.verbose = verbose
+        self.url = 'http://%s:%d' % (self.server_address[0], self.server_address[1])
+
+    def check_upload(self, path, encoding, if_none_match=False):
+        """ Raises UploadError if an upload to 'path' would be refused
+        before its body is read
+        """
+        if encoding not in ('', 'identity', 'gzip'):
+            raise UploadError(415, 'Unsupported content encoding %s' % encoding)
+        if not path.endswith('.sym'):
+            raise UploadError(422, 'Only symbol files can be uploaded')
+        if if_none_match and os.path.exists(path):
+            raise UploadError(412, '%s already exists' % os.path.relpath(path, self.root).replace(os.sep, '/'))
+
+    def store(self, path, body, length, encoding, if_none_match=False):
+        """ Store 'length' bytes read from 'body' as the symbol file at
+        'path', decompressing them if 'encoding' is 'gzip'. Returns True
+        if the symbol file was created or False if it replaced an
+        existing one. Raises UploadError if the upload is refused.
+        """
+        self.check_upload(path, encoding, if_none_match)
+        relative_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+
+        dir_path = os.path.dirname(path)
+        try:
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        except OSError:
+            # created by a concurrent upload
+            if not os.path.isdir(dir_path):
+                raise UploadError(500, 'Unable to create %s' % os.path.dirname(relative_path))
+        temp_fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                head = self._copy_upload(body, length, encoding, temp_file)
+            expected_path = symbol_file_path(head.split('\n', 1)[0])
+            if not expected_path:
+                raise UploadError(422, 'Not a symbol file')
+            # the debug file may be an alternative name for the module, but
+            # the debug ID must match
+            if relative_path.split('/')[-2:-1] != expected_path.split('/')[1:2]:
+                raise UploadError(422, 'Symbol file for %s uploaded to %s' % (expected_path, relative_path))
+            os.chmod(temp_path, 0o644)
+
+            created = not os.path.exists(path)
+            if if_none_match and hasattr(os, 'link'):
+                # fail rather than replace a file uploaded concurrently
+                try:
+                    os.link(temp_path, path)
+                except OSError:
+                    raise UploadError(412, '%s already exists' % relative_path)
+                os.remove(temp_path)
+            else:
+                os.rename(temp_path, path)
+            return created
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _copy_upload(self, body, length, encoding, out):
+        """ Copy an upload to 'out'. Returns the start of the symbol file """
+        if encoding != 'gzip':
+            return _copy(body, length, out)
+
+        # the compressed upload is spooled so that GzipFile can check its
+        # length and CRC, which a zlib decompressor alone does not report
+        compressed = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE * 16)
+        try:
+            _copy(body, length, compressed)
+            compressed.seek(0)
+            gzip_file = gzip.GzipFile(fileobj=compressed, mode='rb')
+            head = ''
+            while True:
+                data = gzip_file.read(CHUNK_SIZE)
+                if not data:
+                    return head
+                if not head:
+                    head = data
+                out.write(data)
+        except (IOError, EOFError, zlib.error) as err:
+            raise UploadError(400, 'Invalid gzip data: %s' % err)
+        finally:
+            compressed.close()
+
+def _copy(body, length, out):
+    """ Copy 'length' bytes from 'body' to 'out'. Returns the first
+    chunk copied.
+    """
+    first = ''
+    remaining = length
+    while remaining > 0:
+        data = body.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise UploadError(400, 'Upload ended after %d of %d bytes' % (length - remaining, length))
+        if not first:
+            first = data
+        remaining -= len(data)
+        out.write(data)
+    return first
+
+class _Discard:
+    def write(self, data):
+        pass
+
+def start_server(root, host='127.0.0.1', port=0, allow_upload=False):
+    """ Start a SymbolServer on a background thread, for tests and
+    benchmarks. Returns the server, whose 'url' is its base URL. Call
+    shutdown() to stop it.
+    """
+    server = SymbolServer((host, port), root, allow_upload)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
@@ -0,0 +1,359 @@
+"""
+symbol_shards splits a Breakpad text symbol file into shards covering
+ranges of addresses, so that a stackwalk can be given a symbol file
+trimmed to the parts of a module its minidump refers to instead of the
+whole file.
+
+A crash usually involves a few dozen functions in a module, while the
+symbol file for a large binary runs to hundreds of megabytes. The FUNC
+(with their line records), PUBLIC, STACK WIN and STACK CFI records of a
+symbol file are sorted by address and cut into shards of roughly equal
+size. Each shard is itself a valid symbol file, starting with the MODULE
+line and the FILE records its line records refer to. An index lists the
+address range each shard covers.
+
+Given the addresses a minidump refers to in a module, select_shards()
+chooses every shard with a record covering one of them. Since an address
+outside any function is attributed to the nearest PUBLIC symbol below it,
+unless a FUNC lies in between, it also chooses the shards holding the
+nearest FUNC and PUBLIC records below each address. assemble() joins the
+chosen shards into a symbol file which resolves those addresses as the
+full symbol file does.
+
+build_shards() applies BasicSourceLineResolver's rules for records which
+are dropped when a symbol file is loaded, such as overlapping functions,
+so that leaving records out cannot change which of the remaining records
+are used. STACK CFI delta records are kept with the STACK CFI INIT record
+they follow, as dump_syms writes them.
+
+On a symbol server, the shards of '<name>.sym' are kept in the
+'<name>.sym.shards' directory next to it, see shard-symbols.py, and
+fetch-symbols.py --addresses fetches only the index and the shards it
+needs.
+"""
+
+from __future__ import print_function
+
+import bisect
+import re
+
+import serialized_symbols
+
+# Suffix of the directory holding the shards of a symbol file
+SHARDS_SUFFIX = '.shards'
+
+# Name of the index in a shard directory. Shard N is named 'N.sym'
+INDEX_NAME = 'index'
+
+# Default size of a shard, in bytes
+DEFAULT_SHARD_SIZE = 64 * 1024
+
+# The stackwalkers look up a caller's frame at its return address less
+# one, or less two on ARM, so addresses up to this many bytes below each
+# address are also covered
+ADDRESS_SLACK = 2
+
+# Kinds of record, in the order they are written in a shard
+FUNC = 0
+PUBLIC = 1
+STACK_WIN = 2
+STACK_CFI = 3
+RECORD_KINDS = [FUNC, PUBLIC, STACK_WIN, STACK_CFI]
+
+class SymbolShardsError(Exception):
+    """ Raised when a symbol file cannot be sharded, or an index or
+    shard is not valid
+    """
+    pass
+
+class ShardInfo(object):
+    """ The entry for a shard in a ShardIndex.
+
+    'start' is the lowest address of a record in the shard, 'end' is one
+    past the highest address covered by any of its records, and
+    'first_function' and 'first_public' are the lowest addresses of its
+    FUNC and PUBLIC records, or None if it has none.
+    """
+    __slots__ = ('start', 'end', 'first_function', 'first_public', 'size')
+
+    def __init__(self, start, end, first_function, first_public, size):
+        self.start = start
+        self.end = end
+        self.first_function = first_function
+        self.first_public = first_public
+        self.size = size
+
+class ShardIndex:
+    """ The index of a sharded symbol file.
+
+    'header' is the MODULE and INFO records of the symbol file and
+    'shards' is a list of ShardInfos, ordered by start address.
+    """
+    def __init__(self, header, shards):
+        self.header = header
+        self.shards = shards
+
+    def format(self):
+        """ Returns the index as text. Like a symbol file, it starts
+        with the MODULE record.
+        """
+        lines = list(self.header)
+        for shard in self.shards:
+            lines += ['SHARD %x %x %s %s %d' % (shard.start, shard.end, _format_address(shard.first_function),
+                                                _format_address(shard.first_public), shard.size)]
+        return ''.join(line + '\n' for line in lines)
+
+    @staticmethod
+    def parse(data):
+        """ Parse an index written by format() """
+        header = []
+        shards = []
+        for line in data.splitlines():
+            if line.startswith('SHARD '):
+                fields = line.split(' ')
+                if len(fields) != 6:
+                    raise SymbolShardsError('Invalid shard index record: %s' % line[:100])
+                try:
+                    shards += [ShardInfo(int(fields[1], 16), int(fields[2], 16), _parse_address(fields[3]),
+                                         _parse_address(fields[4]), int(fields[5]))]
+                except ValueError:
+                    raise SymbolShardsError('Invalid shard index record: %s' % line[:100])
+            elif line.startswith('MODULE ') or line.startswith('INFO '):
+                header += [line]
+        if not header or not header[0].startswith('MODULE '):
+            raise SymbolShardsError('Shard index does not start with a MODULE record')
+        return ShardIndex(header, shards)
+
+    def select_shards(self, addresses):
+        """ Returns the positions, in order, of the shards needed to look
+        up 'addresses', which are relative to the module base
+        """
+        starts = [shard.start for shard in self.shards]
+        # the furthest any shard up to each position reaches
+        reach = []
+        for shard in self.shards:
+            reach += [max([shard.end] + reach[-1:])]
+
+        selected = set()
+        for address in addresses:
+            low = max(address - ADDRESS_SLACK, 0)
+            last = bisect.bisect_right(starts, address) - 1
+
+            # shards with a record covering the addresses
+            position = last
+            while position >= 0 and reach[position] > low:
+                if self.shards[position].end > low:
+                    selected.add(position)
+                position -= 1
+
+            # and those with the nearest FUNC and PUBLIC records below
+            # them, which need not cover them
+            for field in ('first_function', 'first_public'):
+                position = bisect.bisect_right(starts, low) - 1
+                while position >= 0:
+                    first = getattr(self.shards[position], field)
+                    if first is not None and first <= low:
+                        selected.add(position)
+                        break
+                    position -= 1
+        return sorted(selected)
+
+def _format_address(address):
+    if address is None:
+        return '-'
+    return '%x' % address
+
+def _parse_address(field):
+    if field == '-':
+        return None
+    return int(field, 16)
+
+def shard_name(position):
+    """ Returns the file name of the shard at 'position' """
+    return '%d.sym' % position
+
+class _Record(object):
+    """ A FUNC, PUBLIC, STACK WIN or STACK CFI INIT record, with the line
+    records of a FUNC or the delta records following a STACK CFI INIT
+    """
+    __slots__ = ('kind', 'address', 'end', 'lines', 'file_ids')
+
+    def __init__(self, kind, address, end, line):
+        self.kind = kind
+        self.address = address
+        self.end = end
+        self.lines = [line]
+        self.file_ids = set()
+
+def _read_records(symbol_data):
+    """ Returns the header, FILE records by ID and the _Records of a
+    symbol file which BasicSourceLineResolver would keep
+    """
+    header = []
+    files = {}
+    records = []
+    functions = serialized_symbols.RangeMap()
+    cfi_initial_rules = serialized_symbols.RangeMap()
+    windows_frame_info = [serialized_symbols.ContainedRangeMap()
+                          for i in range(serialized_symbols.STACK_INFO_TYPES)]
+    public_addresses = set()
+
+    # the records which line records and STACK CFI delta records belong
+    # to, as in BasicSourceLineResolver only PUBLIC records end a function
+    function = None
+    cfi = None
+    for line_number, line in enumerate(re.split('[\r\n]+', symbol_data), 1):
+        if not line:
+            continue
+        try:
+            if line.startswith('FILE '):
+                file_id = int(line.split(' ', 2)[1])
+                files.setdefault(file_id, line)
+            elif line.startswith('FUNC '):
+                address, size = [int(field, 16) for field in line.split(' ', 3)[1:3]]
+                function = _Record(FUNC, address, address + size, line)
+                # invalid or overlapping functions are dropped along
+                # with their lines
+                if functions.store(address, size, None):
+                    records += [function]
+            elif line.startswith('PUBLIC '):
+                address = int(line.split(' ', 2)[1], 16)
+                function = None
+                # public symbols at address 0 are ignored, but two at
+                # any other address are an error
+                if address:
+                    if address in public_addresses:
+                        raise SymbolShardsError('Duplicate PUBLIC record at line %d' % line_number)
+                    public_addresses.add(address)
+                    records += [_Record(PUBLIC, address, address + 1, line)]
+            elif line.startswith('STACK WIN '):
+                fields = line.split(' ', 6)
+                stack_info_type, address, size = [int(field, 16) for field in fields[2:5]]
+                if not 0 <= stack_info_type < serialized_symbols.STACK_INFO_TYPES:
+                    raise ValueError(stack_info_type)
+                if windows_frame_info[stack_info_type].store(address, size, None):
+                    records += [_Record(STACK_WIN, address, address + size, line)]
+            elif line.startswith('STACK CFI INIT '):
+                address, size = [int(field, 16) for field in line.split(' ', 5)[3:5]]
+                cfi = _Record(STACK_CFI, address, address + size, line)
+                if cfi_initial_rules.store(address, size, None):
+                    records += [cfi]
+            elif line.startswith('STACK CFI '):
+                if cfi is None:
+                    raise SymbolShardsError('STACK CFI record without a STACK CFI INIT record at line %d' %
+                                            line_number)
+                int(line.split(' ', 3)[2], 16)
+                cfi.lines += [line]
+            elif line.startswith('MODULE ') or line.startswith('INFO '):
+                header += [line]
+            else:
+                if function is None:
+                    raise SymbolShardsError('Line record outside a function at line %d' % line_number)
+                address, size, number, file_id = line.split(' ', 4)[:4]
+                # the fields are only checked, the record is copied as it is
+                int(address, 16), int(size, 16), int(number)
+                function.lines += [line]
+                function.file_ids.add(int(file_id))
+        except (ValueError, IndexError):
+            raise SymbolShardsError('Invalid symbol file record at line %d: %s' % (line_number, line[:100]))
+    if not header or not header[0].startswith('MODULE '):
+        raise SymbolShardsError('Symbol file does not start with a MODULE record')
+    return header, files, records
+
+def build_shards(symbol_data, shard_size=DEFAULT_SHARD_SIZE):
+    """ Split the contents of a text symbol file into shards of about
+    'shard_size' bytes. Returns a (ShardIndex, list of shard contents)
+    tuple. Raises SymbolShardsError if the symbol file is not valid.
+    """
+    header, files, records = _read_records(symbol_data)
+    # records are sorted by address, keeping their order in the symbol
+    # file for records at the same address
+    records.sort(key=lambda record: record.address)
+
+    groups = []
+    group = []
+    group_size = 0
+    for record in records:
+        group += [record]
+        group_size += sum(len(line) + 1 for line in record.lines)
+        if group_size >= shard_size:
+            groups += [group]
+            group = []
+            group_size = 0
+    if group:
+        groups += [group]
+
+    module_line = header[0] + '\n'
+    infos = []
+    shards = []
+    for group in groups:
+        file_ids = set()
+        for record in group:
+            file_ids.update(record.file_ids)
+        lines = [files[file_id] for file_id in sorted(file_ids) if file_id in files]
+        for kind in RECORD_KINDS:
+            for record in group:
+                if record.kind == kind:
+                    lines += record.lines
+        data = module_line + ''.join(line + '\n' for line in lines)
+
+        functions = [record.address for record in group if record.kind == FUNC]
+        publics = [record.address for record in group if record.kind == PUBLIC]
+        infos += [ShardInfo(group[0].address, max(record.end for record in group),
+                            functions[0] if functions else None,
+                            publics[0] if publics else None, len(data))]
+        shards += [data]
+    return ShardIndex(header, infos), shards
+
+def _shard_records(data):
+    """ Returns the FILE records and the records of each kind in a
+    shard
+    """
+    files = []
+    blocks = dict((kind, []) for kind in RECORD_KINDS)
+    kind = FUNC
+    for line in data.splitlines():
+        if not line or line.startswith('MODULE ') or line.startswith('INFO '):
+            continue
+        if line.startswith('FILE '):
+            files += [line]
+            continue
+        if line.startswith('PUBLIC '):
+            kind = PUBLIC
+        elif line.startswith('STACK WIN '):
+            kind = STACK_WIN
+        elif line.startswith('STACK '):
+            kind = STACK_CFI
+        elif line.startswith('FUNC '):
+            kind = FUNC
+        blocks[kind] += [line]
+    return files, blocks
+
+def assemble(index, shards):
+    """ Join the contents of shards selected from a ShardIndex, in the
+    order of select_shards(), into a symbol file
+    """
+    files = []
+    file_ids = set()
+    blocks = dict((kind, []) for kind in RECORD_KINDS)
+    for data in shards:
+        shard_files, shard_blocks = _shard_records(data)
+        for line in shard_files:
+            file_id = line.split(' ', 2)[1]
+            if file_id not in file_ids:
+                file_ids.add(file_id)
+                files += [line]
+        for kind in RECORD_KINDS:
+            blocks[kind] += shard_blocks[kind]
+
+    lines = list(index.header) + files
+    for kind in RECORD_KINDS:
+        lines += blocks[kind]
+    return ''.join(line + '\n' for line in lines)
+
+def trim(symbol_data, addresses, shard_size=DEFAULT_SHARD_SIZE):
+    """ Returns a symbol file with only the shards of 'symbol_data'
+    needed to look up 'addresses'
+    """
+    index, shards = build_shards(symbol_data, shard_size)
+    return assemble(index, [shards[position] for position in index.select_shards(addresses)])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Tests crash signature generation and bucketing.
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import crash_signature
+import minidump_stackwalk_processor
+
+STACKWALK_OUTPUT = """OS|Linux|0.0.0 Linux 4.4
+CPU|amd64|family 6|4
+Crash|SIGABRT|0x0|1
+Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1
+
+0|0|libc.so.6|__poll|||0x100
+1|0|libc.so.6|raise|||0x35
+1|1|libc.so.6|abort|||0x16a
+1|2|test_app|std::vector<int, std::allocator<int> >::at(unsigned long) const|vector.h|12|0x4
+1|3|test_app|Parser::parse(char const*)|parser.cc|40|0x8
+1|4|test_app|Parser::parse(char const*)|parser.cc|44|0x8
+1|5|test_app|main|main.cc|7|0x5
+1|6|libc.so.6||||0x21b45
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def main():
+    trace = minidump_stackwalk_processor.Stacktrace.parse(STACKWALK_OUTPUT)
+    generator = crash_signature.SignatureGenerator()
+    signature = generator.signature(trace)
+    expected_frames = ['std::vector<T>::at', 'Parser::parse', 'main', '[libc.so.6]']
+    check(signature.frames == expected_frames, 'Unexpected signature %s' % signature)
+
+    # a different build of the same crash should have the same key
+    other_build = STACKWALK_OUTPUT.replace('0x8', '0x10').replace('parser.cc|40', 'parser.cc|41')
+    check(generator.signature(minidump_stackwalk_processor.Stacktrace.parse(other_build)).key == signature.key,
+          'Signature changed between builds')
+
+    short_signature = crash_signature.SignatureGenerator(frame_count=2, prefix_patterns=[r'std::']).signature(trace)
+    check(short_signature.frames == ['raise', 'abort'], 'Unexpected signature %s' % short_signature)
+
+    bucket_index = crash_signature.BucketIndex(max_samples=2)
+    for i in range(3):
+        bucket_index.add(signature, 'crash-%d.dmp' % i)
+    bucket_index.add(short_signature, 'other.dmp')
+    buckets = bucket_index.buckets()
+    check([(bucket.key, bucket.count) for bucket in buckets] == [(signature.key, 3), (short_signature.key, 1)],
+          'Unexpected bucket counts')
+    check(buckets[0].samples == ['crash-0.dmp', 'crash-1.dmp'], 'Unexpected samples %s' % buckets[0].samples)
+    bucket_index.close()
+
+    print('Crash signature OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Tests that extract-stacktrace.py processes a batch of minidumps in
+# parallel, printing each result as it completes and reporting failed
+# minidumps without stopping the batch.
+
+from __future__ import print_function
+
+import imp
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+EXTRACT_STACKTRACE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'extract-stacktrace.py')
+
+# Length of time the stackwalk of a minidump named 'slow*.dmp' takes
+SLOW_STACKWALK_DELAY = 1
+
+# Stand-in for minidump_stackwalk, whose crashing frame is named after
+# the minidump. It fails for minidumps named 'bad*.dmp'
+FAKE_STACKWALK = """#!%(python)s
+import os, sys, time
+name = os.path.splitext(os.path.basename(sys.argv[2]))[0]
+if name.startswith('bad'):
+    sys.exit(1)
+if name.startswith('slow'):
+    time.sleep(%(delay)f)
+sys.stdout.write('OS|Linux|0.0.0 Linux 4.4\\nCPU|amd64|family 6|4\\nCrash|SIGSEGV|0x42|0\\n')
+sys.stdout.write('Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1\\n\\n')
+sys.stdout.write('0|0|test_app|crash_%%s()|test.cc|12|0x4\\n' %% name)
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def write_file(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def main():
+    extract_stacktrace = imp.load_source('extract_stacktrace', EXTRACT_STACKTRACE_PATH)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        stackwalk_path = os.path.join(temp_dir, 'minidump_stackwalk')
+        write_file(stackwalk_path, FAKE_STACKWALK % {'python': sys.executable, 'delay': SLOW_STACKWALK_DELAY})
+        os.chmod(stackwalk_path, os.stat(stackwalk_path).st_mode | stat.S_IXUSR)
+
+        dump_dir = os.path.join(temp_dir, 'dumps')
+        os.mkdir(dump_dir)
+        for name in ['slow.dmp', 'b.dmp', 'bad.dmp', 'a.dmp', 'notes.txt']:
+            write_file(os.path.join(dump_dir, name), 'MDMP')
+        other_dir = os.path.join(temp_dir, 'other')
+        os.mkdir(other_dir)
+        for name in ['d.dmp', 'c.dmp']:
+            write_file(os.path.join(other_dir, name), 'MDMP')
+
+        # directories are searched for minidumps and glob patterns are
+        # expanded, each in sorted order, while the order of the
+        # arguments is kept
+        paths = [os.path.join(other_dir, 'd.dmp'), dump_dir, os.path.join(other_dir, '*.dmp'),
+                 os.path.join(temp_dir, 'missing.dmp')]
+        dump_files = extract_stacktrace.find_dumps(paths)
+        check(dump_files == [os.path.join(other_dir, 'd.dmp')] +
+                            [os.path.join(dump_dir, name) for name in ['a.dmp', 'b.dmp', 'bad.dmp', 'slow.dmp']] +
+                            [os.path.join(other_dir, name) for name in ['c.dmp', 'd.dmp']],
+              'Unexpected minidumps %s' % dump_files)
+        print('Find minidumps OK')
+
+        # each result is printed once, as soon as it is ready, so the slow
+        # minidump comes last, and a failed minidump does not stop the batch
+        env = dict(os.environ)
+        env['MINIDUMP_STACKWALK_PATH'] = stackwalk_path
+        env['MINIDUMP_STACKWALK_SYMBOL_URL'] = 'http://127.0.0.1:1'
+        batch_files = [os.path.join(dump_dir, name) for name in ['slow.dmp', 'a.dmp', 'bad.dmp', 'b.dmp']]
+        proc = subprocess.Popen([sys.executable, EXTRACT_STACKTRACE_PATH, '-j', '4'] + batch_files,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        stdout, stderr = proc.communicate()
+        check(proc.returncode == 1, 'Failed minidump was not reported in the exit status')
+        check('Failed to process %s: StackwalkError: minidump_stackwalk exited with status 1' % batch_files[2] in stderr
+              and 'Processed 4 minidumps, 1 failed' in stderr, 'Unexpected errors %s' % stderr)
+
+        results = stdout.split('==> ')[1:]
+        printed_files = [result.split(' <==')[0] for result in results]
+        check(sorted(printed_files) == sorted(batch_files[:2] + batch_files[3:]),
+              'Unexpected results for %s' % printed_files)
+        check(printed_files[-1] == batch_files[0], 'Results were not printed as they completed')
+        for dump_file, result in zip(printed_files, results):
+            name = os.path.splitext(os.path.basename(dump_file))[0]
+            check('crash_%s()' % name in result, 'Unexpected stack trace for %s: %s' % (dump_file, result))
+        print('Batch OK')
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+# Tests fetch-symbols.py against local stand-ins for symbol servers.
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import SocketServer
+import gzip
+import hashlib
+import imp
+import os
+import select
+import socket
+import StringIO
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import metrics
+import minidump_stackwalk_processor
+import result_cache
+import serialized_symbols
+import symbol_cache
+import symbol_http
+import symbol_shards
+
+FETCH_SYMBOLS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'fetch-symbols.py')
+
+SYMBOL_FILE = 'MODULE Linux x86_64 0123456789ABCDEF test_app\nFUNC 1000 10 0 main\n'
+
+# Length of time the slow symbol server waits before responding
+SLOW_SERVER_DELAY = 5
+
+class SymbolServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.server.delay:
+            # stop waiting if the client closes the connection
+            readable, _, _ = select.select([self.connection], [], [], self.server.delay)
+            if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                self.server.closed += 1
+                return
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.server.statuses += [404]
+            self.send_error(404)
+            return
+
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.server.statuses += [304]
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.server.statuses += [200]
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressed = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+            gzip_file.write(content)
+            gzip_file.close()
+            content = compressed.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestSymbolServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files, delay=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), SymbolServerHandler)
+        self.files = files
+        self.delay = delay
+        self.statuses = []
+        self.closed = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    def handle_error(self, request, client_address):
+        # responses to requests which fetch-symbols.py has cancelled
+        # fail with a broken pipe
+        pass
+
+def fetch_symbols(servers, cache_dir, debug_file_name, debug_id, extra_args=[]):
+    command = [sys.executable, FETCH_SYMBOLS_PATH, '--cache-dir', cache_dir, '-t', '10'] + extra_args
+    for server in servers:
+        command += ['-s', server]
+    command += [debug_file_name, debug_id]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+def test_lookup(slow_server, empty_server, good_server, cache_dir):
+    fetch_symbols_module = imp.load_source('fetch_symbols', FETCH_SYMBOLS_PATH)
+    cache = symbol_cache.SymbolCache(cache_dir)
+    http = symbol_http.ConnectionPool(timeout=10)
+    fetcher = fetch_symbols_module.SymbolFetcher([slow_server.url, empty_server.url, good_server.url],
+                                                 {'test_app' : ['test_app_alt']}, cache, http)
+    delayed_server = TestSymbolServer({'/test_app/00000002/test_app.sym' : SYMBOL_FILE}, delay=1)
+    threads = set(threading.enumerate())
+
+    # the requests to the slow server should be cancelled once the good
+    # server has returned the symbols, rather than being left open until
+    # it times out, and the servers which do not have the symbols should
+    # be recorded as missing them, even if they respond after the winner,
+    # by the time the lookup returns
+    slow_server.closed = 0
+    good_server.files['/test_app/00000001/test_app.sym'] = SYMBOL_FILE
+    symbols = StringIO.StringIO()
+    fetch_symbols_module.write_symbols(fetcher.fetch('test_app', '00000001'), symbols)
+    check(symbols.getvalue() == SYMBOL_FILE, 'Unexpected symbols %s' % symbols.getvalue())
+    check(wait_for(lambda: slow_server.closed == 2, SLOW_SERVER_DELAY / 2),
+          'Request to the slow symbol server was not cancelled')
+    for server in (empty_server, good_server):
+        check(cache.is_missing('test_app_alt/00000001/test_app_alt.sym', server.url),
+              'Failed lookup was not recorded')
+    check(not cache.is_missing('test_app_alt/00000001/test_app_alt.sym', slow_server.url),
+          'Cancelled lookup was recorded as failed')
+
+    # symbols for the debug file name itself should be preferred to those
+    # for an alternative name, even if they arrive later
+    good_server.files['/test_app_alt/00000002/test_app_alt.sym'] = 'MODULE Linux x86_64 00000002 test_app_alt\n'
+    fetcher.symbol_servers = [delayed_server.url, good_server.url]
+    symbols = StringIO.StringIO()
+    fetch_symbols_module.write_symbols(fetcher.fetch('test_app', '00000002'), symbols)
+    check(symbols.getvalue() == SYMBOL_FILE, 'Symbols for an alternative name were preferred')
+
+    # but symbols for an alternative name are used once every lookup of
+    # the debug file name has failed
+    good_server.files['/test_app_alt/00000003/test_app_alt.sym'] = 'MODULE Linux x86_64 00000003 test_app_alt\n'
+    symbols = StringIO.StringIO()
+    fetch_symbols_module.write_symbols(fetcher.fetch('test_app', '00000003'), symbols)
+    check(symbols.getvalue() == 'MODULE Linux x86_64 00000003 test_app_alt\n', 'Alternative name not used')
+
+    # no requests, or server threads handling them, should be left
+    # running once idle connections are closed
+    http.close()
+    check(wait_for(lambda: set(threading.enumerate()) <= threads, SLOW_SERVER_DELAY / 2),
+          'Requests still running after lookups')
+
+def main():
+    symfile_url = '/test_app/0123456789ABCDEF/test_app.sym'
+    empty_server = TestSymbolServer({})
+    invalid_server = TestSymbolServer({symfile_url : '<html>Not a symbol file</html>'})
+    slow_server = TestSymbolServer({symfile_url : SYMBOL_FILE}, delay=SLOW_SERVER_DELAY)
+    good_server = TestSymbolServer({symfile_url : SYMBOL_FILE})
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # the fastest server with a valid symbol file should win, without
+        # waiting for the slow server
+        start_time = time.time()
+        status, symbols = fetch_symbols([slow_server.url, empty_server.url, invalid_server.url, good_server.url],
+                                        cache_dir, 'test_app', '0123456789ABCDEF')
+        check(status == 0, 'Symbols not found')
+        check(symbols == SYMBOL_FILE, 'Unexpected symbols %s' % symbols)
+        check(time.time() - start_time < SLOW_SERVER_DELAY, 'Lookup waited for the slow symbol server')
+
+        # symbols should now be served from the cache
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', '0123456789ABCDEF')
+        check(status == 0 and symbols == SYMBOL_FILE, 'Symbols not found in cache')
+
+        # invalid symbol files should be rejected
+        status, symbols = fetch_symbols([empty_server.url, invalid_server.url], cache_dir,
+                                        'test_app', 'FEDCBA9876543210')
+        check(status == 1 and not symbols, 'Invalid symbol file was accepted')
+
+        # failed lookups should not be retried until they expire
+        empty_server.statuses = []
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', 'FEDCBA9876543210')
+        check(status == 1 and not symbols, 'Missing symbols were found')
+        check(empty_server.statuses == [], 'Failed lookup was retried')
+
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', 'FEDCBA9876543210',
+                                        ['--missing-ttl', '0'])
+        check(empty_server.statuses == [404], 'Expired failed lookup was not retried')
+
+        # cached symbols should be revalidated with a conditional request
+        # and replaced if they have changed
+        good_server.statuses = []
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '0123456789ABCDEF',
+                                        ['--revalidate', '0'])
+        check(status == 0 and symbols == SYMBOL_FILE, 'Revalidated symbols not found')
+        check(good_server.statuses == [304], 'Unexpected responses %s' % good_server.statuses)
+
+        updated_symbols = SYMBOL_FILE + 'PUBLIC 2000 0 helper\n'
+        good_server.files[symfile_url] = updated_symbols
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '0123456789ABCDEF',
+                                        ['--revalidate', '0'])
+        check(status == 0 and symbols == updated_symbols, 'Changed symbols were not fetched')
+
+        # serialized symbols should be converted once and cached, and
+        # converted again when the symbol file changes
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', '0123456789ABCDEF', ['--serialized'])
+        check(status == 0 and symbols == serialized_symbols.serialize(updated_symbols), 'Unexpected serialized symbols')
+        serialized_path = os.path.join(cache_dir, 'test_app/0123456789ABCDEF/test_app.sym.serialized')
+        check(os.path.exists(serialized_path), 'Serialized symbols were not cached')
+        serialized_mtime = os.path.getmtime(serialized_path)
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', '0123456789ABCDEF', ['--serialized'])
+        check(status == 0 and symbols == serialized_symbols.serialize(updated_symbols), 'Cached serialized symbols not found')
+        check(os.path.getmtime(serialized_path) == serialized_mtime, 'Symbols were serialized again')
+
+        good_server.files[symfile_url] = SYMBOL_FILE
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '0123456789ABCDEF',
+                                        ['--revalidate', '0', '--serialized'])
+        check(status == 0 and symbols == serialized_symbols.serialize(SYMBOL_FILE), 'Stale serialized symbols were used')
+
+        # with --addresses, only the shards needed for the addresses
+        # should be fetched and joined into a trimmed symbol file
+        sharded_symbols = 'MODULE Linux x86_64 00112233 test_app\n' + ''.join(
+            'FUNC %x 10 0 function%d\n' % (address, address) for address in range(0x1000, 0x2000, 0x10))
+        index, shards = symbol_shards.build_shards(sharded_symbols, 512)
+        shards_url = '/test_app/00112233/test_app.sym.shards'
+        good_server.files[shards_url + '/index'] = index.format()
+        for position, data in enumerate(shards):
+            good_server.files['%s/%s' % (shards_url, symbol_shards.shard_name(position))] = data
+        addresses_path = os.path.join(cache_dir, 'addresses.json')
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/00112233": [%d], "test_app/44556677": [%d]}' % (0x1804, 0x1804))
+        good_server.statuses = []
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '00112233',
+                                        ['--addresses', addresses_path])
+        positions = index.select_shards([0x1804])
+        check(status == 0 and symbols == symbol_shards.assemble(index, [shards[position] for position in positions]),
+              'Unexpected trimmed symbols %s' % symbols)
+        check('FUNC 1800 10 0 function6144\n' in symbols and len(symbols) < len(sharded_symbols) / 4,
+              'Symbols were not trimmed')
+        check(good_server.statuses == [200] * (len(positions) + 1), 'Unexpected responses %s' % good_server.statuses)
+
+        # shards cached for one minidump are not newer symbols, so they do
+        # not invalidate the cached result of another minidump whose
+        # symbols were trimmed
+        results = result_cache.ResultCache(os.path.join(cache_dir, 'results'), symbol_cache.SymbolCache(cache_dir))
+        stackwalk_output = 'Module|test_app||test_app|00112233|0x00400000|0x00420000|1\n'
+        results.store('dump-a', stackwalk_output,
+                      minidump_stackwalk_processor.Stacktrace.parse(stackwalk_output).modules.values())
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/00112233": [%d]}' % 0x1f04)
+        good_server.statuses = []
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '00112233',
+                                        ['--addresses', addresses_path])
+        check(status == 0 and 'FUNC 1f00 10 0 function7936\n' in symbols and 200 in good_server.statuses,
+              'New shards were not fetched')
+        check(results.lookup('dump-a') == stackwalk_output, 'Fetching shards invalidated a cached result')
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/00112233": [%d], "test_app/44556677": [%d]}' % (0x1804, 0x1804))
+
+        # symbols which are cached or have no shards should be fetched in full
+        status, symbols = fetch_symbols([empty_server.url], cache_dir, 'test_app', '0123456789ABCDEF',
+                                        ['--addresses', addresses_path])
+        check(status == 0 and symbols == SYMBOL_FILE, 'Cached symbols not found')
+        good_server.files['/test_app/44556677/test_app.sym'] = SYMBOL_FILE
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '44556677',
+                                        ['--addresses', addresses_path])
+        check(status == 0 and symbols == SYMBOL_FILE, 'Unsharded symbols not found')
+
+        # while a failed lookup of the shards is cached, the fetch goes
+        # straight to the full symbol file
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/8899AABB": [%d]}' % 0x1804)
+        good_server.statuses = []
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '8899AABB',
+                                        ['--addresses', addresses_path])
+        check(status == 1 and good_server.statuses == [404, 404], 'Unexpected responses %s' % good_server.statuses)
+        no_shards_metrics_path = os.path.join(cache_dir, 'no-shards-metrics.jsonl')
+        good_server.statuses = []
+        status, symbols = fetch_symbols([good_server.url], cache_dir, 'test_app', '8899AABB',
+                                        ['--addresses', addresses_path, '--metrics', no_shards_metrics_path])
+        check(status == 1 and good_server.statuses == [], 'Unexpected responses %s' % good_server.statuses)
+        check([event['event'] for event in metrics.read_events(no_shards_metrics_path)] ==
+              ['cache_lookup', 'negative_cache_hit', 'fetch'], 'Missing shards were looked up again')
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/00112233": [%d], "test_app/44556677": [%d]}' % (0x1804, 0x1804))
+
+        # cache hits, misses and skipped requests should be recorded
+        metrics_path = os.path.join(cache_dir, 'metrics.jsonl')
+        fetch_symbols([empty_server.url], cache_dir, 'test_app', '0123456789ABCDEF', ['--metrics', metrics_path])
+        fetch_symbols([empty_server.url], cache_dir, 'test_app', 'FEDCBA9876543210', ['--metrics', metrics_path])
+        # trimmed fetches are recorded as a single 'trim' event rather
+        # than as a cache lookup for the shard index and each shard
+        with open(addresses_path, 'w') as addresses_file:
+            addresses_file.write('{"test_app/00112233": [%d]}' % 0x1004)
+        fetch_symbols([good_server.url], cache_dir, 'test_app', '00112233',
+                      ['--addresses', addresses_path, '--metrics', metrics_path])
+        events = metrics.read_events(metrics_path)
+        summary = metrics.Summary(events)
+        check((summary.cache_hits, summary.cache_misses, summary.negative_cache_hits) == (1, 1, 1),
+              'Unexpected cache metrics')
+        check([event['found'] for event in summary.fetches] == [True, False, True], 'Unexpected fetch metrics')
+        check(len([event for event in events if event['event'] == 'trim']) == 1, 'Trimmed fetch was not recorded')
+
+        test_lookup(slow_server, empty_server, good_server, os.path.join(cache_dir, 'lookup'))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print('Fetch symbols OK')
+
+if __name__ == '__main__':
+    main()
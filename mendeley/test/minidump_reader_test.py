@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Tests that the details read directly from a minidump match those
+# output by minidump_stackwalk.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_reader
+import minidump_stackwalk_processor
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor', 'testdata')
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def record(value):
+    if value is None:
+        return None
+    return tuple(getattr(value, name) for name in value.__slots__)
+
+def main():
+    dump_file = os.path.join(TESTDATA_DIR, 'minidump2.dmp')
+    with open(os.path.join(TESTDATA_DIR, 'minidump2.stackwalk.machine_readable.out')) as expected_file:
+        expected = minidump_stackwalk_processor.Stacktrace.parse(expected_file.read())
+
+    trace = minidump_reader.read_stacktrace(dump_file)
+    check(record(trace.os_version) == record(expected.os_version), 'Unexpected OS %s' % (record(trace.os_version),))
+    check(record(trace.cpu_info) == record(expected.cpu_info), 'Unexpected CPU %s' % (record(trace.cpu_info),))
+    check(record(trace.crash_info) == record(expected.crash_info),
+          'Unexpected crash %s' % (record(trace.crash_info),))
+    check(trace.main_module == expected.main_module, 'Unexpected main module %s' % trace.main_module)
+    check(sorted(trace.modules.keys()) == sorted(expected.modules.keys()), 'Unexpected modules')
+    for name, module in expected.modules.items():
+        check(record(trace.modules[name]) == record(module), 'Unexpected module %s' % (record(trace.modules[name]),))
+
+    with minidump_reader.MinidumpFile(dump_file) as minidump:
+        check(minidump.exception().thread_id == minidump.thread_ids()[0], 'Unexpected crashing thread')
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        truncated_file = os.path.join(temp_dir, 'truncated.dmp')
+        with open(dump_file, 'rb') as dump:
+            data = dump.read(4096)
+        for length in [0, 16, len(data)]:
+            with open(truncated_file, 'wb') as truncated:
+                truncated.write(data[:length])
+            try:
+                minidump_reader.read_stacktrace(truncated_file)
+                check(False, 'Truncated minidump of %d bytes was read' % length)
+            except minidump_reader.MinidumpFormatError:
+                pass
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print('Minidump reader OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Tests that cached stackwalk results are reused and are discarded when
+# newer symbols for one of their modules are added to the symbol cache,
+# but not when symbols are evicted from it.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_stackwalk_processor
+import result_cache
+import symbol_cache
+
+STACKWALK_OUTPUT = """OS|Linux|0.0.0 Linux 4.4
+CPU|amd64|family 6|4
+Crash|SIGSEGV|0x42|0
+Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1
+Module|libc.so.6||libc.so.6|FEDCBA9876543210|0x7f0000000000|0x7f0000100000|0
+
+0|0|test_app|crash()|test.cc|12|0x4
+0|1|libc.so.6||||0x21b45
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        symbols = symbol_cache.SymbolCache(os.path.join(temp_dir, 'symbols'))
+        symbols.update('test_app/0123456789ABCDEF/test_app.sym', 'MODULE Linux x86_64 0123456789ABCDEF test_app\n')
+        results = result_cache.ResultCache(os.path.join(temp_dir, 'results'), symbols)
+
+        dump_file = os.path.join(temp_dir, 'crash.dmp')
+        with open(dump_file, 'wb') as dump:
+            dump.write('MDMP test')
+        key = results.key(dump_file, 'minidump_stackwalk\nfetch-symbols.py -s http://symbols')
+        check(key != results.key(dump_file, 'minidump_stackwalk\nfetch-symbols.py -s http://other'),
+              'Key does not depend on the symbol source')
+        check(results.lookup(key) is None, 'Found a result before one was stored')
+
+        modules = minidump_stackwalk_processor.Stacktrace.parse(STACKWALK_OUTPUT).modules.values()
+        results.store(key, STACKWALK_OUTPUT, modules)
+        check(results.lookup(key) == STACKWALK_OUTPUT, 'Stored result not found')
+
+        # symbols arriving for a module which had none invalidate the result
+        symbols.update('libc.so.6/FEDCBA9876543210/libc.so.6.sym', 'MODULE Linux x86_64 FEDCBA9876543210 libc.so.6\n')
+        check(results.lookup(key) is None, 'Result not invalidated by new symbols')
+
+        results.store(key, STACKWALK_OUTPUT, modules)
+        check(results.lookup(key) == STACKWALK_OUTPUT, 'Stored result not found after invalidation')
+
+        # entries derived from the symbols, such as their serialized form
+        # or shards, do not
+        results.store(key, STACKWALK_OUTPUT, modules)
+        symbols.update('test_app/0123456789ABCDEF/test_app.sym' + symbol_cache.SERIALIZED_SUFFIX, 'serialized')
+        symbols.update('test_app/0123456789ABCDEF/test_app.sym.shards/0.sym',
+                       'MODULE Linux x86_64 0123456789ABCDEF test_app\n')
+        check(results.lookup(key) == STACKWALK_OUTPUT, 'Result invalidated by derived symbol entries')
+
+        # as do replaced symbols
+        symbols.update('test_app/0123456789ABCDEF/test_app.sym', 'MODULE Linux x86_64 0123456789ABCDEF test_app\nFILE 0 test.cc\n')
+        check(results.lookup(key) is None, 'Result not invalidated by replaced symbols')
+
+        # evicting symbols from the symbol cache does not
+        results.store(key, STACKWALK_OUTPUT, modules)
+        symbols.remove('test_app/0123456789ABCDEF/test_app.sym')
+        symbols.remove('libc.so.6/FEDCBA9876543210/libc.so.6.sym')
+        check(results.lookup(key) == STACKWALK_OUTPUT, 'Result invalidated by evicted symbols')
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print('Result cache OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Tests that symbol files are serialized as FastSourceLineResolver
+# expects, and that invalid serialized symbols are detected.
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import serialized_symbols
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor', 'testdata')
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def check_invalid(data, message):
+    try:
+        serialized_symbols.SerializedSymbols(data).validate()
+    except serialized_symbols.SerializedSymbolsError:
+        return
+    check(False, message)
+
+def main():
+    with open(os.path.join(TESTDATA_DIR, 'module1.out'), 'rb') as module_file:
+        data = serialized_symbols.serialize(module_file.read())
+
+    # the empty function is dropped, as by BasicSourceLineResolver
+    symbols = serialized_symbols.SerializedSymbols(data)
+    counts = symbols.validate()
+    check(counts == {'files': 3, 'functions': 5, 'lines': 6, 'public_symbols': 1, 'windows_frame_info': 4,
+                     'cfi_initial_rules': 1, 'cfi_delta_rules': 5}, 'Unexpected counts %s' % counts)
+    check(symbols.files() == {1: 'file1_1.cc', 2: 'file1_2.cc', 3: 'file1_3.cc'}, 'Unexpected files %s' % symbols.files())
+    check(symbols.functions() == [('Function1_1', 0x1000, 0xc), ('Function1_2', 0x1100, 0x8),
+                                  ('Function1_3', 0x1200, 0x100), ('Function1_4', 0x1300, 0x100),
+                                  ('LargeFunction', 0x3000, 0x7000)],
+          'Unexpected functions %s' % symbols.functions())
+    check(symbols.public_symbols() == [('PublicSymbol', 0x2800)], 'Unexpected public symbols')
+    print('Serialize OK')
+
+    # symbol files which BasicSourceLineResolver rejects
+    for name in ['module3_bad.out', 'module4_bad.out']:
+        with open(os.path.join(TESTDATA_DIR, name), 'rb') as module_file:
+            try:
+                serialized_symbols.serialize(module_file.read())
+                check(False, 'Invalid symbol file %s was serialized' % name)
+            except serialized_symbols.SerializedSymbolsError:
+                pass
+    try:
+        serialized_symbols.serialize('MODULE Linux x86 0 app\nPUBLIC 10 0 a\nPUBLIC 10 0 b\n')
+        check(False, 'Duplicate public symbols were serialized')
+    except serialized_symbols.SerializedSymbolsError:
+        pass
+    print('Invalid symbol files OK')
+
+    # corrupt serialized symbols
+    check_invalid(data[:-1], 'Truncated symbols were accepted')
+    check_invalid(data[:-1] + 'x', 'Unterminated symbols were accepted')
+    check_invalid('', 'Empty symbols were accepted')
+    files_offset = symbols.map_offsets[0]
+    check_invalid(data[:files_offset] + '\xff' + data[files_offset + 1:], 'Corrupt map count was accepted')
+    # swap the keys of the first two files
+    keys_offset = files_offset + 4 + 3 * 4
+    keys = data[keys_offset:keys_offset + 8]
+    check_invalid(data[:keys_offset] + keys[4:] + keys[:4] + data[keys_offset + 8:], 'Unsorted keys were accepted')
+    print('Invalid serialized symbols OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Tests that stack traces survive a round trip through the columnar
+# export format.
+
+from __future__ import print_function
+
+import os
+import StringIO
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_stackwalk_processor
+import stacktrace_export
+
+STACKWALK_OUTPUT = """OS|Linux|0.0.0 Linux 4.4
+CPU|amd64|family 6|4
+Crash|SIGSEGV|0xffffffff00000042|1
+Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1
+Module|libc.so.6||libc.so.6|FEDCBA9876543210|0x7f0000000000|0x7f0000100000|0
+
+0|0|libc.so.6|__poll|||0x100
+1|0|test_app|crash()|test.cc|12|0x4
+1|1|test_app|main|test.cc|20|0x5
+1|2|libc.so.6||||0x21b45
+"""
+
+NO_CRASH_OUTPUT = """OS|Linux|0.0.0 Linux 4.4
+CPU|amd64|family 6|4
+Crash|No crash||
+Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1
+
+0|0|test_app|main|test.cc|20|0x5
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def record(value):
+    if value is None:
+        return None
+    return tuple(getattr(value, name) for name in value.__slots__)
+
+def trace_fields(trace):
+    return (trace.main_module,
+            sorted((name, record(module)) for name, module in trace.modules.items()),
+            sorted((thread_id, [record(frame) for frame in frames]) for thread_id, frames in trace.threads.items()),
+            record(trace.crash_info), record(trace.cpu_info), record(trace.os_version))
+
+def main():
+    traces = [minidump_stackwalk_processor.Stacktrace.parse(output)
+              for output in [STACKWALK_OUTPUT, NO_CRASH_OUTPUT, STACKWALK_OUTPUT]]
+
+    export = StringIO.StringIO()
+    writer = stacktrace_export.TraceWriter(export, batch_size=2)
+    for i, trace in enumerate(traces):
+        writer.add(trace, 'crash-%d.dmp' % i)
+    writer.close()
+
+    export.seek(0)
+    batches = stacktrace_export.read_batches(export)
+    check([batch.trace_count for batch in batches] == [2, 1], 'Unexpected batches')
+    check(batches[0].column_strings('trace_crash_type') == ['SIGSEGV', None], 'Unexpected crash type column')
+
+    read_traces = [entry for batch in batches for entry in batch.stacktraces()]
+    check([dump_file for dump_file, trace in read_traces] == ['crash-0.dmp', 'crash-1.dmp', 'crash-2.dmp'],
+          'Unexpected dump files')
+    for trace, (dump_file, read_trace) in zip(traces, read_traces):
+        check(trace_fields(trace) == trace_fields(read_trace), 'Stack trace for %s changed in export' % dump_file)
+
+    try:
+        stacktrace_export.read_batches(StringIO.StringIO(export.getvalue()[:-10]))
+        check(False, 'Truncated export was read')
+    except stacktrace_export.ExportFormatError:
+        pass
+
+    print('Stacktrace export OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Tests that stack traces survive a round trip through a stream of
+# ProcessStateProto messages.
+
+from __future__ import print_function
+
+import os
+import re
+import StringIO
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_stackwalk_processor
+import process_state_proto
+import stacktrace_proto
+
+PROCESS_STATE_PROTO_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor',
+                                        'proto', 'process_state.proto')
+
+# A ProcessStateProto with negative integers, a nested message and a
+# non-ASCII string, as encoded by 'protoc --encode'
+ENCODED_MESSAGE = ('\x08\x07\x12\x0e\n\x01X\x10\xfb\xff\xff\xff\xff\xff\xff\xff\xff\x01'
+                   ' \xfe\xff\xff\xff\xff\xff\xff\xff\xff\x01*\x0b\n\t\x08\x04\x12\x05\x1a\x03m\xc3\xa9')
+
+STACKWALK_OUTPUT = """OS|Linux|0.0.0 Linux 4.4
+CPU|amd64|family 6|4
+Crash|SIGSEGV|0xffffffff00000042|2
+Module|libc.so.6||libc.so.6|FEDCBA9876543210|0x7f0000000000|0x7f0000100000|0
+Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1
+
+2|0|test_app|crash()|test.cc|12|0x4
+2|1|test_app|run()|||0x10
+2|2|test_app|main|test.cc|20|0x5
+2|3|libc.so.6||||0x21b45
+2|4|||||0x7fff0010
+0|0|libc.so.6|__poll|||0x100
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def record(value):
+    if value is None:
+        return None
+    return tuple(getattr(value, name) for name in value.__slots__)
+
+def trace_fields(trace):
+    return (trace.main_module,
+            sorted((name, record(module)) for name, module in trace.modules.items()),
+            sorted((thread_id, [record(frame) for frame in frames]) for thread_id, frames in trace.threads.items()),
+            record(trace.crash_info), record(trace.cpu_info), record(trace.os_version))
+
+def proto_fields():
+    """ Returns the (label, name, number) of each field declared in
+    process_state.proto, ignoring the message it belongs to
+    """
+    with open(PROCESS_STATE_PROTO_PATH) as proto_file:
+        source = re.sub(r'//.*', '', proto_file.read())
+    return sorted((label, name, int(number)) for label, name, number in
+                  re.findall(r'\b(optional|required|repeated)\s+[\w.]+\s+(\w+)\s*=\s*(\d+)\s*;', source))
+
+def message_fields():
+    return sorted((label, name, number) for message in process_state_proto.MESSAGES
+                  for number, name, label, field_type in message.FIELDS)
+
+def main():
+    # the messages of process_state_proto are written by hand, so check
+    # that they have not fallen behind process_state.proto
+    check(message_fields() == proto_fields(),
+          'process_state_proto does not match process_state.proto: %s' %
+          sorted(set(message_fields()) ^ set(proto_fields())))
+
+    # and that they are encoded as protoc encodes them
+    message = process_state_proto.ProcessStateProto.parse(ENCODED_MESSAGE)
+    frame = message.threads[0].frames[0]
+    check((message.time_date_stamp, message.crash.reason, message.crash.address, message.requesting_thread,
+           frame.instruction, frame.module.code_file, frame.function_name) == (7, 'X', -5, -2, 4, u'm\xe9', None),
+          'Unexpected decoded message')
+    check(message.serialize() == ENCODED_MESSAGE, 'Message was not encoded as protoc encodes it')
+    try:
+        process_state_proto.ProcessStateProto.parse(ENCODED_MESSAGE[:-1])
+        check(False, 'Truncated message was decoded')
+    except process_state_proto.DecodeError:
+        pass
+    try:
+        process_state_proto.StackFrame().serialize()
+        check(False, 'Message without a required field was encoded')
+    except process_state_proto.EncodeError:
+        pass
+    print('Wire format OK')
+
+    trace = minidump_stackwalk_processor.Stacktrace.parse(STACKWALK_OUTPUT)
+
+    proto = stacktrace_proto.to_proto(trace)
+    check(proto.modules[0].code_file == 'test_app', 'Main module is not first')
+    check(len(proto.threads) == 3 and not proto.threads[1].frames, 'Unexpected threads')
+    check(proto.threads[2].frames[3].instruction == 0x7f0000000000 + 0x21b45, 'Unexpected frame address')
+
+    stream = StringIO.StringIO()
+    stacktrace_proto.write_stacktrace(stream, trace)
+    stacktrace_proto.write_stacktrace(stream, trace)
+    stream.seek(0)
+    read_traces = list(stacktrace_proto.read_stacktraces(stream))
+    check(len(read_traces) == 2, 'Unexpected number of messages')
+    for read_trace in read_traces:
+        check(trace_fields(read_trace) == trace_fields(trace), 'Stack trace changed in round trip')
+
+    try:
+        list(stacktrace_proto.read_stacktraces(StringIO.StringIO(stream.getvalue()[:-1])))
+        check(False, 'Truncated stream was read')
+    except EOFError:
+        pass
+
+    print('Stacktrace proto OK')
+
+if __name__ == '__main__':
+    main()
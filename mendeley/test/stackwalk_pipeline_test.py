@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# Tests that the stackwalk pipeline runs stackwalks and symbol fetches
+# concurrently, fetching the symbols for each module once per batch.
+
+from __future__ import print_function
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import result_cache
+import stackwalk_pipeline
+import symbol_cache
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor', 'testdata')
+
+# Length of time each stand-in stackwalk and symbol fetch takes
+STACKWALK_DELAY = 0.5
+FETCH_DELAY = 0.5
+
+# Stand-in for minidump_stackwalk, which outputs a stack trace in
+# several writes and fails for minidumps named 'bad*.dmp'. For minidumps
+# named 'truncated*.dmp' it outputs a truncated frame line, and for
+# those named 'killed*.dmp' it is killed partway through a frame line.
+FAKE_STACKWALK = """#!%(python)s
+import os, signal, sys, time
+dump_file = sys.argv[2]
+if os.path.basename(dump_file).startswith('bad'):
+    sys.exit(1)
+sys.stdout.write('OS|Linux|0.0.0 Linux 4.4\\nCPU|amd64|family 6|4\\nCrash|SIGSEGV|0x42|1\\n')
+sys.stdout.write('Module|test_app|1.0|test_app|0123456789ABCDEF|0x00400000|0x00420000|1\\n\\n')
+sys.stdout.flush()
+if os.path.basename(dump_file).startswith('truncated'):
+    sys.stdout.write('1|0|test_app|cra\\n1|1|test_app|main()|test.cc|20|0x8\\n')
+    sys.exit(0)
+if os.path.basename(dump_file).startswith('killed'):
+    sys.stdout.write('1|0|test_app|cra')
+    sys.stdout.flush()
+    os.kill(os.getpid(), signal.SIGKILL)
+time.sleep(%(delay)f)
+sys.stdout.write('0|0|test_app|idle()|test.cc|5|0x4\\n')
+sys.stdout.write('1|0|test_app|crash()|test.cc|12|0x4\\n1|1|test_app|main()|test.cc|20|0x8')
+"""
+
+# Stand-in for fetch-symbols.py, which logs each fetch
+FAKE_FETCH = """#!/bin/sh
+sleep %(delay)f
+echo "$1 $2" >> %(log)s
+"""
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def write_script(path, content):
+    with open(path, 'w') as script:
+        script.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        stackwalk_path = os.path.join(temp_dir, 'minidump_stackwalk')
+        fetch_path = os.path.join(temp_dir, 'fetch-symbols')
+        fetch_log = os.path.join(temp_dir, 'fetches.log')
+        write_script(stackwalk_path, FAKE_STACKWALK % {'python': sys.executable, 'delay': STACKWALK_DELAY})
+        write_script(fetch_path, FAKE_FETCH % {'delay': FETCH_DELAY, 'log': fetch_log})
+
+        dump_files = []
+        for index in range(6):
+            dump_files += [os.path.join(temp_dir, 'crash%d.dmp' % index)]
+            shutil.copy(os.path.join(TESTDATA_DIR, 'minidump2.dmp'), dump_files[-1])
+        dump_files += [os.path.join(temp_dir, 'bad.dmp')]
+        with open(dump_files[-1], 'wb') as dump:
+            dump.write('MDMP')
+
+        # the stackwalks run at once, after the symbols for the modules
+        # shared by the minidumps have been fetched once each
+        pipeline = stackwalk_pipeline.StackwalkPipeline(stackwalk_path, fetch_path, stackwalk_jobs=len(dump_files),
+                                                        fetch_jobs=8, keep_output=True)
+        start_time = time.time()
+        results = list(pipeline.run(dump_files))
+        elapsed = time.time() - start_time
+        check(elapsed < (STACKWALK_DELAY + FETCH_DELAY) * 2, 'Stackwalks did not run concurrently (%.2fs)' % elapsed)
+        check(sorted(result.dump_file for result in results) == sorted(dump_files), 'Missing results')
+        with open(fetch_log) as log:
+            fetches = log.read().splitlines()
+        check(len(fetches) == len(set(fetches)) == 13, 'Unexpected symbol fetches %s' % fetches)
+        check('test_app.pdb 5A9832E5287241C1838ED98914E9B7FF1' in fetches, 'Symbols for test_app were not fetched')
+
+        for result in results:
+            if result.dump_file.endswith('bad.dmp'):
+                check(result.error and 'exited with status 1' in result.error and not result.stacktrace,
+                      'Failed stackwalk was not reported')
+                continue
+            trace = result.stacktrace
+            check(not result.error and trace.crash_info.thread_id == 1 and
+                  [frame.function for frame in trace.threads[1]] == ['crash()', 'main()'],
+                  'Unexpected stack trace for %s' % result.dump_file)
+            check(0 not in trace.threads, 'Frames of threads other than the crashing thread were kept')
+            check(result.output.endswith('1|1|test_app|main()|test.cc|20|0x8'), 'Output was not kept')
+        print('Concurrent stackwalks OK')
+
+        # output which cannot be parsed fails only its own minidump, and
+        # a stackwalk killed partway through a line is reported as failed
+        broken_files = [os.path.join(temp_dir, name) for name in ('truncated.dmp', 'killed.dmp')]
+        for dump_file in broken_files:
+            shutil.copy(dump_files[0], dump_file)
+        pipeline = stackwalk_pipeline.StackwalkPipeline(stackwalk_path, fetch_path, stackwalk_jobs=4, fetch_jobs=0)
+        results = dict((result.dump_file, result) for result in pipeline.run(broken_files + dump_files[:2]))
+        check(sorted(results) == sorted(broken_files + dump_files[:2]), 'Missing results after a parse error')
+        check(results[broken_files[0]].error and results[broken_files[0]].error.startswith('ValueError: ') and
+              not results[broken_files[0]].stacktrace, 'Truncated output was not reported')
+        check(results[broken_files[1]].error == 'StackwalkError: minidump_stackwalk exited with status -9',
+              'Killed stackwalk was not reported %s' % results[broken_files[1]].error)
+        check(all(not results[dump_file].error for dump_file in dump_files[:2]),
+              'Other minidumps failed after a parse error')
+        print('Truncated output OK')
+
+        # the number of stackwalks at once is bounded
+        pipeline = stackwalk_pipeline.StackwalkPipeline(stackwalk_path, fetch_path, stackwalk_jobs=2, fetch_jobs=0,
+                                                        all_threads=True)
+        start_time = time.time()
+        results = list(pipeline.run(dump_files[:4]))
+        elapsed = time.time() - start_time
+        check(elapsed >= STACKWALK_DELAY * 2, 'More stackwalks ran at once than allowed (%.2fs)' % elapsed)
+        check(all(sorted(result.stacktrace.threads) == [0, 1] for result in results), 'Threads were not kept')
+        check(all(result.output is None for result in results), 'Output was kept without being needed')
+        print('Bounded stackwalks OK')
+
+        # results are served from the result cache
+        symbols = symbol_cache.SymbolCache(os.path.join(temp_dir, 'symbols'))
+        results_cache = result_cache.ResultCache(os.path.join(temp_dir, 'results'), symbols)
+        pipeline = stackwalk_pipeline.StackwalkPipeline(stackwalk_path, fetch_path, stackwalk_jobs=4, fetch_jobs=0,
+                                                        result_cache=results_cache)
+        first = list(pipeline.run(dump_files[:1]))
+        second = list(pipeline.run(dump_files[:1]))
+        check(not first[0].cached and second[0].cached and second[0].output == first[0].output and
+              [frame.function for frame in second[0].stacktrace.threads[1]] == ['crash()', 'main()'],
+              'Result cache was not used')
+        print('Cached results OK')
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
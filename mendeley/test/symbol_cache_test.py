@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# Tests the index of the symbol cache and index-symbol-cache.py.
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import serialized_symbols
+import symbol_cache
+
+INDEX_SYMBOL_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'index-symbol-cache.py')
+
+LINUX_SYMBOLS = 'MODULE Linux x86_64 0123456789ABCDEF0 test_app\nFUNC 1000 10 0 main\n'
+WINDOWS_SYMBOLS = 'MODULE windows x86 FEDCBA98765432101 test_app.pdb\nFUNC 1000 10 0 main\n'
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def write_file(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def describe(cache):
+    return [(entry.path, entry.module, entry.debug_id, entry.os, entry.arch, entry.valid) for entry in cache.entries()]
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(temp_dir, 'cache')
+        cache = symbol_cache.SymbolCache(cache_dir, compression=symbol_cache.FORMAT_GZIP)
+        linux_path = 'test_app/0123456789ABCDEF0/test_app.sym'
+        windows_path = 'test_app.pdb/FEDCBA98765432101/test_app.sym'
+        serialized_path = linux_path + symbol_cache.SERIALIZED_SUFFIX
+        cache.update(linux_path, LINUX_SYMBOLS)
+        cache.update(serialized_path, serialized_symbols.serialize(LINUX_SYMBOLS))
+
+        # entries are described in the index when they are added
+        check(describe(cache) == [(linux_path, 'test_app', '0123456789ABCDEF0', 'Linux', 'x86_64', True),
+                                  (serialized_path, 'test_app', '0123456789ABCDEF0', None, None, True)],
+              'Unexpected entries %s' % describe(cache))
+        check(cache.contains(linux_path) and not cache.contains(windows_path), 'Unexpected cache contents')
+
+        # entries copied into the cache directory, and entries which
+        # were deleted from it, are found by reindexing
+        write_file(cache.entry_path(windows_path), WINDOWS_SYMBOLS)
+        write_file(cache.entry_path('broken/0/broken.sym'), '<html>Not Found</html>')
+        write_file(cache.entry_path(windows_path + symbol_cache.LOCK_SUFFIX), '')
+        os.remove(cache.entry_path(serialized_path))
+        check(cache.reindex() == (2, 1, 1), 'Unexpected reindex counts')
+        check(describe(cache) == [('broken/0/broken.sym', None, None, None, None, False),
+                                  (windows_path, 'test_app.pdb', 'FEDCBA98765432101', 'windows', 'x86', True),
+                                  (linux_path, 'test_app', '0123456789ABCDEF0', 'Linux', 'x86_64', True)],
+              'Unexpected entries after reindexing %s' % describe(cache))
+        check(cache.reindex() == (0, 3, 0), 'Unexpected counts reindexing again')
+        print('Reindex cache OK')
+
+        # invalid entries are removed when looked up
+        check(not cache.contains('broken/0/broken.sym'), 'Invalid entry is contained')
+        check(cache.lookup('broken/0/broken.sym') is None, 'Invalid entry was returned')
+        check(not os.path.exists(cache.entry_path('broken/0/broken.sym')), 'Invalid entry was not removed')
+        cache.mark_invalid(windows_path)
+        check(cache.lookup(windows_path) is None and not os.path.exists(cache.entry_path(windows_path)),
+              'Entry marked invalid was not removed')
+        reader = cache.lookup(linux_path)
+        check(reader and reader.read() == LINUX_SYMBOLS, 'Valid entry was not returned')
+        reader.close()
+        print('Invalid entries OK')
+
+        # invalid entries are evicted before least recently used ones
+        small_cache = symbol_cache.SymbolCache(os.path.join(temp_dir, 'small'),
+                                               max_size=len(LINUX_SYMBOLS) + len(WINDOWS_SYMBOLS))
+        small_cache.update(linux_path, LINUX_SYMBOLS)
+        small_cache.update(windows_path, WINDOWS_SYMBOLS)
+        small_cache.mark_invalid(windows_path)
+        small_cache.update('other/0123456789ABCDEF0/other.sym', LINUX_SYMBOLS)
+        check([entry.path for entry in small_cache.entries()] == ['other/0123456789ABCDEF0/other.sym', linux_path],
+              'Invalid entry was not evicted first')
+        print('Evict invalid entries OK')
+
+        # lock files are removed when released, along with the directories
+        # of modules which were not found, or left behind by killed
+        # fetchers, in which case they are removed by reindexing
+        lock_cache = symbol_cache.SymbolCache(os.path.join(temp_dir, 'locks'), max_size=2 * len(LINUX_SYMBOLS) + 10)
+        with lock_cache.lock_entry('missing/0/missing.sym'):
+            check(os.path.exists(lock_cache.entry_path('missing/0/missing.sym' + symbol_cache.LOCK_SUFFIX)),
+                  'Lock file was not created')
+        check(os.listdir(lock_cache.root) == [symbol_cache.INDEX_FILE_NAME], 'Lock file was not removed')
+        write_file(lock_cache.entry_path('killed/0/killed.sym' + symbol_cache.LOCK_SUFFIX), '')
+        with lock_cache.lock_entry(linux_path):
+            lock_cache.update(linux_path, LINUX_SYMBOLS)
+            # a lock which is held is not removed
+            lock_cache.reindex()
+            check(os.path.exists(lock_cache.entry_path(linux_path + symbol_cache.LOCK_SUFFIX)),
+                  'Held lock file was removed')
+        check(sorted(os.listdir(lock_cache.root)) == [symbol_cache.INDEX_FILE_NAME, 'test_app'],
+              'Stale lock file was not removed')
+
+        # address indexes count towards the size limit
+        write_file(lock_cache.entry_path(linux_path + symbol_cache.INDEX_SUFFIX), 'x' * 10)
+        write_file(lock_cache.entry_path('orphan/0/orphan.sym' + symbol_cache.INDEX_SUFFIX), 'x' * 10)
+        lock_cache.reindex()
+        check(lock_cache.total_size() == len(LINUX_SYMBOLS) + 10, 'Address index size was not recorded')
+        check(not os.path.exists(lock_cache.entry_path('orphan')), 'Address index without an entry was not removed')
+        lock_cache.update('other/0123456789ABCDEF0/other.sym', LINUX_SYMBOLS)
+        lock_cache.record_index_size('other/0123456789ABCDEF0/other.sym', 1)
+        check([entry.path for entry in lock_cache.entries()] == ['other/0123456789ABCDEF0/other.sym'],
+              'Entry was not evicted to make room for an address index')
+        check(sorted(os.listdir(lock_cache.root)) == [symbol_cache.INDEX_FILE_NAME, 'other'],
+              'Directories of evicted entry were not removed')
+        print('Lock files and address indexes OK')
+
+        # index-symbol-cache.py --verify finds corrupt entries
+        cache.update(serialized_path, serialized_symbols.serialize(LINUX_SYMBOLS))
+        write_file(cache.entry_path(windows_path), WINDOWS_SYMBOLS)
+        write_file(cache.entry_path('corrupt/0/corrupt.sym'), '\x1f\x8b' + 'x' * 100)
+        write_file(cache.entry_path('truncated/0/truncated.sym' + symbol_cache.SERIALIZED_SUFFIX),
+                   serialized_symbols.serialize(LINUX_SYMBOLS)[:-1] + '\1')
+        command = [sys.executable, INDEX_SYMBOL_CACHE_PATH, '--cache-dir', cache_dir, '--verify']
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = process.communicate()[0]
+        check(process.returncode == 1, 'Corrupt entries were not reported')
+        check('Invalid corrupt/0/corrupt.sym' in output and 'Invalid truncated/0/truncated.sym.serialized' in output,
+              'Unexpected output %s' % output)
+        check('Linux        x86_64            1' in output and 'windows      x86               1' in output,
+              'Unexpected summary %s' % output)
+        check(not cache.contains('corrupt/0/corrupt.sym') and cache.contains(windows_path),
+              'Corrupt entries were not marked invalid')
+
+        subprocess.check_output(command + ['--remove-invalid'], stderr=subprocess.STDOUT)
+        check([entry.path for entry in cache.entries()] == [windows_path, linux_path, serialized_path],
+              'Invalid entries were not removed %s' % describe(cache))
+        print('Verify cache OK')
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
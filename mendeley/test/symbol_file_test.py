@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Tests that addresses are resolved from symbol files as they are by
+# BasicSourceLineResolver, with and without a saved index, and that
+# frames without functions are re-symbolized.
+
+from __future__ import print_function
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_stackwalk_processor
+import symbol_cache
+import symbol_file
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor', 'testdata')
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def resolve(symbols, address):
+    info = symbols.lookup(address)
+    if info is None:
+        return None
+    return tuple(getattr(info, name) for name in info.__slots__)
+
+# expected results from basic_source_line_resolver_unittest.cc
+MODULE1_LOOKUPS = [
+    (0x0, None),
+    (0x1000, ('Function1_1', 0x1000, 'file1_1.cc', 44, 0x1000)),
+    (0x1006, ('Function1_1', 0x1000, 'file1_1.cc', 45, 0x1004)),
+    (0x1102, ('Function1_2', 0x1100, 'file1_2.cc', 65, 0x1100)),
+    (0x1280, ('Function1_3', 0x1200, None, None, None)),
+    (0x1380, ('Function1_4', 0x1300, None, None, None)),
+    (0x2000, None),
+    (0x2900, ('PublicSymbol', 0x2800, None, None, None)),
+    (0x4000, ('LargeFunction', 0x3000, 'file1_3.cc', 4098359, 0x3000)),
+]
+
+MODULE2_LOOKUPS = [
+    (0x2181, ('Function2_2', 0x2170, 'file2_2.cc', 21, 0x2180)),
+    (0x216f, ('Public2_1', 0x2160, None, None, None)),
+    (0x219f, None),
+    (0x21a0, ('Public2_2', 0x21a0, None, None, None)),
+]
+
+def check_lookups(symbols, lookups, description):
+    for address, expected in lookups:
+        result = resolve(symbols, address)
+        check(result == expected, 'Unexpected lookup of 0x%x in %s: %s' % (address, description, result))
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        module1 = os.path.join(TESTDATA_DIR, 'module1.out')
+        with symbol_file.SymbolFile(module1) as symbols:
+            check((symbols.os, symbols.arch, symbols.debug_id, symbols.debug_file) ==
+                  ('windows', 'x86', '111111111111111111111111111111111', 'module1.pdb'),
+                  'Unexpected MODULE line %s' % ((symbols.os, symbols.arch, symbols.debug_id, symbols.debug_file),))
+            check_lookups(symbols, MODULE1_LOOKUPS, 'module1')
+        with symbol_file.SymbolFile(os.path.join(TESTDATA_DIR, 'module2.out')) as symbols:
+            check_lookups(symbols, MODULE2_LOOKUPS, 'module2')
+
+        # FILE records need not be in order of ID, and the first of any
+        # duplicate IDs is used
+        unordered_path = os.path.join(temp_dir, 'unordered.sym')
+        with open(unordered_path, 'w') as sym_file:
+            sym_file.write('MODULE Linux x86_64 0123456789ABCDEF0 unordered\n'
+                           'FILE 7 seven.cc\nFILE 2 two.cc\nFILE 7 other.cc\n'
+                           'FUNC 1000 20 0 main\n1000 10 3 7\n1010 10 4 2\n')
+        with symbol_file.SymbolFile(unordered_path) as symbols:
+            check([resolve(symbols, address)[2] for address in (0x1000, 0x1010)] == ['seven.cc', 'two.cc'] and
+                  symbols.source_file(3) is None and symbols.source_file(8) is None,
+                  'Unexpected source files of unordered FILE records')
+
+        # as in BasicSourceLineResolver, functions overlapping an earlier
+        # one in the file are dropped along with their lines, as are lines
+        # overlapping an earlier one of the same function
+        overlapping_path = os.path.join(temp_dir, 'overlapping.sym')
+        with open(overlapping_path, 'w') as sym_file:
+            sym_file.write('MODULE Linux x86_64 0123456789ABCDEF0 overlapping\nFILE 1 a.cc\n'
+                           'FUNC 1000 20 0 first\n1000 20 3 1\n'
+                           'FUNC 1010 20 0 overlapping\n1010 20 7 1\n'
+                           'FUNC 1020 10 0 second\n1020 10 9 1\n'
+                           'FUNC 2000 200 0 third\n2010 100 11 1\n2020 4 12 1\n')
+        with symbol_file.SymbolFile(overlapping_path) as symbols:
+            check([resolve(symbols, address) for address in (0x1018, 0x1028)] ==
+                  [('first', 0x1000, 'a.cc', 3, 0x1000), ('second', 0x1020, 'a.cc', 9, 0x1020)],
+                  'Overlapping function was not dropped')
+            check(resolve(symbols, 0x2030) == ('third', 0x2000, 'a.cc', 11, 0x2010),
+                  'Overlapping line was not dropped')
+
+        # as in BasicSourceLineResolver, public symbols at address 0 are
+        # ignored, and of two at the same address the first is used
+        publics_path = os.path.join(temp_dir, 'publics.sym')
+        with open(publics_path, 'w') as sym_file:
+            sym_file.write('MODULE Linux x86_64 0123456789ABCDEF0 publics\n'
+                           'PUBLIC 0 0 zero\nPUBLIC 1000 0 first\nPUBLIC 1000 0 duplicate\n')
+        with symbol_file.SymbolFile(publics_path) as symbols:
+            check(symbols.lookup(0x10) is None, 'Public symbol at address 0 was used')
+            check(resolve(symbols, 0x1010) == ('first', 0x1000, None, None, None),
+                  'Duplicate public symbol was used')
+        print('Lookup OK')
+
+        # an index saved next to the symbol file is used by later loads
+        sym_path = os.path.join(temp_dir, 'module1.sym')
+        index_path = sym_path + symbol_cache.INDEX_SUFFIX
+        shutil.copy(module1, sym_path)
+        with symbol_file.SymbolFile(sym_path, index_path) as symbols:
+            check_lookups(symbols, MODULE1_LOOKUPS, 'module1 when saving the index')
+        check(os.path.exists(index_path), 'Index was not saved')
+        with symbol_file.SymbolFile(sym_path, index_path) as symbols:
+            symbols._build_index = None
+            check_lookups(symbols, MODULE1_LOOKUPS, 'module1 with a saved index')
+
+        # a stale index is rebuilt
+        with open(sym_path, 'a') as sym_file:
+            sym_file.write('PUBLIC 20000 0 AppendedSymbol\n')
+        with symbol_file.SymbolFile(sym_path, index_path) as symbols:
+            check(resolve(symbols, 0x20010) == ('AppendedSymbol', 0x20000, None, None, None),
+                  'Stale index was used')
+
+        # a truncated index is ignored
+        with open(index_path, 'r+b') as index_file:
+            index_file.truncate(os.path.getsize(index_path) - 4)
+        with symbol_file.SymbolFile(sym_path, index_path) as symbols:
+            check(resolve(symbols, 0x20010) == ('AppendedSymbol', 0x20000, None, None, None),
+                  'Truncated index was used')
+        print('Index OK')
+
+        # compressed cache entries, whose index is removed with the entry
+        cache = symbol_cache.SymbolCache(os.path.join(temp_dir, 'cache'), max_size=0)
+        entry = 'module1.pdb/111111111111111111111111111111111/module1.sym'
+        writer = cache.open_writer(entry)
+        with open(module1, 'rb') as module_file:
+            writer.write(module_file.read())
+        writer.commit()
+        entry_path = cache.entry_path(entry)
+        gzipped = gzip.open(entry_path + '.gz', 'wb')
+        with open(module1, 'rb') as module_file:
+            gzipped.write(module_file.read())
+        gzipped.close()
+        os.rename(entry_path + '.gz', entry_path)
+        symbols = symbol_file.open_cached(cache, entry)
+        try:
+            check_lookups(symbols, MODULE1_LOOKUPS, 'compressed cache entry')
+        finally:
+            symbols.close()
+        check(os.path.exists(cache.entry_path(entry) + symbol_cache.INDEX_SUFFIX), 'Cache entry index was not saved')
+        check(cache.total_size() == os.path.getsize(module1) + os.path.getsize(entry_path + symbol_cache.INDEX_SUFFIX),
+              'Cache entry index size was not recorded')
+        check(symbol_file.open_cached(cache, 'missing.pdb/0/missing.sym') is None, 'Missing cache entry was opened')
+        connection = cache._connect()
+        cache._remove_entry(connection, entry)
+        connection.close()
+        check(not os.path.exists(cache.entry_path(entry) + symbol_cache.INDEX_SUFFIX),
+              'Cache entry index was not removed')
+        check(os.listdir(cache.root) == [symbol_cache.INDEX_FILE_NAME], 'Cache entry directories were not removed')
+        print('Cache OK')
+
+        # files which are not symbol files
+        not_symbols = os.path.join(temp_dir, 'not_symbols.sym')
+        with open(not_symbols, 'w') as not_symbols_file:
+            not_symbols_file.write('<html>Not found</html>\n')
+        try:
+            symbol_file.SymbolFile(not_symbols)
+            check(False, 'Invalid symbol file was opened')
+        except symbol_file.SymbolFileError:
+            pass
+        with symbol_file.SymbolFile(os.path.join(TESTDATA_DIR, 'module4_bad.out')) as symbols:
+            try:
+                symbols.lookup(0x1000)
+                check(False, 'Line records outside a function were accepted')
+            except symbol_file.SymbolFileError:
+                pass
+        print('Invalid files OK')
+
+        # frames without functions are symbolized from module offsets
+        with symbol_file.SymbolFile(module1) as symbols:
+            unsymbolized = minidump_stackwalk_processor.Frame('module1.pdb', '', '', '', '0x1006')
+            frame = symbol_file.symbolize_frame(unsymbolized, symbols)
+            check((frame.module, frame.function, frame.line, frame.column, frame.addr) ==
+                  ('module1.pdb', 'Function1_1', 'file1_1.cc', '45', '0x2'), 'Unexpected frame %s' % frame)
+            unsymbolized = minidump_stackwalk_processor.Frame('module1.pdb', '', '', '', '0x2900')
+            frame = symbol_file.symbolize_frame(unsymbolized, symbols)
+            check((frame.function, frame.line, frame.column, frame.addr) == ('PublicSymbol', '', '', '0x100'),
+                  'Unexpected frame %s' % frame)
+            unsymbolized = minidump_stackwalk_processor.Frame('module1.pdb', '', '', '', '0x10')
+            check(symbol_file.symbolize_frame(unsymbolized, symbols) is unsymbolized, 'Unknown address was symbolized')
+        print('Symbolize OK')
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# Tests the HTTP symbol server with upload-symbols.py and fetch-symbols.py.
+
+from __future__ import print_function
+
+import gzip
+import httplib
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import symbol_server
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+UPLOAD_SYMBOLS_PATH = os.path.join(SCRIPT_DIR, 'upload-symbols.py')
+FETCH_SYMBOLS_PATH = os.path.join(SCRIPT_DIR, 'fetch-symbols.py')
+
+LINUX_SYMBOLS = 'MODULE Linux x86_64 0123456789ABCDEF0 test_app\n' + ''.join(
+    'FUNC %x 10 0 function_%d\n' % (address, address) for address in range(0x1000, 0x3000, 0x10))
+WINDOWS_SYMBOLS = 'MODULE windows x86 FEDCBA98765432101 test_app.pdb\nFUNC 1000 10 0 main\n'
+
+LINUX_PATH = '/test_app/0123456789ABCDEF0/test_app.sym'
+WINDOWS_PATH = '/test_app.pdb/FEDCBA98765432101/test_app.sym'
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def write_file(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def request(server, method, path, headers={}, body=None):
+    connection = httplib.HTTPConnection(server.server_address[0], server.server_address[1], timeout=10)
+    try:
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+def run(command):
+    proc = subprocess.Popen([sys.executable] + command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout, stderr
+
+def gzip_data(data):
+    compressed = StringIO.StringIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+    gzip_file.write(data)
+    gzip_file.close()
+    return compressed.getvalue()
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        root = os.path.join(temp_dir, 'server')
+        dump_dir = os.path.join(temp_dir, 'dump_syms')
+        os.makedirs(root)
+        server = symbol_server.start_server(root, allow_upload=True)
+
+        # dump_syms output is uploaded to the paths fetch-symbols.py requests
+        write_file(os.path.join(dump_dir, 'test_app.sym'), LINUX_SYMBOLS)
+        write_file(os.path.join(dump_dir, 'win', 'test_app.sym'), WINDOWS_SYMBOLS)
+        write_file(os.path.join(dump_dir, 'win', 'broken.sym'), '<html>Not a symbol file</html>')
+        status, stdout, stderr = run([UPLOAD_SYMBOLS_PATH, '-j', '4', server.url, dump_dir])
+        check(status == 1 and 'Unable to upload' in stderr and '2 uploaded' in stderr,
+              'Unexpected upload result %d: %s' % (status, stderr))
+        for path, data in [(LINUX_PATH, LINUX_SYMBOLS), (WINDOWS_PATH, WINDOWS_SYMBOLS)]:
+            with open(root + path, 'rb') as symbol_file:
+                check(symbol_file.read() == data, 'Symbol file %s was not uploaded' % path)
+        check(not [name for _, _, names in os.walk(root) for name in names if name.startswith('.tmp-')],
+              'Temporary files were left behind')
+
+        # files already on the server are skipped unless forced
+        os.remove(os.path.join(dump_dir, 'win', 'broken.sym'))
+        status, stdout, stderr = run([UPLOAD_SYMBOLS_PATH, server.url, dump_dir])
+        check(status == 0 and '0 uploaded' in stderr and '2 already present' in stderr,
+              'Existing symbol files were uploaded: %s' % stderr)
+        status, stdout, stderr = run([UPLOAD_SYMBOLS_PATH, '--force', '--no-gzip', server.url, dump_dir])
+        check(status == 0 and '2 uploaded' in stderr, 'Forced upload failed: %s' % stderr)
+        print('Upload symbols OK')
+
+        # uploads must match their path and be complete
+        for path, headers, body, expected_status in [
+                (LINUX_PATH, {'If-None-Match': '*'}, LINUX_SYMBOLS, 412),
+                (WINDOWS_PATH, {}, LINUX_SYMBOLS, 422),
+                ('/test_app/0123456789ABCDEF0/test_app.txt', {}, LINUX_SYMBOLS, 422),
+                ('/../test_app.sym', {}, LINUX_SYMBOLS, 404),
+                (LINUX_PATH, {'Content-Encoding': 'gzip'}, gzip_data(LINUX_SYMBOLS)[:-8], 400),
+                (LINUX_PATH, {'Content-Encoding': 'br'}, LINUX_SYMBOLS, 415)]:
+            status = request(server, 'PUT', path, headers, body)[0]
+            check(status == expected_status, 'Upload to %s returned %d' % (path, status))
+        with open(root + LINUX_PATH, 'rb') as symbol_file:
+            check(symbol_file.read() == LINUX_SYMBOLS, 'Refused upload replaced a symbol file')
+        print('Refuse uploads OK')
+
+        # responses are compressed for clients which accept gzip, and
+        # revalidated with conditional requests
+        status, headers, body = request(server, 'GET', LINUX_PATH, {'Accept-Encoding': 'gzip'})
+        check(status == 200 and headers.get('content-encoding') == 'gzip' and len(body) < len(LINUX_SYMBOLS) / 2,
+              'Response was not compressed')
+        check(gzip.GzipFile(fileobj=StringIO.StringIO(body)).read() == LINUX_SYMBOLS, 'Unexpected compressed response')
+        check(request(server, 'GET', LINUX_PATH, {'Accept-Encoding': 'gzip;q=0'})[2] == LINUX_SYMBOLS,
+              'Response was compressed for a client which refused gzip')
+        check(request(server, 'GET', LINUX_PATH, {'If-None-Match': headers['etag']})[0] == 304,
+              'Unchanged symbol file was sent again')
+        check(request(server, 'GET', LINUX_PATH, {'If-Modified-Since': headers['last-modified']})[0] == 304,
+              'Unmodified symbol file was sent again')
+        check(request(server, 'GET', '/test_app/0123456789ABCDEF0/missing.sym')[0] == 404, 'Missing file was found')
+        check(request(server, 'GET', '/test_app/0123456789ABCDEF0')[0] == 404, 'Directory was served')
+        print('Compressed and conditional requests OK')
+
+        # byte ranges are served uncompressed
+        size = len(LINUX_SYMBOLS)
+        for range_header, expected in [('bytes=0-5', LINUX_SYMBOLS[:6]), ('bytes=10-', LINUX_SYMBOLS[10:]),
+                                       ('bytes=-8', LINUX_SYMBOLS[-8:]), ('bytes=5-%d' % (size * 2), LINUX_SYMBOLS[5:])]:
+            status, headers, body = request(server, 'GET', LINUX_PATH,
+                                            {'Range': range_header, 'Accept-Encoding': 'gzip'})
+            check(status == 206 and body == expected and 'content-encoding' not in headers,
+                  'Unexpected response %d to range %s' % (status, range_header))
+        status, headers, body = request(server, 'GET', LINUX_PATH, {'Range': 'bytes=%d-' % size})
+        check(status == 416 and headers.get('content-range') == 'bytes */%d' % size, 'Unsatisfiable range was served')
+        check(request(server, 'GET', LINUX_PATH, {'Range': 'bytes=0-1,4-5'})[2] == LINUX_SYMBOLS,
+              'Multiple ranges were not answered with the whole file')
+        check(request(server, 'GET', LINUX_PATH, {'Range': 'bytes=0-5', 'If-Range': '"stale"'})[2] == LINUX_SYMBOLS,
+              'Range of a changed file was served')
+        print('Range requests OK')
+
+        # concurrent fetchers are served at once
+        results = []
+        def fetch(index):
+            cache_dir = os.path.join(temp_dir, 'cache%d' % index)
+            results.append(run([FETCH_SYMBOLS_PATH, '--cache-dir', cache_dir, '-s', server.url,
+                                'test_app', '0123456789ABCDEF0']))
+        threads = [threading.Thread(target=fetch, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        check(len(results) == 8 and all(result[:2] == (0, LINUX_SYMBOLS) for result in results),
+              'Concurrent fetches failed')
+        print('Concurrent fetches OK')
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
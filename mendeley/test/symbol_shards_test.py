@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Tests that symbol files trimmed to the shards covering a minidump's
+# addresses resolve those addresses as the full symbol files do.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import minidump_reader
+import symbol_file
+import symbol_shards
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src', 'processor', 'testdata')
+
+SYMBOL_FILE = '\n'.join([
+    'MODULE Linux x86 0123456789ABCDEF0 app',
+    'INFO CODE_ID 0123456789ABCDEF',
+    'FILE 1 a.cc',
+    'FILE 2 b.cc',
+    'PUBLIC 100 0 public_low',
+    'FUNC 1000 20 0 first',
+    '1000 10 5 1',
+    '1010 10 6 2',
+    'FUNC 1010 10 0 overlapping',
+    '1010 10 7 1',
+    'FUNC 2000 10 0 second',
+    '2000 10 8 2',
+    'PUBLIC 3000 0 public_high',
+    'STACK CFI INIT 1000 20 .cfa: $esp 4 +',
+    'STACK CFI 1004 .cfa: $esp 8 +',
+    'STACK WIN 4 2000 10 0 0 0 0 0 0 1 $eip 4 +',
+    '']) + ''.join('FUNC %x 10 0 filler%d\n' % (address, address) for address in range(0x10000, 0x20000, 0x10))
+
+def check(condition, message):
+    if not condition:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+
+def lookups(path, addresses):
+    symbols = symbol_file.SymbolFile(path)
+    try:
+        results = []
+        for address in addresses:
+            info = symbols.lookup(address)
+            results += [info and (info.function, info.function_base, info.source_file, info.line)]
+        return results
+    finally:
+        symbols.close()
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        trimmed_path = os.path.join(temp_dir, 'trimmed.sym')
+
+        index, shards = symbol_shards.build_shards(SYMBOL_FILE, 1024)
+        check(len(shards) > 10, 'Symbol file was not sharded')
+        check(all(shard.startswith('MODULE Linux x86 0123456789ABCDEF0 app\n') for shard in shards),
+              'Shard without a MODULE record')
+        parsed = symbol_shards.ShardIndex.parse(index.format())
+        check(parsed.header == index.header and
+              [tuple(getattr(shard, name) for name in shard.__slots__) for shard in parsed.shards] ==
+              [tuple(getattr(shard, name) for name in shard.__slots__) for shard in index.shards],
+              'Shard index was not read back')
+
+        # the overlapping function is dropped, as when loading the full
+        # symbol file
+        addresses = [0x1005, 0x1012, 0x2008, 0x3004]
+        trimmed = symbol_shards.trim(SYMBOL_FILE, addresses, 1024)
+        check(len(trimmed) < len(SYMBOL_FILE) / 10, 'Symbol file was not trimmed')
+        check('overlapping' not in trimmed, 'Overlapping function was kept')
+        check('STACK CFI 1004 .cfa: $esp 8 +\n' in trimmed and 'STACK WIN 4 2000' in trimmed, 'Stack records were not kept')
+        check(trimmed.startswith('MODULE Linux x86 0123456789ABCDEF0 app\nINFO CODE_ID 0123456789ABCDEF\n'),
+              'Trimmed symbol file has no header')
+        with open(trimmed_path, 'wb') as trimmed_file:
+            trimmed_file.write(trimmed)
+        check(lookups(trimmed_path, addresses) == [('first', 0x1000, 'a.cc', 5), ('first', 0x1000, 'b.cc', 6),
+                                                  ('second', 0x2000, 'b.cc', 8), ('public_high', 0x3000, None, None)],
+              'Unexpected lookups %s' % lookups(trimmed_path, addresses))
+
+        # the nearest PUBLIC symbol is kept however far below the address
+        with open(trimmed_path, 'wb') as trimmed_file:
+            trimmed_file.write(symbol_shards.trim(SYMBOL_FILE, [0x500], 1024))
+        check(lookups(trimmed_path, [0x500]) == [('public_low', 0x100, None, None)], 'Distant PUBLIC symbol was not kept')
+        print('Trim symbol file OK')
+
+        # the addresses a minidump refers to should resolve as in the
+        # full symbol file
+        module_addresses = minidump_reader.read_module_addresses(os.path.join(TESTDATA_DIR, 'minidump2.dmp'))
+        check(sorted(module_addresses.keys()) ==
+              [('dbghelp.pdb', '39559573E21B46F28E286923BE9E6A761'), ('kernel32.pdb', 'BCE8785C57B44245A669896B6A19B9542'),
+               ('msvcrt.pdb', 'A678F3C30DED426B839032B996987E381'), ('ntdll.pdb', '36515FB5D04345E491F672FA2E2878C02'),
+               ('psapi.pdb', 'A5C3A1F9689F43D8AD228A09293889702'), ('test_app.pdb', '5A9832E5287241C1838ED98914E9B7FF1')],
+              'Unexpected modules %s' % sorted(module_addresses.keys()))
+        for debug_file, debug_id in [('test_app.pdb', '5A9832E5287241C1838ED98914E9B7FF1'),
+                                     ('kernel32.pdb', 'BCE8785C57B44245A669896B6A19B9542')]:
+            symbol_path = os.path.join(TESTDATA_DIR, 'symbols', debug_file, debug_id, debug_file[:-4] + '.sym')
+            with open(symbol_path, 'rb') as symbols:
+                symbol_data = symbols.read()
+            addresses = module_addresses[(debug_file, debug_id)]
+            trimmed = symbol_shards.trim(symbol_data, addresses, 4096)
+            check(len(trimmed) < len(symbol_data) / 2, 'Symbols for %s were not trimmed' % debug_file)
+            with open(trimmed_path, 'wb') as trimmed_file:
+                trimmed_file.write(trimmed)
+            addresses = [address - offset for address in addresses for offset in range(symbol_shards.ADDRESS_SLACK + 1)]
+            check(lookups(trimmed_path, addresses) == lookups(symbol_path, addresses),
+                  'Trimmed symbols for %s resolve differently' % debug_file)
+        print('Trim minidump symbols OK')
+
+        # invalid symbol files should be rejected
+        for data in ['FUNC 1000 10 0 main\n', 'MODULE Linux x86 0 app\n1000 10 1 1\n',
+                     'MODULE Linux x86 0 app\nPUBLIC 10 0 a\nPUBLIC 10 0 b\n',
+                     'MODULE Linux x86 0 app\nSTACK CFI 1000 .cfa: $esp 4 +\n']:
+            try:
+                symbol_shards.build_shards(data)
+                check(False, 'Invalid symbol file was sharded: %r' % data)
+            except symbol_shards.SymbolShardsError:
+                pass
+        print('Invalid symbol files OK')
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""Upload the symbol files written by dump_syms to a symbol server.
+
+Each '.sym' file given, or found in the directories given, is uploaded
+with a PUT request to '<server>/<debug file>/<debug id>/<name>.sym',
+the path fetch-symbols.py requests, which is read from the file's
+MODULE record. This works with servers started with
+'serve-symbols.py --allow-upload' or others accepting PUT uploads.
+
+Files are uploaded in parallel over kept-alive connections and are
+compressed with gzip on the way unless --no-gzip is given. Since a
+debug ID identifies the build of a binary, symbol files which already
+exist on the server are skipped unless --force is given.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gzip
+import itertools
+import multiprocessing.pool
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+import symbol_http
+import symbol_server
+
+# Default number of files to upload at once
+DEFAULT_UPLOAD_JOBS = 8
+
+# Default length of time in seconds to wait for the server to respond
+DEFAULT_REQUEST_TIMEOUT = 60
+
+UPLOADED = 'uploaded'
+EXISTS = 'exists'
+FAILED = 'failed'
+
+def find_symbol_files(paths):
+    """ Returns the .sym files given in 'paths' or found in directories in
+    'paths'
+    """
+    symbol_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            symbol_files += [path]
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            # the shards written by shard-symbols.py are not uploaded
+            dir_names[:] = sorted(name for name in dir_names if not name.endswith('.shards'))
+            symbol_files += [os.path.join(dir_path, name) for name in sorted(file_names) if name.endswith('.sym')]
+    return symbol_files
+
+class Uploader:
+    """ Uploads symbol files to 'server_url' using the connection pool
+    'http', which may be shared between threads.
+    """
+    def __init__(self, http, server_url, compress=True, force=False):
+        self.http = http
+        self.server_url = server_url.rstrip('/')
+        self.compress = compress
+        self.force = force
+        self.lock = threading.Lock()
+        self.uploaded_bytes = 0
+
+    def upload(self, symbol_path):
+        """ Upload a symbol file. Returns an (outcome, server path,
+        message) tuple, where outcome is UPLOADED, EXISTS or FAILED.
+        """
+        try:
+            with open(symbol_path, 'rb') as symbol_file:
+                path = symbol_server.symbol_file_path(symbol_file.readline())
+                if not path:
+                    return (FAILED, None, 'no MODULE record')
+                url = '%s/%s' % (self.server_url, urllib2.quote(path))
+                # a HEAD request avoids sending files the server already
+                # has, and 'If-None-Match' covers concurrent uploads
+                if not self.force and self.http.head(url) == 200:
+                    return (EXISTS, path, None)
+                symbol_file.seek(0)
+                body = symbol_file
+                headers = {}
+                if self.compress:
+                    body = self._compress(symbol_file)
+                    headers['Content-Encoding'] = 'gzip'
+                try:
+                    body.seek(0, os.SEEK_END)
+                    headers['Content-Length'] = str(body.tell())
+                    if not self.force:
+                        headers['If-None-Match'] = '*'
+                    try:
+                        response = self.http.put(url, body, headers)
+                    except symbol_http.HTTPError as err:
+                        if err.status == 412:
+                            return (EXISTS, path, None)
+                        return (FAILED, path, str(err))
+                    response.read()
+                    with self.lock:
+                        self.uploaded_bytes += int(headers['Content-Length'])
+                finally:
+                    if body is not symbol_file:
+                        body.close()
+        except (IOError, OSError) + symbol_http.CONNECTION_ERRORS as err:
+            return (FAILED, None, str(err))
+        return (UPLOADED, path, None)
+
+    def _compress(self, symbol_file):
+        compressed = tempfile.TemporaryFile()
+        gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=symbol_server.COMPRESSION_LEVEL)
+        while True:
+            data = symbol_file.read(symbol_server.CHUNK_SIZE)
+            if not data:
+                break
+            gzip_file.write(data)
+        gzip_file.close()
+        return compressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload symbol files written by dump_syms to a symbol server')
+    parser.add_argument('server_url', type=str, help='Base URL of the symbol server')
+    parser.add_argument('paths', type=str, nargs='+',
+      help='Symbol files, or directories of dump_syms output, to search for .sym files')
+    parser.add_argument('-j', '--jobs', type=int, action='store', dest='jobs', default=DEFAULT_UPLOAD_JOBS,
+      help='Number of files to upload at once (default: %d)' % DEFAULT_UPLOAD_JOBS)
+    parser.add_argument('-t', type=float, action='store', dest='timeout', default=DEFAULT_REQUEST_TIMEOUT,
+      help='Number of seconds to wait for a response from the server (default: %d)' % DEFAULT_REQUEST_TIMEOUT)
+    parser.add_argument('-f', '--force', action='store_true', dest='force',
+      help='Replace symbol files which already exist on the server')
+    parser.add_argument('--no-gzip', action='store_false', dest='compress',
+      help='Upload symbol files uncompressed')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    symbol_paths = find_symbol_files(args.paths)
+    http = symbol_http.ConnectionPool(timeout=args.timeout, max_idle_connections=args.jobs)
+    uploader = Uploader(http, args.server_url, args.compress, args.force)
+    pool = multiprocessing.pool.ThreadPool(args.jobs)
+    start_time = time.time()
+    counts = {UPLOADED: 0, EXISTS: 0, FAILED: 0}
+    try:
+        results = pool.imap(uploader.upload, symbol_paths)
+        for symbol_path, (outcome, path, message) in itertools.izip(symbol_paths, results):
+            counts[outcome] += 1
+            if outcome == UPLOADED:
+                print('Uploaded %s to %s' % (symbol_path, path))
+            elif outcome == EXISTS:
+                print('Skipped %s, %s already exists' % (symbol_path, path))
+            else:
+                print('Unable to upload %s: %s' % (symbol_path, message), file=sys.stderr)
+    finally:
+        pool.close()
+        pool.join()
+        http.close()
+
+    print('%d uploaded (%d bytes) in %.2fs, %d already present, %d failed' %
+          (counts[UPLOADED], uploader.uploaded_bytes, time.time() - start_time, counts[EXISTS], counts[FAILED]),
+          file=sys.stderr)
+    if counts[FAILED]:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
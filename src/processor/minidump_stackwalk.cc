@@ -44,6 +44,7 @@
 #include "google_breakpad/processor/call_stack.h"
 #include "google_breakpad/processor/code_module.h"
 #include "google_breakpad/processor/code_modules.h"
+#include "google_breakpad/processor/fast_source_line_resolver.h"
 #include "google_breakpad/processor/minidump.h"
 #include "google_breakpad/processor/minidump_processor.h"
 #include "google_breakpad/processor/process_state.h"
@@ -63,11 +64,13 @@ using google_breakpad::CallStack;
 using google_breakpad::CodeModule;
 using google_breakpad::CodeModules;
 using google_breakpad::ExternalSymbolSupplier;
+using google_breakpad::FastSourceLineResolver;
 using google_breakpad::MinidumpModule;
 using google_breakpad::MinidumpProcessor;
 using google_breakpad::PathnameStripper;
 using google_breakpad::ProcessState;
 using google_breakpad::scoped_ptr;
+using google_breakpad::SourceLineResolverInterface;
 using google_breakpad::SimpleSymbolSupplier;
 using google_breakpad::StackFrame;
 using google_breakpad::StackFramePPC;
@@ -514,10 +517,15 @@ static void PrintProcessStateMachineReadable(const ProcessState& process_state)
 // information if the minidump was produced as a result of a crash, and
 // call stacks for each thread contained in the minidump.  All information
 // is printed to stdout.
+//
+// If |serialized_symbols| is true, symbols are expected in the serialized
+// form produced by ModuleSerializer and are loaded with
+// FastSourceLineResolver, rather than parsed from text symbol files.
 static bool PrintMinidumpProcess(const string &minidump_file,
                                  const vector<string> &symbol_paths,
                                  bool machine_readable,
-                                 const string& symbol_fetch_command) {
+                                 const string& symbol_fetch_command,
+                                 bool serialized_symbols) {
   scoped_ptr<SymbolSupplier> symbol_supplier;
   if (!symbol_fetch_command.empty()) {
     symbol_supplier.reset(new ExternalSymbolSupplier(symbol_fetch_command));
@@ -526,8 +534,13 @@ static bool PrintMinidumpProcess(const string &minidump_file,
     symbol_supplier.reset(new SimpleSymbolSupplier(symbol_paths));
   }
 
-  BasicSourceLineResolver resolver;
-  MinidumpProcessor minidump_processor(symbol_supplier.get(), &resolver);
+  scoped_ptr<SourceLineResolverInterface> resolver;
+  if (serialized_symbols) {
+    resolver.reset(new FastSourceLineResolver());
+  } else {
+    resolver.reset(new BasicSourceLineResolver());
+  }
+  MinidumpProcessor minidump_processor(symbol_supplier.get(), resolver.get());
 
   // Process the minidump.
   ProcessState process_state;
@@ -549,9 +562,10 @@ static bool PrintMinidumpProcess(const string &minidump_file,
 }  // namespace
 
 static void usage(const char *program_name) {
-  fprintf(stderr, "usage: %s [-m] [-e <symbol-fetch-command>] <minidump-file> [symbol-path ...]\n"
+  fprintf(stderr, "usage: %s [-m] [-f] [-e <symbol-fetch-command>] <minidump-file> [symbol-path ...]\n"
           "    -m : Output in machine-readable format\n"
-		  "    -e : Run <symbol-fetch-command> to fetch symbols for a file",
+		  "    -e : Run <symbol-fetch-command> to fetch symbols for a file\n"
+		  "    -f : Symbols are serialized for FastSourceLineResolver (see fetch-symbols.py --serialized)",
           program_name);
 }
 
@@ -565,6 +579,7 @@ int main(int argc, char **argv) {
 
   string minidump_file;
   bool machine_readable;
+  bool serialized_symbols = false;
   int symbol_path_arg;
   string symbol_fetch_command;
   std::vector<std::string> symbol_paths;
@@ -576,6 +591,8 @@ int main(int argc, char **argv) {
       return 0;
     } else if (arg == "-m") {
       machine_readable = true;
+    } else if (arg == "-f") {
+      serialized_symbols = true;
     } else if (arg == "-e") {
       ++i;
       if (i >= argc) {
@@ -600,5 +617,6 @@ int main(int argc, char **argv) {
   return PrintMinidumpProcess(minidump_file,
       symbol_paths,
       machine_readable,
-      symbol_fetch_command) ? 0 : 1;
+      symbol_fetch_command,
+      serialized_symbols) ? 0 : 1;
 }